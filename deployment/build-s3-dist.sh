@@ -119,19 +119,54 @@ function clean_up {
     find . -maxdepth 1 -not -name "*.py" -not -name "requirements.txt" -not -name "package.json" -not -name "package-lock.json" -not -name "." -not -name "*.js" -not -name "*.ndjson" -not -name "*.yaml"| xargs -I {} rm -rf {}
 }
 
+# the modules of $source_dir/common listed in COMMON_MODULES are copied into the function before it is zipped,
+# then removed, so every function ships the same version of the code it shares with the others
+function copy_common {
+    for module in $COMMON_MODULES; do
+        cp $source_dir/common/$module.py .
+    done
+}
+
+function remove_common {
+    for module in $COMMON_MODULES; do
+        rm -f $module.py
+    done
+    COMMON_MODULES=""
+}
+
 # a hack to skip building everything and just create the templates
 if [[ $skip != "true" ]] ; then
 
 echo "Building getCurrentAddress (from geofence-apis.template)"
 FUNCTION_NAME="getCurrentAddress"
+COMMON_MODULES="geohash geocodingCache hereClient"
 cd $source_dir/$FUNCTION_NAME
 if is_python; then
+    copy_common
     if [ -f "requirements.txt" ]; then
         pip install -r requirements.txt -t .
     fi
+    # offline gazetteer used when HERE is not available. The GeoNames export changes every day, so the build stops
+    # unless the files match the checksums pinned in geonames.sha256. GEONAMES_URL can point to a copy of the pinned
+    # snapshot, the GeoNames export by default. WITHOUT_GAZETTEER=true builds the function without it on purpose
+    geonames_url=${GEONAMES_URL:-"https://download.geonames.org/export/dump"}
+    if [[ $WITHOUT_GAZETTEER == "true" ]]; then
+        echo "WITHOUT_GAZETTEER is set, $FUNCTION_NAME is built without the offline gazetteer"
+    elif [ ! -f $template_dir/geonames.sha256 ]; then
+        echo "ERROR: no GeoNames checksums in $template_dir/geonames.sha256, pin a snapshot or set WITHOUT_GAZETTEER=true"
+        exit 1
+    elif curl -sSfO $geonames_url/cities15000.zip && curl -sSfO $geonames_url/admin1CodesASCII.txt && curl -sSfO $geonames_url/countryInfo.txt && sha256sum -c $template_dir/geonames.sha256; then
+        unzip -o cities15000.zip
+        python3 $source_dir/tools/buildGazetteer.py --cities cities15000.txt --admin1 admin1CodesASCII.txt --countries countryInfo.txt --output gazetteer.bin || exit 1
+    else
+        echo "ERROR: could not download from $geonames_url the GeoNames files matching geonames.sha256"
+        exit 1
+    fi
+    rm -f cities15000.zip cities15000.txt admin1CodesASCII.txt countryInfo.txt
     zip -9r $FUNCTION_NAME.zip . -x test_getCurrentAddress.py
     cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
     clean_up
+    remove_common
 elif [ -f "package.json" ]; then
     if [ -f "package-lock.json" ]; then 
         rm -rf package-lock.json
@@ -146,14 +181,17 @@ fi
 
 echo "Building getCoordsFromAddress (from geofence-apis.template)"
 FUNCTION_NAME="getCoordsFromAddress"
+COMMON_MODULES="geocodingCache hereClient rateLimiter geofenceSync"
 cd $source_dir/$FUNCTION_NAME
 if is_python; then
+    copy_common
     if [ -f "requirements.txt" ]; then
         pip install -r requirements.txt -t .
     fi
     zip -9r $FUNCTION_NAME.zip . -x test_getCoordsFromAddress.py
     cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
     clean_up
+    remove_common
 elif [ -f "package.json" ]; then
     if [ -f "package-lock.json" ]; then 
         rm -rf package-lock.json
@@ -190,14 +228,17 @@ fi
 
 echo "Building manageMessages (from geofence-apis.template)"
 FUNCTION_NAME="manageMessages"
+COMMON_MODULES="rateLimiter"
 cd $source_dir/$FUNCTION_NAME
 if is_python; then
+    copy_common
     if [ -f "requirements.txt" ]; then
         pip install -r requirements.txt -t .
     fi
     zip -9r $FUNCTION_NAME.zip . -x test_manageMessages.py
     cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
     clean_up
+    remove_common
 elif [ -f "package.json" ]; then
     if [ -f "package-lock.json" ]; then 
         rm -rf package-lock.json
@@ -232,16 +273,145 @@ else
     exit
 fi
 
+echo "Building searchGeofences (from geofence-apis.template)"
+FUNCTION_NAME="searchGeofences"
+COMMON_MODULES="geohash geofenceSync geofenceItems"
+cd $source_dir/$FUNCTION_NAME
+if is_python; then
+    copy_common
+    if [ -f "requirements.txt" ]; then
+        # numpy ships compiled code, so the wheels of the Lambda runtime are installed whatever the build machine
+        pip install -r requirements.txt -t . --platform manylinux2014_x86_64 --python-version 3.7 --only-binary=:all:
+    fi
+    zip -9r $FUNCTION_NAME.zip . -x test_searchGeofences.py
+    cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
+    clean_up
+    remove_common
+elif [ -f "package.json" ]; then
+    if [ -f "package-lock.json" ]; then 
+        rm -rf package-lock.json
+    fi
+    npm run build
+    cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
+    clean_up
+else
+    echo "Did not build the function $FUNCTION_NAME correctly"
+    exit
+fi
+
+echo "Building processGeofenceChanges (from geofence-apis.template)"
+FUNCTION_NAME="processGeofenceChanges"
+COMMON_MODULES="geohash geofenceSync"
+cd $source_dir/$FUNCTION_NAME
+if is_python; then
+    copy_common
+    if [ -f "requirements.txt" ]; then
+        pip install -r requirements.txt -t .
+    fi
+    zip -9r $FUNCTION_NAME.zip . -x test_processGeofenceChanges.py
+    cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
+    clean_up
+    remove_common
+elif [ -f "package.json" ]; then
+    if [ -f "package-lock.json" ]; then 
+        rm -rf package-lock.json
+    fi
+    npm run build
+    cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
+    clean_up
+else
+    echo "Did not build the function $FUNCTION_NAME correctly"
+    exit
+fi
+
+echo "Building importGeofences (from geofence-apis.template)"
+FUNCTION_NAME="importGeofences"
+COMMON_MODULES="hereClient"
+cd $source_dir/$FUNCTION_NAME
+if is_python; then
+    copy_common
+    if [ -f "requirements.txt" ]; then
+        pip install -r requirements.txt -t .
+    fi
+    zip -9r $FUNCTION_NAME.zip . -x test_importGeofences.py
+    cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
+    clean_up
+    remove_common
+elif [ -f "package.json" ]; then
+    if [ -f "package-lock.json" ]; then 
+        rm -rf package-lock.json
+    fi
+    npm run build
+    cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
+    clean_up
+else
+    echo "Did not build the function $FUNCTION_NAME correctly"
+    exit
+fi
+
+echo "Building exportGeofences (from geofence-apis.template)"
+FUNCTION_NAME="exportGeofences"
+COMMON_MODULES="geofenceItems"
+cd $source_dir/$FUNCTION_NAME
+if is_python; then
+    copy_common
+    if [ -f "requirements.txt" ]; then
+        pip install -r requirements.txt -t .
+    fi
+    zip -9r $FUNCTION_NAME.zip . -x test_exportGeofences.py
+    cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
+    clean_up
+    remove_common
+elif [ -f "package.json" ]; then
+    if [ -f "package-lock.json" ]; then 
+        rm -rf package-lock.json
+    fi
+    npm run build
+    cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
+    clean_up
+else
+    echo "Did not build the function $FUNCTION_NAME correctly"
+    exit
+fi
+
+echo "Building buildGeofenceSnapshot (from geofence-apis.template)"
+FUNCTION_NAME="buildGeofenceSnapshot"
+COMMON_MODULES="geofenceSync"
+cd $source_dir/$FUNCTION_NAME
+if is_python; then
+    copy_common
+    if [ -f "requirements.txt" ]; then
+        pip install -r requirements.txt -t .
+    fi
+    zip -9r $FUNCTION_NAME.zip . -x test_buildGeofenceSnapshot.py
+    cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
+    clean_up
+    remove_common
+elif [ -f "package.json" ]; then
+    if [ -f "package-lock.json" ]; then 
+        rm -rf package-lock.json
+    fi
+    npm run build
+    cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
+    clean_up
+else
+    echo "Did not build the function $FUNCTION_NAME correctly"
+    exit
+fi
+
 echo "Building indexDdbDataToEs (from geofence-analytics.template)"
 FUNCTION_NAME="indexDdbDataToEs"
+COMMON_MODULES="geofenceItems"
 cd $source_dir/$FUNCTION_NAME
 if is_python; then
+    copy_common
     if [ -f "requirements.txt" ]; then
         pip install -r requirements.txt -t .
     fi
-    zip -9r $FUNCTION_NAME.zip .
+    zip -9r $FUNCTION_NAME.zip . -x test_indexDdbDataToEs.py
     cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
     clean_up
+    remove_common
 elif [ -f "package.json" ]; then
     if [ -f "package-lock.json" ]; then 
         rm -rf package-lock.json
@@ -275,7 +445,7 @@ if is_python; then
     if [ -f "requirements.txt" ]; then
         pip install -r requirements.txt -t .
     fi
-    zip -9r $FUNCTION_NAME.zip .
+    zip -9r $FUNCTION_NAME.zip . -x test_lambdaDeploy.py
     cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
     clean_up
 elif [ -f "package.json" ]; then
@@ -294,7 +464,7 @@ if is_python; then
     if [ -f "requirements.txt" ]; then
         pip install -r requirements.txt -t .
     fi
-    zip -9r $FUNCTION_NAME.zip .
+    zip -9r $FUNCTION_NAME.zip . -x test_websiteDeploy.py
     cp ./$FUNCTION_NAME.zip $build_dist_dir/$FUNCTION_NAME.zip
     clean_up
 elif [ -f "package.json" ]; then
@@ -326,6 +496,11 @@ else
     exit
 fi
 cp ./$WEBSITE.zip $build_dist_dir/$WEBSITE.zip
+# hash of the built files, so a change of the website alone updates the website custom resource
+WEBSITE_HASH=$(cd build && find . -type f | LC_ALL=C sort | xargs sha256sum | sha256sum | cut -c1-16)
+replace="s/%%WEBSITE_HASH%%/$WEBSITE_HASH/g"
+echo "sed -i '' -e $replace $template_dist_dir/website-stack.template"
+sed -i '' -e $replace $template_dist_dir/website-stack.template
 rm -rf node_modules && rm -rf build && rm -rf $WEBSITE.zip
 
 fi 
@@ -50,7 +50,8 @@ function executeUnitTests {
     pip install $DEPENDENCY
   fi
   
-  python -m unittest
+  # the modules shared by the functions are imported from the common folder
+  PYTHONPATH=$source_dir/common python -m unittest
   clean_up
 }
 
@@ -59,3 +60,11 @@ executeUnitTests getCoordsFromAddress
 executeUnitTests cognitoPosConfirmation moto
 executeUnitTests manageMessages
 executeUnitTests sendMessage
+executeUnitTests searchGeofences
+executeUnitTests processGeofenceChanges
+executeUnitTests importGeofences
+executeUnitTests exportGeofences
+executeUnitTests buildGeofenceSnapshot
+executeUnitTests indexDdbDataToEs
+executeUnitTests lambda-custom-resource
+executeUnitTests website-custom-resource
@@ -0,0 +1,290 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge,
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+"""
+Cold start benchmark of the Lambda functions of the solution.
+
+Every handler module in source/ is imported in a fresh Python process, as in a new Lambda container, then invoked once
+with a representative event. The AWS API and ElasticSearch calls are answered locally with canned responses, so no AWS
+account or network access is needed, and the heavy dependencies loaded by the first invocation (ElasticSearch, herepy, numpy) are
+reported. The median of the runs is compared to the cold start budget, and the script exits with an error when a
+function goes over it. Run it from this folder:
+
+    python benchmark_coldStart.py --runs 5 --import-budget 500 --invocation-budget 500
+"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+source_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+heavy_modules = ['elasticsearch', 'requests_aws4auth', 'herepy', 'numpy']
+
+cached_address = {
+  'street': 'some_address',
+  'city': 'some_city',
+  'state': 'some_state',
+  'country': 'some_country_code',
+  'latitude': -11.1234567,
+  'longitude': -99.0987654
+}
+
+geofence_image = {
+  'id': {'S': 'some-geofence'},
+  'name': {'S': 'some_name'},
+  'latitude': {'N': '-11.1234567'},
+  'longitude': {'N': '-99.0987654'},
+  'address': {'S': 'some_address'},
+  'city': {'S': 'some_city'},
+  'state': {'S': 'some_state'},
+  'visits': {'N': '0'}
+}
+
+polygon_geofence = {
+  'id': 'some-polygon',
+  'name': 'some_polygon',
+  'latitude': -11.1234567,
+  'longitude': -99.0987654,
+  'polygon': [
+    {'latitude': -11.12, 'longitude': -99.10},
+    {'latitude': -11.12, 'longitude': -99.09},
+    {'latitude': -11.13, 'longitude': -99.09},
+    {'latitude': -11.13, 'longitude': -99.10}
+  ]
+}
+
+# the handlers with their environment, the event of their first invocation, the canned AWS responses by operation, an
+# error code being raised as the error of the operation, and the canned ElasticSearch responses by request, a list being
+# answered in order. A handler measured in several configurations names its folder. The handlers without an event are
+# only imported: the custom resources answer CloudFormation through a presigned URL and importGeofences reads its file
+# from S3.
+handlers = {
+  'buildGeofenceSnapshot': {
+    'env': {'SNAPSHOT_BUCKET': 'some-bucket', 'SNAPSHOT_KEY': 'geofences.bin', 'SYNC_TABLE_NAME': 'some-sync-table'},
+    'event': {},
+    'responses': {'GetObject': 'NoSuchKey', 'Query': {'Items': []}}
+  },
+  'cognitoPosConfirmation': {
+    'event': {'userPoolId': 'some-user-pool', 'userName': 'some-user', 'request': {'userAttributes': {}}}
+  },
+  'exportGeofences': {
+    'env': {'DBB_TABLE_NAME': 'some-table', 'EXPORT_BUCKET': 'some-bucket', 'TOTAL_SEGMENTS': '1'},
+    'event': {},
+    'responses': {'Scan': {'Items': [geofence_image]}, 'CreateMultipartUpload': {'UploadId': 'some-upload'}, 'UploadPart': {'ETag': '"some-etag"'}}
+  },
+  'getCoordsFromAddress': {
+    'env': {'DBB_TABLE_NAME': 'some-table', 'GEOCODING_CACHE_TABLE': 'some-cache-table', 'HERE_API_KEY': 'benchmark-key'},
+    'event': {'operation': 'getCoordsFromAddress', 'arguments': {'address': 'some address'}},
+    'responses': {'GetItem': {'Item': {'value': {'S': json.dumps(cached_address)}, 'expiresAt': {'N': '9999999999'}}}}
+  },
+  'getCurrentAddress': {
+    'env': {'GEOCODING_CACHE_TABLE': 'some-cache-table', 'HERE_API_KEY': 'benchmark-key'},
+    'event': {'arguments': {'coordinates': {'latitude': -11.1234567, 'longitude': -99.0987654}}},
+    'responses': {'GetItem': {'Item': {'value': {'S': json.dumps(cached_address)}, 'expiresAt': {'N': '9999999999'}}}}
+  },
+  'importGeofences': {
+    'env': {'DBB_TABLE_NAME': 'some-table', 'HERE_API_KEY': 'benchmark-key'}
+  },
+  'indexDdbDataToEs': {
+    'env': {'REGION': 'us-east-1', 'ES_HOST': 'localhost'},
+    'event': {'Records': [{'eventName': 'INSERT', 'dynamodb': {'Keys': {'id': {'S': 'some-geofence'}}, 'NewImage': geofence_image}}]},
+    'es_responses': {
+      'GET /': {'cluster_name': 'benchmark', 'version': {'number': '7.4.2'}},
+      'PUT /index-geofences/_doc/some-geofence': {'_id': 'some-geofence', 'result': 'created'}
+    }
+  },
+  'manageMessages': {
+    'event': {'operation': 'getMessage', 'arguments': {'template': 'some-geofence'}},
+    'responses': {'GetPushTemplate': {'PushNotificationTemplateResponse': {'Default': {'Title': 'some_title', 'Body': 'some_body'}}}}
+  },
+  'processGeofenceChanges': {
+    'env': {'DBB_TABLE_NAME': 'some-table', 'SYNC_TABLE_NAME': 'some-sync-table'},
+    'event': {'Records': [{'eventName': 'REMOVE', 'dynamodb': {'Keys': {'id': {'S': 'some-geofence'}}, 'OldImage': geofence_image}}]},
+    'responses': {'UpdateItem': {'Attributes': {'currentVersion': {'N': '1'}}}}
+  },
+  'searchGeofences': {
+    'env': {'DBB_TABLE_NAME': 'some-table'},
+    'event': {'arguments': {'coordinates': {'latitude': -11.1234567, 'longitude': -99.0987654}, 'radius': 1000}},
+    'responses': {'Query': {'Items': []}}
+  },
+  'searchGeofences (ES)': {
+    'folder': 'searchGeofences',
+    'env': {'DBB_TABLE_NAME': 'some-table', 'REGION': 'us-east-1', 'ES_HOST': 'localhost'},
+    'event': {'arguments': {'coordinates': {'latitude': -11.1234567, 'longitude': -99.0987654}, 'radius': 1000}},
+    'es_responses': {
+      'POST /index-geofences/_search': [
+        {'hits': {'hits': [{'_id': 'some-geofence', '_source': {'id': 'some-geofence', 'name': 'some_name'}, 'sort': [12.5, 'some-geofence']}]}},
+        {'hits': {'hits': [{'_id': 'some-polygon', '_source': polygon_geofence}]}}
+      ]
+    }
+  },
+  'sendMessage': {
+    'env': {'DBB_TABLE_NAME': 'some-table'},
+    'event': {'arguments': {'input': {'applicationId': 'some-app', 'geofenceId': 'some-geofence', 'userId': 'some-user'}}},
+    'responses': {'GetUserEndpoints': {'EndpointsResponse': {'Item': []}}}
+  },
+  'lambda-custom-resource': {
+    'module': 'lambdaDeploy'
+  },
+  'website-custom-resource': {
+    'module': 'websiteDeploy'
+  }
+}
+
+def stub_elasticsearch(es_responses):
+  """
+  Answers the requests of the ElasticSearch client with the canned responses once the client is imported, so its import
+  is still measured as part of the first invocation.
+  """
+
+  import importlib.abc
+  import importlib.util
+
+  responses = {request: list(response) if isinstance(response, list) else [response] for request, response in es_responses.items()}
+
+  def perform_request(transport, method, url, headers = None, params = None, body = None):
+    canned = responses.get(f'{method} {url}', [{}])
+    return canned.pop(0) if len(canned) > 1 else canned[0]
+
+  class ElasticsearchFinder(importlib.abc.MetaPathFinder):
+    def find_spec(self, name, path, target = None):
+      if name != 'elasticsearch':
+        return None
+
+      sys.meta_path.remove(self)
+      spec = importlib.util.find_spec(name)
+      exec_module = spec.loader.exec_module
+
+      def exec_stubbed_module(module):
+        exec_module(module)
+        module.Transport.perform_request = perform_request
+
+      spec.loader.exec_module = exec_stubbed_module
+      return spec
+
+  sys.meta_path.insert(0, ElasticsearchFinder())
+
+def run_handler(name):
+  """
+  Imports and invokes the handler in this process, then prints the timings as a JSON line. Only called in the child
+  processes, one per run.
+  """
+
+  spec = handlers[name]
+  folder = spec.get('folder', name)
+  os.environ.update({
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'benchmark',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+    'REGION': 'us-east-1'
+  })
+  os.environ.update(spec.get('env', {}))
+  sys.path[:0] = [os.path.join(source_folder, folder), os.path.join(source_folder, 'common')]
+
+  result = {}
+
+  with contextlib.redirect_stdout(io.StringIO()):
+    started = time.perf_counter()
+    module = importlib.import_module(spec.get('module', folder))
+    result['import'] = (time.perf_counter() - started) * 1000
+
+    if 'event' in spec:
+      import botocore.client
+      responses = spec.get('responses', {})
+
+      def make_api_call(client, operation_name, api_params):
+        response = responses.get(operation_name, {})
+        if isinstance(response, str):
+          raise client.exceptions.from_code(response)({'Error': {'Code': response, 'Message': response}}, operation_name)
+        return response
+
+      botocore.client.BaseClient._make_api_call = make_api_call
+
+      if 'es_responses' in spec:
+        stub_elasticsearch(spec['es_responses'])
+
+      started = time.perf_counter()
+      try:
+        module.handler(spec['event'], None)
+        result['status'] = 'ok'
+      except Exception as ex:
+        result['status'] = f'{type(ex).__name__}: {ex}'
+      result['invocation'] = (time.perf_counter() - started) * 1000
+
+  result['heavy'] = [name for name in heavy_modules if name in sys.modules]
+  print(json.dumps(result))
+
+def measure(name, runs):
+  """
+  Runs the handler in runs fresh processes and returns the median timings of the runs.
+  """
+
+  results = []
+  for _ in range(runs):
+    output = subprocess.run(
+      [sys.executable, os.path.abspath(__file__), '--child', name],
+      check = True,
+      capture_output = True,
+      text = True
+    ).stdout
+    results.append(json.loads(output.strip().splitlines()[-1]))
+
+  return {
+    'import': statistics.median(result['import'] for result in results),
+    'invocation': statistics.median(result['invocation'] for result in results) if 'invocation' in results[0] else None,
+    'status': results[-1].get('status', 'import only'),
+    'heavy': results[-1]['heavy']
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Cold start benchmark of the Lambda functions')
+  parser.add_argument('--runs', type = int, default = 5)
+  parser.add_argument('--import-budget', type = float, default = 500, help = 'budget of the handler import in milliseconds')
+  parser.add_argument('--invocation-budget', type = float, default = 500, help = 'budget of the first invocation in milliseconds')
+  parser.add_argument('--child', help = argparse.SUPPRESS)
+  parser.add_argument('names', nargs = '*', help = 'handlers to measure, all of them by default')
+  args = parser.parse_args()
+
+  if args.child:
+    run_handler(args.child)
+    return
+
+  over_budget = []
+  print(f"{'function':28} {'import':>10} {'1st call':>10}   heavy modules loaded / status")
+
+  for name in args.names or handlers:
+    timings = measure(name, args.runs)
+    invocation = '-' if timings['invocation'] is None else f"{timings['invocation']:7.1f} ms"
+    print(f"{name:28} {timings['import']:7.1f} ms {invocation:>10}   {', '.join(timings['heavy']) or '-'} / {timings['status']}")
+
+    if timings['import'] > args.import_budget or (timings['invocation'] or 0) > args.invocation_budget:
+      over_budget.append(name)
+
+  if over_budget:
+    print(f"Over the cold start budget: {', '.join(over_budget)}")
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,111 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Benchmark of the polygon geofence engine used by the searchGeofences function.
+
+Generates random polygon geofences around a city and measures how long it takes to locate a device against all of
+them, compared with a plain Python ray casting loop. Run it from this folder:
+
+    python benchmark_geofencePolygons.py --polygons 5000 --vertices 12
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'searchGeofences'))
+
+import geofencePolygons
+
+def create_polygons(count, vertices, latitude, longitude, spread, seed):
+  """
+  Returns random star shaped polygons of about 100 to 500 meters spread over a square of the given size in degrees.
+  """
+
+  generator = random.Random(seed)
+  polygons = []
+
+  for number in range(count):
+    center_lat = latitude + generator.uniform(-spread, spread)
+    center_lon = longitude + generator.uniform(-spread, spread)
+    ring = []
+
+    for step in range(vertices):
+      angle = 2 * math.pi * step / vertices
+      radius = generator.uniform(100, 500) / 111320
+      ring.append((center_lat + radius * math.sin(angle), center_lon + radius * math.cos(angle) / math.cos(math.radians(center_lat))))
+
+    polygons.append((f'geofence-{number}', ring))
+
+  return polygons
+
+def contains_loop(polygons, latitude, longitude):
+  """
+  Plain Python ray casting, used as the baseline.
+  """
+
+  found = []
+
+  for geofence_id, ring in polygons:
+    inside = False
+    for (lat1, lon1), (lat2, lon2) in zip(ring, ring[1:] + ring[:1]):
+      if (lat1 > latitude) != (lat2 > latitude) and longitude < lon1 + (latitude - lat1) * (lon2 - lon1) / (lat2 - lat1):
+        inside = not inside
+    if inside:
+      found.append(geofence_id)
+
+  return found
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Benchmark of the polygon geofence engine')
+  parser.add_argument('--polygons', type = int, default = 5000)
+  parser.add_argument('--vertices', type = int, default = 12)
+  parser.add_argument('--spread', type = float, default = 0.05, help = 'half size in degrees of the area covered by the polygons')
+  parser.add_argument('--distance', type = float, default = 1000.0, help = 'max distance in meters used by locate')
+  parser.add_argument('--queries', type = int, default = 1000)
+  parser.add_argument('--seed', type = int, default = 7)
+  args = parser.parse_args()
+
+  latitude, longitude = 40.7128, -74.0060
+  polygons = create_polygons(args.polygons, args.vertices, latitude, longitude, args.spread, args.seed)
+
+  generator = random.Random(args.seed + 1)
+  queries = [(latitude + generator.uniform(-args.spread, args.spread), longitude + generator.uniform(-args.spread, args.spread)) for _ in range(args.queries)]
+
+  build_seconds = timeit.timeit(lambda: geofencePolygons.build_polygon_index(polygons), number = 1)
+  index = geofencePolygons.build_polygon_index(polygons)
+
+  for lat, lon in queries[:50]:
+    assert sorted(geofencePolygons.find_containing(index, lat, lon)) == sorted(contains_loop(polygons, lat, lon))
+
+  contains_seconds = timeit.timeit(lambda: [geofencePolygons.find_containing(index, lat, lon) for lat, lon in queries], number = 1)
+  locate_seconds = timeit.timeit(lambda: [geofencePolygons.locate(index, lat, lon, args.distance) for lat, lon in queries], number = 1)
+  loop_queries = queries[:max(1, args.queries // 20)]
+  loop_seconds = timeit.timeit(lambda: [contains_loop(polygons, lat, lon) for lat, lon in loop_queries], number = 1)
+
+  print(f'{args.polygons} polygons of {args.vertices} vertices, {args.queries} queries')
+  print(f'build index:            {build_seconds * 1000:10.2f} ms')
+  print(f'find_containing:        {contains_seconds * 1000000 / len(queries):10.1f} us per query')
+  print(f'locate ({args.distance:.0f} m):        {locate_seconds * 1000000 / len(queries):10.1f} us per query')
+  print(f'python loop baseline:   {loop_seconds * 1000000 / len(loop_queries):10.1f} us per query')
+
+if __name__ == '__main__':
+  main()
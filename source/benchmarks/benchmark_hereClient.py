@@ -0,0 +1,136 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Latency benchmark of the HERE clients used by the geocoding functions, against a local stubbed HERE endpoint.
+
+Compares a herepy client created on every call (a new connection per request) with the container scoped client of
+hereClient (pooled keep-alive session), then shows the circuit breaker failing fast while the stub hangs past the read
+timeout. No HERE API key or network access is needed. Run it from this folder:
+
+    python benchmark_hereClient.py --requests 200 --latency 0.005
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+import herepy
+import requests
+import hereClient
+
+stub = {
+  'latency': 0.0
+}
+
+geocode_response = json.dumps({
+  'items': [{
+    'address': {
+      'label': 'some_address',
+      'city': 'some_city',
+      'state': 'some_state',
+      'countryCode': 'some_country_code'
+    },
+    'position': {
+      'lat': -11.1234567,
+      'lng': -99.0987654
+    }
+  }]
+}).encode('utf-8')
+
+class StubHandler(BaseHTTPRequestHandler):
+  """
+  Answers every request with the same geocoding response after the configured latency, keeping connections alive.
+  """
+
+  protocol_version = 'HTTP/1.1'
+  disable_nagle_algorithm = True
+
+  def do_GET(self):
+    time.sleep(stub['latency'])
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(geocode_response)))
+    self.end_headers()
+    self.wfile.write(geocode_response)
+
+  def log_message(self, format, *args):
+    pass
+
+def measure(label, count, function):
+  """
+  Calls the function count times and prints the mean and p99 latencies.
+  """
+
+  latencies = []
+  for _ in range(count):
+    started = time.perf_counter()
+    try:
+      function()
+    except Exception:
+      pass
+    latencies.append((time.perf_counter() - started) * 1000)
+
+  latencies.sort()
+  print(f'{label:40} mean {sum(latencies) / count:8.2f} ms   p99 {latencies[int(count * 0.99) - 1]:8.2f} ms')
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Latency benchmark of the HERE clients against a stubbed endpoint')
+  parser.add_argument('--requests', type = int, default = 200)
+  parser.add_argument('--latency', type = float, default = 0.005, help = 'stubbed upstream latency in seconds')
+  args = parser.parse_args()
+
+  server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+  threading.Thread(target = server.serve_forever, daemon = True).start()
+  base_url = f'http://127.0.0.1:{server.server_address[1]}/v1/geocode'
+
+  os.environ['HERE_API_KEY'] = 'benchmark-key'
+  os.environ['HERE_READ_TIMEOUT'] = '0.2'
+  os.environ['HERE_FAILURE_THRESHOLD'] = '3'
+  stub['latency'] = args.latency
+
+  def per_call_client():
+    # what the functions did before: a new client and a new connection on every invocation
+    herepy.geocoder_api.requests = requests
+    geocoder_api = herepy.GeocoderApi(os.environ['HERE_API_KEY'])
+    geocoder_api._base_url = base_url
+    return geocoder_api.free_form('some address')
+
+  def container_client():
+    geocoder_api = hereClient.get_client(herepy.GeocoderApi)
+    geocoder_api._base_url = base_url
+    return hereClient.call(geocoder_api.free_form, 'some address')
+
+  print(f'{args.requests} requests, stubbed upstream latency {args.latency * 1000:.1f} ms')
+  measure('herepy client per call', args.requests, per_call_client)
+  hereClient.get_session()
+  herepy.geocoder_api.requests = hereClient.session
+  measure('container client, keep-alive session', args.requests, container_client)
+
+  stub['latency'] = 1.0
+  measure('hanging upstream, breaker', 10, container_client)
+
+  server.shutdown()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,139 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Lambda function invoked on a schedule to publish the compact binary snapshot of all geofences.
+
+The snapshot is stored in an Amazon S3 bucket served by Amazon CloudFront, so clients and back-end services can bulk
+download every geofence in one small request. Each run loads the previous snapshot and applies only the changes recorded
+in the sync table (maintained from the DynamoDB stream) since the snapshot version, instead of scanning the geofences table.
+
+Once a day (FULL_REBUILD_HOURS) the snapshot is rebuilt from every item of the sync table instead, so a change missed by
+the incremental builds cannot stay out of the snapshot for good.
+"""
+
+import json
+import os
+import re
+import time
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+
+import geofenceSnapshot
+import geofenceSync
+
+radius_pattern = re.compile(r'^\s*RADIUS\s*:\s*\(\s*([0-9.]+)\s*\)\s*$', re.IGNORECASE)
+default_full_rebuild_hours = 24
+
+def handler(event, context):
+  """
+  Main handler function that brings the published snapshot up to date with the sync table.
+  """
+
+  print('Request: {}'.format(json.dumps(event)))
+
+  snapshot_bucket = os.environ['SNAPSHOT_BUCKET']
+  snapshot_key = os.environ['SNAPSHOT_KEY']
+  sync_table_name = os.environ['SYNC_TABLE_NAME']
+
+  s3_client = boto3.client('s3')
+  dbb_client = boto3.client('dynamodb')
+
+  version, geofences, rebuilt_at = load_snapshot(s3_client, snapshot_bucket, snapshot_key)
+
+  full_rebuild = time.time() - rebuilt_at > float(os.environ.get('FULL_REBUILD_HOURS', default_full_rebuild_hours)) * 3600
+  if full_rebuild:
+    print(f'Rebuilding snapshot version {version} from the whole sync table')
+    version, geofences, rebuilt_at = 0, {}, int(time.time())
+
+  changes = get_changes(dbb_client, sync_table_name, version)
+
+  if not changes and not full_rebuild:
+    print(f'Snapshot version {version} is up to date')
+    return f'Snapshot version {version} is up to date.'
+
+  version = apply_changes(geofences, changes, version)
+  snapshot = geofenceSnapshot.pack_snapshot(version, geofences)
+
+  s3_client.put_object(
+    Bucket = snapshot_bucket,
+    Key = snapshot_key,
+    Body = snapshot,
+    ContentType = 'application/octet-stream',
+    CacheControl = 'max-age=60',
+    Metadata = {
+      'snapshot-version': str(version),
+      'snapshot-rebuilt-at': str(rebuilt_at)
+    }
+  )
+
+  print(f'Snapshot version {version} with {len(geofences)} geofences ({len(snapshot)} bytes) published to {snapshot_bucket}/{snapshot_key}')
+  return f'Snapshot version {version} published.'
+
+def load_snapshot(s3_client, snapshot_bucket, snapshot_key):
+  """
+  Returns the version, the geofences and the time of the last full rebuild of the published snapshot, or version 0 and
+  no geofences if there is none yet.
+  """
+
+  try:
+    response_s3 = s3_client.get_object(
+      Bucket = snapshot_bucket,
+      Key = snapshot_key
+    )
+  except s3_client.exceptions.NoSuchKey:
+    print(f'No snapshot found in {snapshot_bucket}/{snapshot_key}. Building it from scratch...')
+    return 0, {}, int(time.time())
+
+  snapshot = geofenceSnapshot.read_snapshot(response_s3['Body'].read())
+  rebuilt_at = int(response_s3.get('Metadata', {}).get('snapshot-rebuilt-at', 0))
+  return snapshot['version'], geofenceSnapshot.unpack_geofences(snapshot), rebuilt_at
+
+def get_changes(dbb_client, sync_table_name, since_version):
+  """
+  Returns the settled sync table items with a version greater than the given one, in version order.
+  """
+
+  changes, _ = geofenceSync.query_changes(dbb_client, sync_table_name, since_version)
+  return changes
+
+def apply_changes(geofences, changes, version = 0):
+  """
+  Applies the sync table items to the geofences of the snapshot and returns the new snapshot version.
+  """
+
+  deserializer = TypeDeserializer()
+
+  for change in changes:
+    item = {k: deserializer.deserialize(v) for k, v in change.items()}
+    version = max(version, int(item['version']))
+
+    if item.get('deleted') or item.get('latitude') is None or item.get('longitude') is None:
+      geofences.pop(item['id'], None)
+    else:
+      geofences[item['id']] = (float(item['latitude']), float(item['longitude']), get_radius(item.get('definition')))
+
+  return version
+
+def get_radius(definition):
+  """
+  Returns the radius in meters of a 'RADIUS:(meters)' geofence definition, 0 for any other definition.
+  """
+
+  match = radius_pattern.match(definition or '')
+  return float(match.group(1)) if match else 0.0
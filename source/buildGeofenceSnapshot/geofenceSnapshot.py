@@ -0,0 +1,134 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Reader and writer of the compact binary geofence snapshot.
+
+The snapshot only depends on the Python standard library, so back-end services (a server-side hit detector, for example)
+can copy this module and load a snapshot with a single memoryview over the downloaded bytes, without parsing or copying
+the coordinates. All values are little-endian:
+
+  header        magic 'GEOF', format (uint16), flags (uint16), version (uint64), count (uint32), ids size (uint32)
+  latitudes     float32[count]
+  longitudes    float32[count]
+  radii         float32[count], in meters, 0 when the geofence is not a radius
+  id offsets    uint32[count + 1], offsets of each geofence id in the id dictionary
+  id dictionary utf-8 geofence ids, one after the other
+
+Geofences are sorted by id, so index i refers to the same geofence in every section.
+"""
+
+import struct
+import sys
+from array import array
+
+magic = b'GEOF'
+snapshot_format = 1
+header = struct.Struct('<4sHHQII')
+
+def pack_snapshot(version, geofences):
+  """
+  Packs the geofences, a dict of geofence id to (latitude, longitude, radius), into snapshot bytes.
+  """
+
+  ids = sorted(geofences)
+  latitudes = array('f', (geofences[geofence_id][0] for geofence_id in ids))
+  longitudes = array('f', (geofences[geofence_id][1] for geofence_id in ids))
+  radii = array('f', (geofences[geofence_id][2] for geofence_id in ids))
+
+  encoded_ids = [geofence_id.encode('utf-8') for geofence_id in ids]
+  id_dictionary = b''.join(encoded_ids)
+  offsets = array('I', [0])
+  for encoded_id in encoded_ids:
+    offsets.append(offsets[-1] + len(encoded_id))
+
+  if sys.byteorder != 'little':
+    for values in (latitudes, longitudes, radii, offsets):
+      values.byteswap()
+
+  return b''.join([
+    header.pack(magic, snapshot_format, 0, version, len(ids), len(id_dictionary)),
+    latitudes.tobytes(),
+    longitudes.tobytes(),
+    radii.tobytes(),
+    offsets.tobytes(),
+    id_dictionary
+  ])
+
+def read_snapshot(data):
+  """
+  Reads snapshot bytes and returns its version, count and sections.
+
+  On little-endian machines the float32 and uint32 sections are memoryviews over the given buffer, so no value is copied.
+  """
+
+  buffer = memoryview(data)
+  snapshot_magic, data_format, flags, version, count, ids_size = header.unpack_from(buffer, 0)
+
+  if snapshot_magic != magic or data_format != snapshot_format:
+    raise ValueError('Not a geofence snapshot or unsupported snapshot format')
+
+  offset = header.size
+  sections = {}
+
+  for name, typecode, length in (('latitudes', 'f', count), ('longitudes', 'f', count), ('radii', 'f', count), ('id_offsets', 'I', count + 1)):
+    size = length * 4
+    sections[name] = cast_section(buffer[offset:offset + size], typecode)
+    offset += size
+
+  if len(buffer) != offset + ids_size:
+    raise ValueError('Truncated geofence snapshot')
+
+  return {
+    'version': version,
+    'count': count,
+    'latitudes': sections['latitudes'],
+    'longitudes': sections['longitudes'],
+    'radii': sections['radii'],
+    'id_offsets': sections['id_offsets'],
+    'ids': buffer[offset:offset + ids_size]
+  }
+
+def cast_section(section, typecode):
+  """
+  Returns a little-endian section as a sequence of numbers, zero-copy when the machine is little-endian.
+  """
+
+  if sys.byteorder == 'little':
+    return section.cast(typecode)
+
+  values = array(typecode, section.tobytes())
+  values.byteswap()
+  return values
+
+def get_geofence_id(snapshot, index):
+  """
+  Returns the id of the geofence at the given index of a snapshot.
+  """
+
+  id_offsets = snapshot['id_offsets']
+  return bytes(snapshot['ids'][id_offsets[index]:id_offsets[index + 1]]).decode('utf-8')
+
+def unpack_geofences(snapshot):
+  """
+  Returns the snapshot as a dict of geofence id to (latitude, longitude, radius), used to apply changes to it.
+  """
+
+  return {
+    get_geofence_id(snapshot, index): (snapshot['latitudes'][index], snapshot['longitudes'][index], snapshot['radii'][index])
+    for index in range(snapshot['count'])
+  }
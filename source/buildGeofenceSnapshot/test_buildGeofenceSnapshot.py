@@ -0,0 +1,153 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+import unittest
+from unittest.mock import Mock, patch
+
+import os
+import io
+import json
+import time
+import geofenceSnapshot
+import geofenceSync
+import buildGeofenceSnapshot
+
+class TestBuildGeofenceSnapshot(unittest.TestCase):
+  """
+  Test class for the BuildGeofenceSnapshot function 
+  """
+
+  ENV_SNAPSHOT_BUCKET = 'SNAPSHOT_BUCKET'
+  SNAPSHOT_BUCKET = 'geofence-snapshot-bucket'
+  ENV_SNAPSHOT_KEY = 'SNAPSHOT_KEY'
+  SNAPSHOT_KEY = 'geofences.snapshot'
+  ENV_SYNC_TABLE_NAME = 'SYNC_TABLE_NAME'
+  SYNC_TABLE_NAME = 'geofence-sync-table'
+
+  def setUp(self):
+    """
+    Setting up the test case
+    """
+    os.environ[TestBuildGeofenceSnapshot.ENV_SNAPSHOT_BUCKET] = TestBuildGeofenceSnapshot.SNAPSHOT_BUCKET
+    os.environ[TestBuildGeofenceSnapshot.ENV_SNAPSHOT_KEY] = TestBuildGeofenceSnapshot.SNAPSHOT_KEY
+    os.environ[TestBuildGeofenceSnapshot.ENV_SYNC_TABLE_NAME] = TestBuildGeofenceSnapshot.SYNC_TABLE_NAME
+
+  def test_pack_and_read_snapshot(self):
+    """
+    Test when a snapshot is packed and read back
+    """
+
+    geofences = {
+      'geofence-b': (-11.5, -99.25, 0.0),
+      'geofence-á': (40.75, -73.5, 150.0)
+    }
+
+    snapshot = geofenceSnapshot.read_snapshot(geofenceSnapshot.pack_snapshot(12, geofences))
+
+    self.assertEqual(snapshot['version'], 12)
+    self.assertEqual(snapshot['count'], 2)
+    self.assertEqual(geofenceSnapshot.get_geofence_id(snapshot, 0), 'geofence-b')
+    self.assertEqual(list(snapshot['radii']), [0.0, 150.0])
+    self.assertEqual(geofenceSnapshot.unpack_geofences(snapshot), geofences)
+
+  @patch('boto3.client')
+  def test_apply_changes_to_published_snapshot(self, mock_client):
+    """
+    Test when the changes recorded since the published snapshot are applied to it
+    """
+
+    published = geofenceSnapshot.pack_snapshot(5, {
+      'geofence-1': (1.0, 2.0, 0.0),
+      'geofence-2': (3.0, 4.0, 0.0)
+    })
+
+    mock_client().get_object.return_value = {'Body': io.BytesIO(published), 'Metadata': {'snapshot-rebuilt-at': str(int(time.time()))}}
+    changes = [{
+      'id': {'S': 'geofence-1'},
+      'version': {'N': '6'},
+      'deleted': {'BOOL': True}
+    }, {
+      'id': {'S': 'geofence-3'},
+      'version': {'N': '7'},
+      'deleted': {'BOOL': False},
+      'latitude': {'N': '5.5'},
+      'longitude': {'N': '6.5'},
+      'definition': {'S': 'RADIUS:(100)'}
+    }]
+
+    def query(**query_args):
+      shard = query_args['ExpressionAttributeValues'][':syncGroup']['S']
+      return {'Items': [change for change in changes if geofenceSync.shard_key(int(change['version']['N'])) == shard]}
+
+    mock_client().query.side_effect = query
+
+    buildGeofenceSnapshot.handler({}, None)
+
+    self.assertEqual(mock_client().query.call_count, geofenceSync.sync_shards)
+    self.assertEqual(mock_client().query.call_args[1]['ExpressionAttributeValues'][':sinceVersion'], {'N': '5'})
+
+    snapshot = geofenceSnapshot.read_snapshot(mock_client().put_object.call_args[1]['Body'])
+    self.assertEqual(snapshot['version'], 7)
+    self.assertEqual(geofenceSnapshot.unpack_geofences(snapshot), {
+      'geofence-2': (3.0, 4.0, 0.0),
+      'geofence-3': (5.5, 6.5, 100.0)
+    })
+
+  @patch('boto3.client')
+  def test_full_rebuild_of_stale_snapshot(self, mock_client):
+    """
+    Test when the last full rebuild of the snapshot is too old, the snapshot is rebuilt from the whole sync table, which
+    brings back a change the incremental builds missed
+    """
+
+    published = geofenceSnapshot.pack_snapshot(8, {
+      'geofence-1': (1.0, 2.0, 0.0),
+      'geofence-2': (3.0, 4.0, 0.0)
+    })
+
+    mock_client().get_object.return_value = {'Body': io.BytesIO(published), 'Metadata': {'snapshot-rebuilt-at': '1600000000'}}
+
+    changes = [{
+      'id': {'S': 'geofence-1'},
+      'version': {'N': '3'},
+      'deleted': {'BOOL': True}
+    }, {
+      'id': {'S': 'geofence-2'},
+      'version': {'N': '8'},
+      'deleted': {'BOOL': False},
+      'latitude': {'N': '3.0'},
+      'longitude': {'N': '4.0'}
+    }]
+
+    def query(**query_args):
+      shard = query_args['ExpressionAttributeValues'][':syncGroup']['S']
+      return {'Items': [change for change in changes if geofenceSync.shard_key(int(change['version']['N'])) == shard]}
+
+    mock_client().query.side_effect = query
+
+    buildGeofenceSnapshot.handler({}, None)
+
+    self.assertEqual(mock_client().query.call_args[1]['ExpressionAttributeValues'][':sinceVersion'], {'N': '0'})
+
+    put_args = mock_client().put_object.call_args[1]
+    snapshot = geofenceSnapshot.read_snapshot(put_args['Body'])
+    self.assertEqual(snapshot['version'], 8)
+    self.assertEqual(geofenceSnapshot.unpack_geofences(snapshot), {'geofence-2': (3.0, 4.0, 0.0)})
+    self.assertGreater(int(put_args['Metadata']['snapshot-rebuilt-at']), 1600000000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Two tier cache for the geocoding results of the HERE APIs.
+
+The first tier is an LRU kept in the Lambda container, the second one is an Amazon DynamoDB table shared by all the
+containers, where items expire with the table TTL. Both tiers use the same keys, so a result found in the table is
+also kept in the container for the next invocations.
+
+The cache is best-effort: an error of the table (a throttle, for example) is logged and handled as a miss or a skipped
+write, so the geocoding request still goes to HERE.
+"""
+
+import json
+import time
+import random
+import hashlib
+import unicodedata
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+max_key_length = 1024
+default_lru_size = 1024
+batch_get_size = 100
+max_batch_get_attempts = 5
+
+lru = OrderedDict()
+
+def normalize_address(address):
+  """
+  Normalizes an address so the same place typed with a different case, spacing or punctuation gets the same key.
+  """
+
+  normalized = unicodedata.normalize('NFKC', address or '').casefold()
+  normalized = ''.join(' ' if unicodedata.category(c)[0] in ('P', 'S', 'Z', 'C') else c for c in normalized)
+  return ' '.join(normalized.split())
+
+def create_key(prefix, value):
+  """
+  Creates the cache key, hashing the values too long to be used as an Amazon DynamoDB key.
+  """
+
+  key = f'{prefix}#{value}'
+  if len(key.encode('utf-8')) > max_key_length:
+    key = f'{prefix}#sha256:' + hashlib.sha256(value.encode('utf-8')).hexdigest()
+  return key
+
+def get(dbb_client, table_name, key, lru_size = default_lru_size):
+  """
+  Returns the cached value and the tier where it was found ('memory' or 'table'), or (None, None) on a miss.
+  """
+
+  if key in lru:
+    lru.move_to_end(key)
+    return lru[key], 'memory'
+
+  if not table_name:
+    return None, None
+
+  try:
+    response_get = dbb_client.get_item(
+      TableName = table_name,
+      Key = {
+        'cacheKey': {'S': key}
+      }
+    )
+  except ClientError as e:
+    print(f'Could not read {key} from the cache table: {e}')
+    return None, None
+
+  item = response_get.get('Item')
+
+  # expired items can still be returned until the TTL process deletes them
+  if not item or int(item['expiresAt']['N']) <= time.time():
+    return None, None
+
+  value = json.loads(item['value']['S'])
+  remember(key, value, lru_size)
+  return value, 'table'
+
+def get_many(dbb_client, table_name, keys, lru_size = default_lru_size):
+  """
+  Returns the cached values of the keys found in either tier, keyed by cache key. The keys missing from the container
+  are read from the table with BatchGetItem, batch_get_size keys per call.
+  """
+
+  values = {}
+  table_keys = []
+
+  for key in keys:
+    if key in lru:
+      lru.move_to_end(key)
+      values[key] = lru[key]
+    else:
+      table_keys.append(key)
+
+  if not table_name:
+    return values
+
+  now = time.time()
+
+  for start in range(0, len(table_keys), batch_get_size):
+    request_items = {
+      table_name: {
+        'Keys': [{'cacheKey': {'S': key}} for key in table_keys[start:start + batch_get_size]]
+      }
+    }
+
+    for attempt in range(max_batch_get_attempts):
+      try:
+        response_batch = dbb_client.batch_get_item(RequestItems = request_items)
+      except ClientError as e:
+        print(f'Could not read {len(table_keys[start:start + batch_get_size])} keys from the cache table: {e}')
+        break
+
+      for item in response_batch.get('Responses', {}).get(table_name, []):
+        # expired items can still be returned until the TTL process deletes them
+        if int(item['expiresAt']['N']) > now:
+          values[item['cacheKey']['S']] = json.loads(item['value']['S'])
+          remember(item['cacheKey']['S'], values[item['cacheKey']['S']], lru_size)
+
+      request_items = response_batch.get('UnprocessedKeys')
+      if not request_items:
+        break
+      time.sleep(random.uniform(0, min(0.05 * (2 ** attempt), 1)))
+
+  return values
+
+def put(dbb_client, table_name, key, value, ttl_seconds, lru_size = default_lru_size):
+  """
+  Stores the value in both tiers of the cache.
+  """
+
+  remember(key, value, lru_size)
+
+  if not table_name:
+    return
+
+  try:
+    dbb_client.put_item(
+      TableName = table_name,
+      Item = {
+        'cacheKey': {'S': key},
+        'value': {'S': json.dumps(value)},
+        'expiresAt': {'N': str(int(time.time()) + ttl_seconds)}
+      }
+    )
+  except ClientError as e:
+    print(f'Could not write {key} to the cache table: {e}')
+
+def remember(key, value, lru_size):
+  """
+  Keeps the value in the container LRU, evicting the least recently used values beyond its size.
+  """
+
+  lru[key] = value
+  lru.move_to_end(key)
+
+  while len(lru) > lru_size:
+    lru.popitem(last = False)
+
+def emit_metrics(function_name, metrics):
+  """
+  Prints the metrics in the CloudWatch embedded metric format, so they are extracted from the function logs without
+  any extra API call. Metrics are given as {name: (value, unit)}.
+  """
+
+  payload = {
+    '_aws': {
+      'Timestamp': int(time.time() * 1000),
+      'CloudWatchMetrics': [{
+        'Namespace': 'LocationBasedNotifications',
+        'Dimensions': [['FunctionName']],
+        'Metrics': [{'Name': name, 'Unit': unit} for name, (value, unit) in metrics.items()]
+      }]
+    },
+    'FunctionName': function_name
+  }
+  payload.update({name: value for name, (value, unit) in metrics.items()})
+
+  print(json.dumps(payload))
@@ -0,0 +1,49 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+
+"""
+Conversion of the geofence items read from Amazon DynamoDB (the table, its stream or the sync table) into plain objects,
+shared by the functions indexing, searching and exporting the geofences so they all return the same values.
+"""
+
+import decimal
+
+from boto3.dynamodb.types import TypeDeserializer
+
+def convert_from_dbb_format_to_obj(data):
+  """
+  Normalizes the object coming from Amazon DynamoDB into a plain object.
+  """
+
+  return {k: normalize_values(TypeDeserializer().deserialize(v)) for k,v in data.items()}
+
+def normalize_values(value):
+  """
+  Normalize values coming from Amazon DynamoDB, including the ones nested in lists and maps such as the polygon vertices.
+  """
+
+  if isinstance(value, list):
+    return [normalize_values(element) for element in value]
+  if isinstance(value, dict):
+    return {k: normalize_values(v) for k, v in value.items()}
+  if isinstance(value, decimal.Decimal):
+    if value % 1 == 0:
+      return int(value)
+    else:
+      return float(value)
+  return value
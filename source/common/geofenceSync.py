@@ -0,0 +1,117 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Layout of the geofence sync table, shared by the processGeofenceChanges function writing it and the functions reading
+the changes by version (searchGeofences for the syncGeofences query, buildGeofenceSnapshot).
+
+Each change gets a version from the counter item of the table. The version-index global secondary index spreads the
+changes over sync_shards partition keys (syncGroup = geofences#<version % sync_shards>), so a burst of changes, a bulk
+import for example, does not go to a single hot partition. A reader queries every shard and merges them by version.
+
+The versions are reserved before the changes are written, and the index is eventually consistent, so a version can
+become visible before a smaller one. A reader moving its cursor past the larger version would skip the smaller one
+forever. Every change is stamped with the time its version was reserved (recordedAt), and the readers only return the
+changes older than sync_lag_seconds: the processGeofenceChanges invocation reserving a smaller version has completed its
+writes by then, since it cannot run longer than its timeout.
+
+The table also holds the largest extent of the polygon geofences (polygon_extent_id), the distance in meters from the
+coordinates of a polygon to its farthest vertex. A polygon is indexed in the geohash cell of its coordinates only, so
+the geohash searches grow the searched area by that extent to find the polygons reaching it from a farther cell.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sync_group = 'geofences'
+sync_shards = 8
+version_index = 'version-index'
+polygon_extent_id = '__polygon_extent__'
+# timeout of the processGeofenceChanges function, plus a margin for the index propagation and the clock skew
+sync_lag_seconds = 90
+
+def shard_key(version):
+  """
+  Returns the syncGroup partition key of the version-index for a version.
+  """
+
+  return f'{sync_group}#{version % sync_shards}'
+
+def query_changes(dbb_client, sync_table_name, since_version, limit = None, now = None):
+  """
+  Returns the settled changes with a version greater than since_version, in version order, as raw DynamoDB items,
+  and whether more settled changes may follow right away.
+
+  With a limit, every shard is read for up to limit items and the merge stops at the smallest last version among the
+  shards holding more items, so no version is skipped. The merge also stops at the first change newer than
+  sync_lag_seconds, the smaller versions possibly not being visible yet.
+  """
+
+  now = time.time() if now is None else now
+
+  def query_shard(shard):
+    items = []
+    query_args = {
+      'TableName': sync_table_name,
+      'IndexName': version_index,
+      'KeyConditionExpression': '#syncGroup = :syncGroup AND #version > :sinceVersion',
+      'ExpressionAttributeNames': {
+        '#syncGroup': 'syncGroup',
+        '#version': 'version'
+      },
+      'ExpressionAttributeValues': {
+        ':syncGroup': {'S': f'{sync_group}#{shard}'},
+        ':sinceVersion': {'N': str(since_version)}
+      },
+      'ScanIndexForward': True
+    }
+    if limit:
+      query_args['Limit'] = limit
+
+    while True:
+      response_query = dbb_client.query(**query_args)
+      items.extend(response_query['Items'])
+
+      if 'LastEvaluatedKey' not in response_query:
+        return items, False
+      if limit:
+        return items, True
+      query_args['ExclusiveStartKey'] = response_query['LastEvaluatedKey']
+
+  with ThreadPoolExecutor(max_workers = sync_shards) as executor:
+    shards = list(executor.map(query_shard, range(sync_shards)))
+
+  horizon = min((get_version(items[-1]) for items, truncated in shards if truncated and items), default = None)
+  changes = sorted((item for items, _ in shards for item in items), key = get_version)
+
+  settled = []
+  for change in changes:
+    if (horizon is not None and get_version(change) > horizon) or (limit and len(settled) == limit):
+      return settled, True
+    if float(change.get('recordedAt', {'N': '0'})['N']) > now - sync_lag_seconds:
+      # the following changes are served by a later call, once settled
+      return settled, False
+    settled.append(change)
+
+  return settled, horizon is not None
+
+def get_version(item):
+  """
+  Returns the version of a raw sync table item.
+  """
+
+  return int(item['version']['N'])
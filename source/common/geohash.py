@@ -0,0 +1,214 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Geohash helpers used to maintain and query the geohash indexes of the geofences Amazon DynamoDB table.
+
+Geofences are stamped with geohash prefixes at the precisions listed in geohash_precisions. A single global secondary
+index, geohash_index, is keyed by the coarsest prefix with the finest one as sort key, so the cells of any indexed
+precision are queried from it. A proximity lookup covers the searched area with the cells of one precision and runs one
+Query per cell, so its cost depends on the number of nearby geofences instead of the table size.
+"""
+
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+base32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+geohash_precisions = [4, 6]
+geohash_index = 'geohash-index'
+max_query_cells = 9
+earth_radius = 6371008.8
+meters_per_degree = 111320.0
+
+def encode(latitude, longitude, precision):
+  """
+  Returns the geohash of the coordinates with the given number of characters.
+  """
+
+  lat_range = [-90.0, 90.0]
+  lon_range = [-180.0, 180.0]
+  geohash = []
+  bits = 0
+  bit_count = 0
+  even_bit = True
+
+  while len(geohash) < precision:
+    if even_bit:
+      middle = (lon_range[0] + lon_range[1]) / 2
+      if longitude >= middle:
+        bits = (bits << 1) | 1
+        lon_range[0] = middle
+      else:
+        bits = bits << 1
+        lon_range[1] = middle
+    else:
+      middle = (lat_range[0] + lat_range[1]) / 2
+      if latitude >= middle:
+        bits = (bits << 1) | 1
+        lat_range[0] = middle
+      else:
+        bits = bits << 1
+        lat_range[1] = middle
+
+    even_bit = not even_bit
+    bit_count += 1
+
+    if bit_count == 5:
+      geohash.append(base32[bits])
+      bits = 0
+      bit_count = 0
+
+  return ''.join(geohash)
+
+def geohash_attributes(latitude, longitude):
+  """
+  Returns the geohash prefix attributes to be stored in a geofence item, one per indexed precision.
+  """
+
+  return {f'geohash{precision}': encode(latitude, longitude, precision) for precision in geohash_precisions}
+
+def cell_size(precision):
+  """
+  Returns the height and width in degrees of a geohash cell with the given number of characters.
+  """
+
+  lat_bits = (precision * 5) // 2
+  lon_bits = precision * 5 - lat_bits
+  return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+def bounding_box(latitude, longitude, radius):
+  """
+  Returns the (min_lat, min_lon, max_lat, max_lon) box around a circle of the given radius in meters.
+  """
+
+  delta_lat = radius / meters_per_degree
+  delta_lon = radius / (meters_per_degree * max(math.cos(math.radians(latitude)), 0.01))
+
+  return (
+    max(latitude - delta_lat, -90.0),
+    max(longitude - delta_lon, -180.0),
+    min(latitude + delta_lat, 90.0),
+    min(longitude + delta_lon, 180.0)
+  )
+
+def expand_box(box, meters):
+  """
+  Returns the (min_lat, min_lon, max_lat, max_lon) box grown by the given distance in meters on every side.
+  """
+
+  min_lat, min_lon, max_lat, max_lon = box
+  delta_lat = meters / meters_per_degree
+  delta_lon = meters / (meters_per_degree * max(min(math.cos(math.radians(min_lat)), math.cos(math.radians(max_lat))), 0.01))
+
+  return (
+    max(min_lat - delta_lat, -90.0),
+    max(min_lon - delta_lon, -180.0),
+    min(max_lat + delta_lat, 90.0),
+    min(max_lon + delta_lon, 180.0)
+  )
+
+def covering_cells(box, precision):
+  """
+  Returns the geohash cells of the given precision that intersect the bounding box.
+  """
+
+  min_lat, min_lon, max_lat, max_lon = box
+  height, width = cell_size(precision)
+
+  lat_steps = int(math.ceil((max_lat - min_lat) / height)) + 1
+  lon_steps = int(math.ceil((max_lon - min_lon) / width)) + 1
+
+  cells = set()
+  for lat_step in range(lat_steps):
+    latitude = min(min_lat + lat_step * height, max_lat)
+    for lon_step in range(lon_steps):
+      longitude = min(min_lon + lon_step * width, max_lon)
+      cells.add(encode(latitude, longitude, precision))
+
+  return cells
+
+def choose_cells(box):
+  """
+  Picks the finest indexed precision that covers the bounding box with at most max_query_cells cells.
+  The coarsest precision is used when none of them does.
+  """
+
+  for precision in sorted(geohash_precisions, reverse = True):
+    height, width = cell_size(precision)
+    min_lat, min_lon, max_lat, max_lon = box
+
+    # cheap upper bound before enumerating the cells
+    if ((max_lat - min_lat) / height + 2) * ((max_lon - min_lon) / width + 2) > max_query_cells * 4:
+      continue
+
+    cells = covering_cells(box, precision)
+    if len(cells) <= max_query_cells:
+      return precision, cells
+
+  precision = min(geohash_precisions)
+  return precision, covering_cells(box, precision)
+
+def distance(latitude_a, longitude_a, latitude_b, longitude_b):
+  """
+  Returns the haversine distance in meters between two coordinates.
+  """
+
+  phi_a = math.radians(latitude_a)
+  phi_b = math.radians(latitude_b)
+  delta_phi = phi_b - phi_a
+  delta_lambda = math.radians(longitude_b - longitude_a)
+
+  a = math.sin(delta_phi / 2) ** 2 + math.cos(phi_a) * math.cos(phi_b) * math.sin(delta_lambda / 2) ** 2
+  return 2 * earth_radius * math.asin(min(1.0, math.sqrt(a)))
+
+def query_cells(dbb_client, table_name, precision, cells):
+  """
+  Runs one Query per geohash cell of the given precision against the geohash index, concurrently, and returns the raw
+  DynamoDB items.
+  """
+
+  coarse_precision = min(geohash_precisions)
+  fine_precision = max(geohash_precisions)
+
+  def query_cell(cell):
+    items = []
+    query_args = {
+      'TableName': table_name,
+      'IndexName': geohash_index,
+      'KeyConditionExpression': '#coarse = :coarse',
+      'ExpressionAttributeNames': {'#coarse': f'geohash{coarse_precision}'},
+      'ExpressionAttributeValues': {':coarse': {'S': cell[:coarse_precision]}}
+    }
+
+    if precision > coarse_precision:
+      query_args['KeyConditionExpression'] += ' AND begins_with(#fine, :cell)'
+      query_args['ExpressionAttributeNames']['#fine'] = f'geohash{fine_precision}'
+      query_args['ExpressionAttributeValues'][':cell'] = {'S': cell}
+
+    while True:
+      response = dbb_client.query(**query_args)
+      items.extend(response['Items'])
+
+      if 'LastEvaluatedKey' not in response:
+        return items
+      query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+  if not cells:
+    return []
+
+  with ThreadPoolExecutor(max_workers = len(cells)) as executor:
+    return [item for items in executor.map(query_cell, sorted(cells)) for item in items]
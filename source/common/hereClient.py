@@ -0,0 +1,132 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+HERE API clients shared by all the invocations of a Lambda container.
+
+The herepy clients are created once per container and send their requests through a pooled keep-alive HTTP session,
+with strict connect and read timeouts. A circuit breaker stops calling HERE for a cooldown period after consecutive
+failures, so a slow or unavailable upstream fails fast instead of holding every invocation until its timeout.
+"""
+
+import os
+import time
+import threading
+
+import herepy
+import herepy.geocoder_api
+import herepy.geocoder_reverse_api
+import herepy.geocoder_autocomplete_api
+import requests
+from requests.adapters import HTTPAdapter
+
+default_connect_timeout = 1.0
+default_read_timeout = 3.0
+default_failure_threshold = 5
+default_cooldown_seconds = 30
+pool_size = 10
+
+session = None
+clients = {}
+breaker = {
+  'failures': 0,
+  'open_until': 0.0,
+  'probing': False
+}
+lock = threading.Lock()
+
+class CircuitOpenError(Exception):
+  """
+  Raised instead of calling HERE while the circuit breaker is open.
+  """
+
+def get_session():
+  """
+  Returns the pooled HTTP session, creating it only once per container. The herepy geocoder modules send their
+  requests through the module level requests functions, which are pointed to the session.
+  """
+
+  global session
+
+  if session is None:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size, max_retries = 0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    herepy.geocoder_api.requests = session
+    herepy.geocoder_reverse_api.requests = session
+    herepy.geocoder_autocomplete_api.requests = session
+
+  return session
+
+def get_timeout():
+  """
+  Returns the (connect, read) timeout in seconds used by the HERE requests.
+  """
+
+  return (
+    float(os.environ.get('HERE_CONNECT_TIMEOUT', default_connect_timeout)),
+    float(os.environ.get('HERE_READ_TIMEOUT', default_read_timeout))
+  )
+
+def get_client(api_class):
+  """
+  Returns the client of the given herepy API class, creating it only once per container.
+  """
+
+  if api_class not in clients:
+    get_session()
+    clients[api_class] = api_class(os.environ['HERE_API_KEY'], timeout = get_timeout())
+
+  return clients[api_class]
+
+def call(function, *args, **kwargs):
+  """
+  Calls a HERE client method through the circuit breaker.
+
+  After failure_threshold consecutive failures the breaker opens and every call fails right away with a
+  CircuitOpenError until the cooldown is over. The first call after the cooldown is then let through alone as a probe,
+  the other calls failing right away while it runs: it closes the breaker again if it succeeds, and opens it for another
+  cooldown if it fails.
+  """
+
+  with lock:
+    if breaker['open_until'] > time.monotonic() or breaker['probing']:
+      raise CircuitOpenError('HERE API calls suspended after consecutive failures')
+    probe = breaker['open_until'] > 0.0
+    breaker['probing'] = probe
+
+  try:
+    response = function(*args, **kwargs)
+  except (requests.exceptions.RequestException, herepy.HEREError):
+    with lock:
+      breaker['failures'] += 1
+      if breaker['failures'] >= int(os.environ.get('HERE_FAILURE_THRESHOLD', default_failure_threshold)):
+        breaker['open_until'] = time.monotonic() + float(os.environ.get('HERE_COOLDOWN_SECONDS', default_cooldown_seconds))
+        print(f"Circuit breaker opened after {breaker['failures']} consecutive HERE failures")
+    raise
+  else:
+    with lock:
+      breaker['failures'] = 0
+      breaker['open_until'] = 0.0
+  finally:
+    if probe:
+      with lock:
+        breaker['probing'] = False
+
+  return response
@@ -0,0 +1,45 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Rate limiter shared by the threads of a Lambda invocation, used to space the concurrent calls of the batch operations
+under the request rate allowed by a downstream API (Amazon Pinpoint or HERE).
+"""
+
+import time
+import threading
+
+def create_rate_limiter(rate):
+  """
+  Returns a function that spaces the calls by 1/rate seconds across all the threads. It waits for the next free slot
+  and returns True, or returns False right away when that slot is after the deadline.
+  """
+
+  lock = threading.Lock()
+  next_slot = [time.monotonic()]
+
+  def acquire(deadline):
+    with lock:
+      slot = max(next_slot[0], time.monotonic())
+      if deadline is not None and slot > deadline:
+        return False
+      next_slot[0] = slot + 1 / rate
+
+    time.sleep(max(slot - time.monotonic(), 0))
+    return True
+
+  return acquire
@@ -0,0 +1,285 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Lambda function invoked on a nightly schedule to export all the geofences, including their number of visits, to the
+exports/ folder of the geofence data bucket.
+
+The geofences table is read with a parallel Scan, one thread per segment, and the items are normalized the same way as
+the ones indexed into Amazon ElasticSearch. They are written as gzip compressed NDJSON (one geofence per line) or as a
+GeoJSON FeatureCollection, streamed to Amazon S3 with a multipart upload. Only a few scanned pages and one part are kept in
+memory at a time, whatever the size of the table. The export is stored as a .gz file (application/gzip) rather than with a
+gzip Content-Encoding, so it is downloaded compressed as its key says instead of being decoded by browsers and clients.
+"""
+
+import json
+import os
+import queue
+import zlib
+import datetime
+import threading
+
+import boto3
+
+import geofenceItems
+
+default_format = 'ndjson'
+default_total_segments = 4
+# S3 multipart uploads require parts of at least 5 MB, except the last one
+part_size = 8 * 1024 * 1024
+# number of scanned pages waiting to be written, bounding the memory used when S3 is slower than the Scan
+max_pending_pages = 8
+
+export_formats = ['ndjson', 'geojson']
+# the fields of the Geofence type of the API, the only ones exported
+public_fields = ['id', 'name', 'branch', 'address', 'city', 'country', 'region', 'latitude', 'longitude', 'definition', 'polygon', 'visits', 'updatedAt']
+
+def handler(event, context):
+  """
+  Main handler function, invoked by the nightly schedule or directly with the format ('ndjson' or 'geojson') and the key
+  of the export.
+  """
+
+  print('Request: {}'.format(json.dumps(event)))
+
+  export_format = (event or {}).get('format', os.environ.get('EXPORT_FORMAT', default_format)).lower()
+  if export_format not in export_formats:
+    raise ValueError(f"Unsupported export format {export_format}, expected one of {', '.join(export_formats)}")
+
+  export_key = (event or {}).get('key') or 'exports/geofences-{}.{}.gz'.format(
+    datetime.datetime.utcnow().strftime('%Y-%m-%d'),
+    export_format
+  )
+
+  response = export_geofences(
+    boto3.client('dynamodb'),
+    boto3.client('s3'),
+    os.environ['DBB_TABLE_NAME'],
+    os.environ['EXPORT_BUCKET'],
+    export_key,
+    export_format,
+    int(os.environ.get('TOTAL_SEGMENTS', default_total_segments))
+  )
+
+  print('Response: {}'.format(json.dumps(response)))
+  return response
+
+def export_geofences(dbb_client, s3_client, dbb_table_name, bucket, key, export_format, total_segments):
+  """
+  Scans the geofences table and uploads the compressed export, returning the number of geofences and bytes written.
+  """
+
+  upload = MultipartUpload(s3_client, bucket, key)
+  compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+  count = 0
+
+  try:
+    if export_format == 'geojson':
+      upload.write(compressor.compress(b'{"type":"FeatureCollection","features":[\n'))
+
+    for item in scan_table(dbb_client, dbb_table_name, total_segments):
+      geofence = create_public_geofence(geofenceItems.convert_from_dbb_format_to_obj(item))
+
+      if export_format == 'geojson':
+        line = (',\n' if count else '') + json.dumps(create_feature(geofence), default = list)
+      else:
+        line = json.dumps(geofence, default = list) + '\n'
+
+      upload.write(compressor.compress(line.encode('utf-8')))
+      count += 1
+
+    if export_format == 'geojson':
+      upload.write(compressor.compress(b'\n]}\n'))
+
+    upload.write(compressor.flush())
+    upload.complete()
+
+  except Exception:
+    upload.abort()
+    raise
+
+  return {
+    'status': 'EXPORTED',
+    'bucket': bucket,
+    'key': key,
+    'format': export_format,
+    'geofences': count,
+    'bytes': upload.size
+  }
+
+def scan_table(dbb_client, dbb_table_name, total_segments):
+  """
+  Yields the items of a parallel Scan of the table, each segment being scanned by its own thread. The pages are handed
+  over through a bounded queue, so the threads wait while the consumer is behind.
+  """
+
+  pages = queue.Queue(maxsize = max_pending_pages)
+  stop = threading.Event()
+
+  def scan_segment(segment):
+    try:
+      scan_args = {
+        'TableName': dbb_table_name,
+        'Segment': segment,
+        'TotalSegments': total_segments
+      }
+
+      while not stop.is_set():
+        response_scan = dbb_client.scan(**scan_args)
+        put_page(response_scan['Items'])
+
+        if 'LastEvaluatedKey' not in response_scan:
+          break
+        scan_args['ExclusiveStartKey'] = response_scan['LastEvaluatedKey']
+
+      put_page(None)
+    except Exception as ex:
+      put_page(ex)
+
+  def put_page(page):
+    # gives up when the consumer stopped reading, so the thread does not block forever on a full queue
+    while not stop.is_set():
+      try:
+        pages.put(page, timeout = 1)
+        return
+      except queue.Full:
+        continue
+
+  threads = [threading.Thread(target = scan_segment, args = (segment,), daemon = True) for segment in range(total_segments)]
+  for thread in threads:
+    thread.start()
+
+  try:
+    remaining = total_segments
+    while remaining:
+      page = pages.get()
+
+      if page is None:
+        remaining -= 1
+      elif isinstance(page, Exception):
+        raise page
+      else:
+        yield from page
+  finally:
+    stop.set()
+    for thread in threads:
+      thread.join()
+
+def create_public_geofence(geofence):
+  """
+  Returns the public fields of a geofence, leaving out the derived and bookkeeping attributes of the item.
+  """
+
+  return {k: geofence[k] for k in public_fields if k in geofence}
+
+def create_feature(geofence):
+  """
+  Creates the GeoJSON feature of a geofence, with the polygon as geometry for the polygon geofences and the center point
+  for the other ones.
+  """
+
+  if geofence.get('polygon'):
+    ring = [[vertex['longitude'], vertex['latitude']] for vertex in geofence['polygon']]
+    ring.append(ring[0])
+    geometry = {'type': 'Polygon', 'coordinates': [ring]}
+  elif geofence.get('latitude') is not None and geofence.get('longitude') is not None:
+    geometry = {'type': 'Point', 'coordinates': [geofence['longitude'], geofence['latitude']]}
+  else:
+    geometry = None
+
+  return {
+    'type': 'Feature',
+    'id': geofence.get('id'),
+    'geometry': geometry,
+    'properties': {k: v for k, v in geofence.items() if k != 'polygon'}
+  }
+
+class MultipartUpload:
+  """
+  Buffers the bytes written and uploads them to Amazon S3 as the parts of a multipart upload.
+  """
+
+  def __init__(self, s3_client, bucket, key):
+    self.s3_client = s3_client
+    self.bucket = bucket
+    self.key = key
+    self.parts = []
+    self.buffer = bytearray()
+    self.size = 0
+
+    response_create = s3_client.create_multipart_upload(
+      Bucket = bucket,
+      Key = key,
+      ContentType = 'application/gzip'
+    )
+    self.upload_id = response_create['UploadId']
+
+  def write(self, data):
+    """
+    Adds data to the current part, uploading parts of part_size bytes as soon as enough data is buffered.
+    """
+
+    self.buffer += data
+    self.size += len(data)
+
+    while len(self.buffer) >= part_size:
+      self.upload_part(self.buffer[:part_size])
+      del self.buffer[:part_size]
+
+  def upload_part(self, data):
+    """
+    Uploads data as the next part.
+    """
+
+    part_number = len(self.parts) + 1
+
+    response_part = self.s3_client.upload_part(
+      Bucket = self.bucket,
+      Key = self.key,
+      UploadId = self.upload_id,
+      PartNumber = part_number,
+      Body = bytes(data)
+    )
+
+    self.parts.append({'ETag': response_part['ETag'], 'PartNumber': part_number})
+
+  def complete(self):
+    """
+    Uploads the remaining data as the last part, which can be smaller than 5 MB, and completes the upload.
+    """
+
+    if self.buffer or not self.parts:
+      self.upload_part(self.buffer)
+      self.buffer = bytearray()
+
+    self.s3_client.complete_multipart_upload(
+      Bucket = self.bucket,
+      Key = self.key,
+      UploadId = self.upload_id,
+      MultipartUpload = {'Parts': self.parts}
+    )
+
+  def abort(self):
+    """
+    Aborts the upload, so the parts already uploaded are not kept and billed.
+    """
+
+    self.s3_client.abort_multipart_upload(
+      Bucket = self.bucket,
+      Key = self.key,
+      UploadId = self.upload_id
+    )
@@ -0,0 +1,173 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+import unittest
+from unittest.mock import Mock, patch
+
+import os
+import gzip
+import json
+import exportGeofences
+
+class TestExportGeofences(unittest.TestCase):
+  """
+  Test class for the ExportGeofences function
+  """
+
+  ENV_DBB_TABLE_NAME = 'DBB_TABLE_NAME'
+  DBB_TABLE_NAME = 'some-geofences-table'
+  ENV_EXPORT_BUCKET = 'EXPORT_BUCKET'
+  EXPORT_BUCKET = 'some-geofence-data-bucket'
+
+  def setUp(self):
+    """
+    Setting up the test case
+    """
+    os.environ[TestExportGeofences.ENV_DBB_TABLE_NAME] = TestExportGeofences.DBB_TABLE_NAME
+    os.environ[TestExportGeofences.ENV_EXPORT_BUCKET] = TestExportGeofences.EXPORT_BUCKET
+
+  def create_item(self, index):
+    """
+    Creates a geofences table item
+    """
+    return {
+      'id': {'S': f'geofence-{index}'},
+      'name': {'S': f'Store {index}'},
+      'latitude': {'N': '40.7128'},
+      'longitude': {'N': '-74.006'},
+      'visits': {'N': str(index)},
+      'definition': {'S': 'RADIUS:(100)'},
+      'geohash4': {'S': 'dr5r'},
+      'geohash6': {'S': 'dr5reg'},
+      '__typename': {'S': 'Geofence'}
+    }
+
+  def create_clients(self, mock_boto3_client, pages):
+    """
+    Returns the mocked Amazon DynamoDB and Amazon S3 clients, with the Scan returning the pages of each segment
+    """
+    def scan(**scan_args):
+      segment_pages = pages[scan_args['Segment']]
+      index = scan_args.get('ExclusiveStartKey', {}).get('page', 0)
+      response = {'Items': segment_pages[index]}
+      if index + 1 < len(segment_pages):
+        response['LastEvaluatedKey'] = {'page': index + 1}
+      return response
+
+    dbb_client = Mock()
+    dbb_client.scan.side_effect = scan
+    s3_client = Mock()
+    s3_client.create_multipart_upload.return_value = {'UploadId': 'some-upload-id'}
+    s3_client.upload_part.side_effect = lambda **part_args: {'ETag': f"etag-{part_args['PartNumber']}"}
+    mock_boto3_client.side_effect = lambda service: s3_client if service == 's3' else dbb_client
+    return dbb_client, s3_client
+
+  def get_export(self, s3_client):
+    """
+    Returns the uncompressed content of the uploaded parts
+    """
+    return gzip.decompress(b''.join(call[1]['Body'] for call in s3_client.upload_part.call_args_list)).decode('utf-8')
+
+  @patch('boto3.client')
+  def test_export_ndjson_successfully(self, mock_boto3_client):
+    """
+    Test when exporting the geofences scanned in several segments and pages as NDJSON
+    """
+
+    pages = [
+      [[self.create_item(1), self.create_item(2)], [self.create_item(3)]],
+      [[self.create_item(4)]],
+      [[]]
+    ]
+    dbb_client, s3_client = self.create_clients(mock_boto3_client, pages)
+
+    with patch.dict(os.environ, {'TOTAL_SEGMENTS': '3'}):
+      response = exportGeofences.handler({'key': 'exports/geofences.ndjson.gz'}, None)
+
+    self.assertEqual(response['status'], 'EXPORTED')
+    self.assertEqual(response['geofences'], 4)
+    self.assertEqual(dbb_client.scan.call_count, 4)
+    self.assertEqual({call[1]['TotalSegments'] for call in dbb_client.scan.call_args_list}, {3})
+
+    geofences = sorted((json.loads(line) for line in self.get_export(s3_client).splitlines()), key = lambda geofence: geofence['id'])
+    self.assertEqual(len(geofences), 4)
+    self.assertEqual(geofences[0]['visits'], 1)
+    self.assertEqual(geofences[0]['latitude'], 40.7128)
+    self.assertNotIn('geohash4', geofences[0])
+    self.assertNotIn('__typename', geofences[0])
+
+    s3_client.create_multipart_upload.assert_called_once_with(
+      Bucket = TestExportGeofences.EXPORT_BUCKET,
+      Key = 'exports/geofences.ndjson.gz',
+      ContentType = 'application/gzip'
+    )
+    s3_client.complete_multipart_upload.assert_called_once_with(
+      Bucket = TestExportGeofences.EXPORT_BUCKET,
+      Key = 'exports/geofences.ndjson.gz',
+      UploadId = 'some-upload-id',
+      MultipartUpload = {'Parts': [{'ETag': 'etag-1', 'PartNumber': 1}]}
+    )
+
+  @patch('boto3.client')
+  def test_export_geojson_in_several_parts(self, mock_boto3_client):
+    """
+    Test when exporting the geofences as GeoJSON in several multipart upload parts
+    """
+
+    polygon_item = self.create_item(2)
+    polygon_item['polygon'] = {'L': [
+      {'M': {'latitude': {'N': '0'}, 'longitude': {'N': '0'}}},
+      {'M': {'latitude': {'N': '0'}, 'longitude': {'N': '1.5'}}},
+      {'M': {'latitude': {'N': '1'}, 'longitude': {'N': '1'}}}
+    ]}
+    pages = [[[self.create_item(1), polygon_item], [self.create_item(index) for index in range(3, 201)]]]
+    dbb_client, s3_client = self.create_clients(mock_boto3_client, pages)
+
+    with patch.dict(os.environ, {'TOTAL_SEGMENTS': '1'}), patch.object(exportGeofences, 'part_size', 1024):
+      response = exportGeofences.handler({'format': 'geojson'}, None)
+
+    self.assertEqual(response['geofences'], 200)
+    self.assertRegex(response['key'], r'^exports/geofences-\d{4}-\d{2}-\d{2}\.geojson\.gz$')
+
+    collection = json.loads(self.get_export(s3_client))
+    self.assertEqual(collection['type'], 'FeatureCollection')
+    self.assertEqual(collection['features'][0]['geometry'], {'type': 'Point', 'coordinates': [-74.006, 40.7128]})
+    self.assertEqual(collection['features'][1]['geometry']['coordinates'], [[[0, 0], [1.5, 0], [1, 1], [0, 0]]])
+    self.assertEqual(collection['features'][1]['properties']['visits'], 2)
+    self.assertEqual(sorted(collection['features'][1]['properties']), ['definition', 'id', 'latitude', 'longitude', 'name', 'visits'])
+
+    parts = s3_client.complete_multipart_upload.call_args[1]['MultipartUpload']['Parts']
+    self.assertGreater(len(parts), 1)
+    self.assertEqual([part['PartNumber'] for part in parts], list(range(1, len(parts) + 1)))
+
+  @patch('boto3.client')
+  def test_export_aborted_on_scan_error(self, mock_boto3_client):
+    """
+    Test when the Scan fails and the multipart upload is aborted
+    """
+
+    dbb_client, s3_client = self.create_clients(mock_boto3_client, [[[]]])
+    dbb_client.scan.side_effect = ValueError('some-scan-error')
+
+    with self.assertRaises(ValueError):
+      exportGeofences.handler({}, None)
+
+    s3_client.abort_multipart_upload.assert_called_once()
+    s3_client.complete_multipart_upload.assert_not_called()
+
+if __name__ == '__main__':
+  unittest.main()
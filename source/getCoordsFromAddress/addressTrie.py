@@ -0,0 +1,75 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Prefix index (trie) of the address suggestions returned by the autocomplete operation.
+
+Every node keeps the first suggestions inserted below it, so a prefix is answered by walking its characters only,
+whatever the number of entries in the trie.
+"""
+
+max_suggestions = 10
+max_entries = 50000
+
+def create_trie(max_size = max_entries):
+  """
+  Returns an empty trie holding up to max_size entries.
+  """
+
+  return {
+    'children': {},
+    'suggestions': [],
+    'size': 0,
+    'maxSize': max_size
+  }
+
+def insert(trie, key, suggestion):
+  """
+  Inserts a suggestion (a dict with a label) under the given normalized key. Suggestions already known by label are
+  ignored, so the suggestions found first (the geofences) keep their place, and so are the suggestions inserted once the
+  trie is full.
+  """
+
+  if not key or trie['size'] >= trie['maxSize']:
+    return
+
+  node = trie
+  for char in key:
+    node = node['children'].setdefault(char, {'children': {}, 'suggestions': []})
+
+  if any(known['label'] == suggestion['label'] for known in node['suggestions']):
+    return
+
+  trie['size'] += 1
+  node = trie
+  for char in key:
+    node = node['children'][char]
+    if len(node['suggestions']) < max_suggestions:
+      node['suggestions'].append(suggestion)
+
+def search(trie, prefix, limit = max_suggestions):
+  """
+  Returns the suggestions of the keys starting with the given normalized prefix.
+  """
+
+  node = trie
+  for char in prefix:
+    node = node['children'].get(char)
+    if node is None:
+      return []
+
+  return node['suggestions'][:limit]
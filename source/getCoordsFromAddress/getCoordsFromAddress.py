@@ -18,12 +18,55 @@
 """
 Lambda function used as an AWS AppSync datasource to return information about an address based in a given address passed as parameter.
 In the address object to be returned, sets the coordinates for the address.
+
+Results are cached by normalized address in the container and in the geocoding cache table, so the HERE API is only
+called for addresses not geocoded before.
+
+The getCoordsFromAddresses operation geocodes a list of addresses at once, calling HERE for the cache misses from a
+bounded thread pool paced to the configured HERE rate limit.
+
+The autocompleteAddress operation suggests addresses from a prefix index of the geofences and the addresses geocoded
+before, kept in the container. HERE autosuggest is only called for prefixes without enough known suggestions, and its
+answers are cached like the geocoding results. The suggestions of the index are published to Amazon S3 by the
+buildPrefixIndex operation, run on a schedule from the sync table, so no request waits for a table scan. The index
+holds at most max_trie_entries suggestions.
+
+The HERE clients are imported on the first call to HERE only, so the containers answering from the cache do not pay
+for them at cold start.
 """
 
 import json
-import uuid 
 import os
-import herepy
+import gzip
+import time
+import threading
+import boto3
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import geocodingCache
+import rateLimiter
+import addressTrie
+import geofenceSync
+
+default_cache_ttl_seconds = 30 * 24 * 60 * 60
+default_max_concurrency = 5
+default_rate_limit = 5
+max_batch_size = 1000
+# time kept to cache the results and return the response before the Lambda times out
+time_budget_margin_seconds = 2
+min_prefix_length = 3
+trie_ttl_seconds = 300
+max_trie_entries = 50000
+default_prefix_index_key = 'prefix-index/suggestions.json.gz'
+default_full_rebuild_hours = 24
+default_suggestion_radius = 50000
+default_suggestion_country = 'USA'
+
+dbb_client = None
+s3_client = None
+trie = None
+trie_expires_at = 0
 
 def handler(event, context):
     """
@@ -33,17 +76,377 @@ def handler(event, context):
     """
 
     print('request: {}'.format(json.dumps(event)))
-    search_text = event['arguments']['address']
 
-    here_api_key = os.environ['HERE_API_KEY']
-    geocoder_api = herepy.GeocoderApi(here_api_key)
-    response_here = geocoder_api.free_form(search_text)
+    operations = {
+      'getCoordsFromAddress': get_coords_from_address,
+      'getCoordsFromAddresses': get_coords_from_addresses,
+      'autocompleteAddress': autocomplete_address,
+      'buildPrefixIndex': build_prefix_index
+    }
+
+    response = operations[event.get('operation', 'getCoordsFromAddress')](event['arguments'], context)
+    print('response: {}'.format(json.dumps(response)))    
+    return response
+
+def get_coords_from_address(arguments, context):
+    """
+    Returns the address and coordinates of a single address, from the cache or the Geocoder HERE API.
+    """
+
+    search_text = arguments['address']
+
+    cache_table_name = os.environ.get('GEOCODING_CACHE_TABLE')
+    cache_client = get_dbb_client() if cache_table_name else None
+    cache_key = geocodingCache.create_key('address', geocodingCache.normalize_address(search_text))
+    address, cache_tier = geocodingCache.get(cache_client, cache_table_name, cache_key)
+
+    metrics = {
+      'CacheHit': (1 if address else 0, 'Count'),
+      'MemoryCacheHit': (1 if cache_tier == 'memory' else 0, 'Count'),
+      'TableCacheHit': (1 if cache_tier == 'table' else 0, 'Count')
+    }
+
+    if not address:
+      started = time.perf_counter()
+      address = geocode_address(search_text)
+      metrics['UpstreamLatency'] = ((time.perf_counter() - started) * 1000, 'Milliseconds')
+
+      geocodingCache.put(cache_client, cache_table_name, cache_key, address, int(os.environ.get('CACHE_TTL_SECONDS', default_cache_ttl_seconds)))
+
+      if trie is not None:
+        addressTrie.insert(trie, geocodingCache.normalize_address(address['street']), {'label': address['street'], 'source': 'address'})
+
+    geocodingCache.emit_metrics('getCoordsFromAddress', metrics)
+    return address
+
+def get_coords_from_addresses(arguments, context):
+    """
+    Returns the address and coordinates of each address of the list, in the same order, with an error message for the
+    addresses that could not be geocoded.
+
+    Duplicated addresses (after normalization) are geocoded once, and the cache table is read with batched calls. Cache misses are sent to HERE concurrently, but never
+    faster than the configured rate limit, and no new request is started once the Lambda time budget is running out.
+    The geocoding still pending when the response is returned is cancelled, so the worker threads left behind neither
+    call HERE nor write to the cache (the runtime has no cancel_futures for the executor shutdown).
+    """
+
+    search_texts = arguments['addresses']
+    if len(search_texts) > max_batch_size:
+      raise ValueError(f'At most {max_batch_size} addresses can be geocoded at once')
+
+    cache_table_name = os.environ.get('GEOCODING_CACHE_TABLE')
+    cache_client = get_dbb_client() if cache_table_name else None
+    cache_ttl_seconds = int(os.environ.get('CACHE_TTL_SECONDS', default_cache_ttl_seconds))
+
+    keys = [geocodingCache.create_key('address', geocodingCache.normalize_address(search_text)) for search_text in search_texts]
+    unique_texts = {}
+    for key, search_text in zip(keys, search_texts):
+      unique_texts.setdefault(key, search_text)
+
+    results = geocodingCache.get_many(cache_client, cache_table_name, list(unique_texts))
+    errors = {}
+    misses = [key for key in unique_texts if key not in results]
+
+    deadline = get_deadline(context)
+    acquire = rateLimiter.create_rate_limiter(float(os.environ.get('HERE_RATE_LIMIT', default_rate_limit)))
+
+    stopped = threading.Event()
+
+    def geocode_miss(key):
+      if stopped.is_set() or not acquire(deadline) or stopped.is_set():
+        errors[key] = 'TimeoutError: not geocoded before the Lambda time budget ran out'
+        return
+
+      try:
+        address = geocode_address(unique_texts[key])
+      except IndexError:
+        errors[key] = f'NotFoundException: no address found for {unique_texts[key]}'
+        return
+      except Exception as ex:
+        errors[key] = f'{type(ex).__name__}: {ex}'
+        return
+
+      if stopped.is_set():
+        return
+
+      results[key] = address
+      geocodingCache.put(cache_client, cache_table_name, key, address, cache_ttl_seconds)
+
+    started = time.perf_counter()
+
+    if misses:
+      executor = ThreadPoolExecutor(max_workers = int(os.environ.get('HERE_MAX_CONCURRENCY', default_max_concurrency)))
+      futures = [executor.submit(geocode_miss, key) for key in misses]
+      wait(futures, timeout = None if deadline is None else max(deadline - time.monotonic(), 0) + time_budget_margin_seconds / 2)
+      stopped.set()
+      for future in futures:
+        future.cancel()
+      executor.shutdown(wait = False)
+
+    geocodingCache.emit_metrics('getCoordsFromAddress', {
+      'BatchAddresses': (len(search_texts), 'Count'),
+      'BatchCacheHits': (len(unique_texts) - len(misses), 'Count'),
+      'BatchUpstreamRequests': (len(misses), 'Count'),
+      'BatchErrors': (len(errors), 'Count'),
+      'BatchUpstreamDuration': ((time.perf_counter() - started) * 1000, 'Milliseconds')
+    })
+
+    return [{
+      'address': search_text,
+      'result': results.get(key),
+      'error': None if key in results else errors.get(key, 'TimeoutError: geocoding did not finish before the Lambda time budget ran out')
+    } for key, search_text in zip(keys, search_texts)]
+
+def autocomplete_address(arguments, context):
+    """
+    Returns the address suggestions for the prefix typed by the admin.
+
+    Suggestions come from the prefix index first. When it does not know enough of them, the HERE autosuggest answer for
+    the prefix is read from the cache or requested, then added to the index. Prefixes shorter than min_prefix_length are
+    only answered from the index, so the first keystrokes never reach HERE.
+    """
+
+    prefix = geocodingCache.normalize_address(arguments['prefix'])
+    limit = min(int(arguments.get('limit') or addressTrie.max_suggestions), addressTrie.max_suggestions)
+
+    cache_table_name = os.environ.get('GEOCODING_CACHE_TABLE')
+    cache_client = get_dbb_client() if cache_table_name else None
+    prefix_index = get_trie()
+
+    suggestions = addressTrie.search(prefix_index, prefix, limit)
+    metrics = {
+      'WarmPrefix': (1 if len(suggestions) >= limit else 0, 'Count')
+    }
+
+    if len(suggestions) < limit and len(prefix) >= min_prefix_length:
+      coordinates = arguments.get('coordinates')
+      scope = f"{coordinates['latitude']},{coordinates['longitude']}" if coordinates else arguments.get('countryCode') or default_suggestion_country
+      cache_key = geocodingCache.create_key('suggest', f'{scope}#{prefix}')
+      labels, cache_tier = geocodingCache.get(cache_client, cache_table_name, cache_key)
+
+      if labels is None:
+        started = time.perf_counter()
+        labels = suggest_addresses(arguments['prefix'], coordinates, arguments.get('countryCode'))
+        metrics['UpstreamLatency'] = ((time.perf_counter() - started) * 1000, 'Milliseconds')
+        geocodingCache.put(cache_client, cache_table_name, cache_key, labels, int(os.environ.get('CACHE_TTL_SECONDS', default_cache_ttl_seconds)))
+
+      known = {suggestion['label'] for suggestion in suggestions}
+      for label in labels:
+        suggestion = {'label': label, 'source': 'here'}
+        addressTrie.insert(prefix_index, geocodingCache.normalize_address(label), suggestion)
+        if label not in known and len(suggestions) < limit:
+          suggestions.append(suggestion)
+          known.add(label)
+
+    geocodingCache.emit_metrics('getCoordsFromAddress', metrics)
+    return suggestions
+
+def suggest_addresses(search_text, coordinates, country_code):
+    """
+    Returns the address labels suggested by the HERE autosuggest API, around the coordinates when they are known or
+    within the given country otherwise.
+    """
+
+    import herepy
+    import hereClient
+
+    autocomplete_api = hereClient.get_client(herepy.GeocoderAutoCompleteApi)
+
+    if coordinates:
+      response_here = hereClient.call(
+        autocomplete_api.address_suggestion,
+        search_text,
+        [float(coordinates['latitude']), float(coordinates['longitude'])],
+        default_suggestion_radius
+      )
+    else:
+      response_here = hereClient.call(autocomplete_api.limit_results_byaddress, search_text, country_code or default_suggestion_country)
+
+    return [item['address']['label'] if 'label' in item.get('address', {}) else item['title'] for item in response_here.items]
+
+def get_trie():
+    """
+    Returns the prefix index of the container, loading the suggestions published by the buildPrefixIndex operation when
+    it is missing or older than trie_ttl_seconds.
+    """
+
+    global trie, trie_expires_at
+
+    if trie is None or trie_expires_at <= time.monotonic():
+      prefix_index = addressTrie.create_trie(max_trie_entries)
+
+      for label, source in load_prefix_index():
+        addressTrie.insert(prefix_index, geocodingCache.normalize_address(label), {'label': label, 'source': source})
+
+      trie = prefix_index
+      trie_expires_at = time.monotonic() + trie_ttl_seconds
+      print(f"Prefix index loaded with {trie['size']} suggestions")
+
+    return trie
+
+def load_prefix_index():
+    """
+    Returns the (label, source) suggestions of the prefix index object, the geofence names and addresses first, or none
+    when it cannot be read, the prefixes being answered by HERE autosuggest until the next load.
+    """
+
+    prefix_index = read_prefix_index()
+    if prefix_index is None:
+      return []
+
+    suggestions = [(label, 'geofence') for labels in prefix_index['geofences'].values() for label in labels]
+    suggestions.extend((label, 'address') for label in prefix_index['addresses'])
+    return suggestions
+
+def read_prefix_index():
+    """
+    Returns the prefix index object published to Amazon S3, or None when there is none yet or it cannot be read.
+    """
+
+    bucket = os.environ.get('PREFIX_INDEX_BUCKET')
+    if not bucket:
+      return None
+
+    try:
+      response_object = get_s3_client().get_object(
+        Bucket = bucket,
+        Key = os.environ.get('PREFIX_INDEX_KEY', default_prefix_index_key)
+      )
+    except ClientError as e:
+      print(f'Could not read the prefix index from {bucket}: {e}')
+      return None
+
+    prefix_index = json.loads(gzip.decompress(response_object['Body'].read()))
+
+    # the objects published before the geofences were tracked by ID are plain lists, replaced by the next full rebuild
+    return prefix_index if isinstance(prefix_index, dict) else None
+
+def build_prefix_index(arguments, context):
+    """
+    Scheduled operation publishing the prefix index suggestions: the geofence names and addresses, then the addresses
+    geocoded before. Each run applies only the geofence changes recorded in the sync table since the published version,
+    as the buildGeofenceSnapshot function does. Once a day (FULL_REBUILD_HOURS) the index is rebuilt from the whole sync
+    table instead, and the geocoding cache table is scanned for the addresses, the only scan of the operation.
+    """
+
+    prefix_index = read_prefix_index() or {}
+    version = prefix_index.get('version', 0)
+    geofences = prefix_index.get('geofences', {})
+    addresses = prefix_index.get('addresses', [])
+    rebuilt_at = prefix_index.get('rebuiltAt', 0)
+
+    full_rebuild = time.time() - rebuilt_at > float(os.environ.get('FULL_REBUILD_HOURS', default_full_rebuild_hours)) * 3600
+    if full_rebuild:
+      print(f'Rebuilding prefix index version {version} from the whole sync table')
+      version, geofences, addresses, rebuilt_at = 0, {}, scan_addresses(), int(time.time())
+
+    changes, _ = geofenceSync.query_changes(get_dbb_client(), os.environ['SYNC_TABLE_NAME'], version)
+
+    if not changes and not full_rebuild:
+      print(f'Prefix index version {version} is up to date')
+      return {'suggestions': count_suggestions(geofences, addresses), 'version': version}
+
+    for change in changes:
+      version = max(version, geofenceSync.get_version(change))
+      labels = [change[field]['S'] for field in ('name', 'address') if change.get(field, {}).get('S')]
+
+      if change.get('deleted', {}).get('BOOL') or not labels:
+        geofences.pop(change['id']['S'], None)
+      else:
+        geofences[change['id']['S']] = labels
+
+    get_s3_client().put_object(
+      Bucket = os.environ['PREFIX_INDEX_BUCKET'],
+      Key = os.environ.get('PREFIX_INDEX_KEY', default_prefix_index_key),
+      Body = gzip.compress(json.dumps({
+        'version': version,
+        'rebuiltAt': rebuilt_at,
+        'geofences': geofences,
+        'addresses': addresses
+      }).encode('utf-8')),
+      ContentType = 'application/gzip'
+    )
+
+    return {'suggestions': count_suggestions(geofences, addresses), 'version': version}
+
+def scan_addresses():
+    """
+    Returns the labels of the addresses geocoded before, read from the geocoding cache table.
+    """
+
+    cache_table_name = os.environ.get('GEOCODING_CACHE_TABLE')
+    if not cache_table_name:
+      return []
+
+    scan_args = {
+      'TableName': cache_table_name,
+      'ProjectionExpression': 'cacheKey, #value',
+      'FilterExpression': 'begins_with(cacheKey, :prefix)',
+      'ExpressionAttributeNames': {'#value': 'value'},
+      'ExpressionAttributeValues': {':prefix': {'S': 'address#'}}
+    }
+
+    addresses = {}
+    for item in scan_items(get_dbb_client(), scan_args):
+      label = json.loads(item['value']['S']).get('street')
+      if label:
+        addresses[label] = None
+
+    return list(addresses)
+
+def count_suggestions(geofences, addresses):
+    """
+    Returns the number of distinct labels of the prefix index.
+    """
+
+    return len({label for labels in geofences.values() for label in labels}.union(addresses))
+
+def scan_items(dbb_client, scan_args):
+    """
+    Yields the scanned items page by page, stopping after max_trie_entries items.
+    """
+
+    count = 0
+
+    while True:
+      response_scan = dbb_client.scan(**scan_args)
+
+      for item in response_scan['Items']:
+        yield item
+        count += 1
+        if count >= max_trie_entries:
+          return
+
+      if 'LastEvaluatedKey' not in response_scan:
+        return
+      scan_args['ExclusiveStartKey'] = response_scan['LastEvaluatedKey']
+
+
+def get_deadline(context):
+    """
+    Returns the monotonic time after which no new HERE request should be started, or None without a Lambda context.
+    """
+
+    if context is None:
+      return None
+
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - time_budget_margin_seconds
+
+def geocode_address(search_text):
+    """
+    Gets the address and its coordinates from the Geocoder HERE API.
+    """
+
+    import herepy
+    import hereClient
+
+    response_here = hereClient.call(hereClient.get_client(herepy.GeocoderApi).free_form, search_text)
     
     response_location = response_here.items[0]
     response_address = response_location['address'] 
     response_location = response_location['position']
     
-    address = {
+    return {
       'street': response_address['label'],
       'city': response_address['city'],
       'state': response_address['state'],
@@ -51,6 +454,27 @@ def handler(event, context):
       'latitude': response_location['lat'],
       'longitude': response_location['lng']
     }
-  
-    print('response: {}'.format(json.dumps(address)))    
-    return address
+
+def get_dbb_client():
+    """
+    Returns the Amazon DynamoDB client, creating it only once per container.
+    """
+
+    global dbb_client
+
+    if dbb_client is None:
+      dbb_client = boto3.client('dynamodb')
+
+    return dbb_client
+
+def get_s3_client():
+    """
+    Returns the Amazon S3 client, creating it only once per container.
+    """
+
+    global s3_client
+
+    if s3_client is None:
+      s3_client = boto3.client('s3')
+
+    return s3_client
@@ -19,9 +19,18 @@ import unittest
 from unittest.mock import Mock, patch
 
 import os
+import io
 import json
+import gzip
+import time
+import threading
 import getCoordsFromAddress
-from herepy.models import GeocoderResponse
+import geocodingCache
+import hereClient
+import rateLimiter
+import requests
+from botocore.exceptions import ClientError
+from herepy.models import GeocoderResponse, GeocoderAutoCompleteResponse
 
 class TestGetCoordsFromAddress(unittest.TestCase):
   """
@@ -30,12 +39,19 @@ class TestGetCoordsFromAddress(unittest.TestCase):
 
   ENV_HERE_API_KEY = 'HERE_API_KEY'
   HERE_API_KEY = 'some-sample-key'
+  ENV_GEOCODING_CACHE_TABLE = 'GEOCODING_CACHE_TABLE'
+  GEOCODING_CACHE_TABLE = 'geocoding-cache-table'
 
   def setUp(self):
     """
     Setting up the test case
     """
     os.environ[TestGetCoordsFromAddress.ENV_HERE_API_KEY] = TestGetCoordsFromAddress.HERE_API_KEY
+    os.environ.pop(TestGetCoordsFromAddress.ENV_GEOCODING_CACHE_TABLE, None)
+    geocodingCache.lru.clear()
+    hereClient.clients.clear()
+    hereClient.breaker.update({'failures': 0, 'open_until': 0.0, 'probing': False})
+    getCoordsFromAddress.trie = None
   
   @patch('herepy.GeocoderApi')
   def test_get_coords_from_address_successfully(self, mock_GeocoderApi):
@@ -86,6 +102,419 @@ class TestGetCoordsFromAddress(unittest.TestCase):
     self.assertEqual(returned_address['latitude'], -11.1234567)
     self.assertEqual(returned_address['longitude'], -99.0987654)
 
+  @patch('getCoordsFromAddress.get_dbb_client')
+  @patch('herepy.GeocoderApi')
+  def test_get_coords_from_address_cached(self, mock_GeocoderApi, mock_get_dbb_client):
+    """
+    Test when the address is geocoded once and then served from the cache, ignoring case, spacing and punctuation
+    """
+
+    os.environ[TestGetCoordsFromAddress.ENV_GEOCODING_CACHE_TABLE] = TestGetCoordsFromAddress.GEOCODING_CACHE_TABLE
+
+    returned_address = {
+      'items': [{
+        'address': {
+          'label': 'some_address',
+          'city': 'some_city',
+          'state': 'some_state',
+          'countryCode': 'some_country_code'
+        },
+        'position': {
+          'lat': -11.1234567,
+          'lng': -99.0987654
+        }
+      }]
+    }
+
+    mock_GeocoderApi().free_form.return_value = GeocoderResponse().new_from_jsondict(returned_address)
+    mock_get_dbb_client().get_item.return_value = {}
+
+    first_address = getCoordsFromAddress.handler({'arguments': {'address': '1 Main St., Springfield'}}, None)
+    second_address = getCoordsFromAddress.handler({'arguments': {'address': ' 1 main st  springfield '}}, None)
+
+    self.assertEqual(mock_GeocoderApi().free_form.call_count, 1)
+    self.assertEqual(first_address, second_address)
+
+    put_args = mock_get_dbb_client().put_item.call_args[1]
+    self.assertEqual(put_args['TableName'], 'geocoding-cache-table')
+    self.assertEqual(put_args['Item']['cacheKey'], {'S': 'address#1 main st springfield'})
+
+  @patch('getCoordsFromAddress.get_dbb_client')
+  @patch('herepy.GeocoderApi')
+  def test_get_coords_from_address_cache_table(self, mock_GeocoderApi, mock_get_dbb_client):
+    """
+    Test when the address is found in the cache table shared by the containers
+    """
+
+    os.environ[TestGetCoordsFromAddress.ENV_GEOCODING_CACHE_TABLE] = TestGetCoordsFromAddress.GEOCODING_CACHE_TABLE
+
+    cached_address = {'street': 'some_address', 'latitude': 1.5, 'longitude': 2.5}
+    mock_get_dbb_client().get_item.return_value = {
+      'Item': {
+        'cacheKey': {'S': 'address#some address'},
+        'value': {'S': json.dumps(cached_address)},
+        'expiresAt': {'N': '9999999999'}
+      }
+    }
+
+    returned_address = getCoordsFromAddress.handler({'arguments': {'address': 'Some Address'}}, None)
+
+    self.assertEqual(returned_address, cached_address)
+    mock_GeocoderApi().free_form.assert_not_called()
+    self.assertIn('address#some address', geocodingCache.lru)
+
+  @patch('getCoordsFromAddress.get_dbb_client')
+  @patch('herepy.GeocoderApi')
+  def test_get_coords_from_address_cache_table_throttled(self, mock_GeocoderApi, mock_get_dbb_client):
+    """
+    Test when the cache table throttles, the address is still geocoded by HERE
+    """
+
+    os.environ[TestGetCoordsFromAddress.ENV_GEOCODING_CACHE_TABLE] = TestGetCoordsFromAddress.GEOCODING_CACHE_TABLE
+
+    throttled = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'throttled'}}, 'GetItem')
+    mock_get_dbb_client().get_item.side_effect = throttled
+    mock_get_dbb_client().put_item.side_effect = throttled
+
+    returned_address = {
+      'items': [{
+        'address': {
+          'label': 'some_address',
+          'city': 'some_city',
+          'state': 'some_state',
+          'countryCode': 'some_country_code'
+        },
+        'position': {
+          'lat': -11.1234567,
+          'lng': -99.0987654
+        }
+      }]
+    }
+
+    mock_GeocoderApi().free_form.return_value = GeocoderResponse().new_from_jsondict(returned_address)
+
+    response = getCoordsFromAddress.handler({'arguments': {'address': 'Some Address'}}, None)
+
+    self.assertEqual(response['street'], 'some_address')
+    mock_GeocoderApi().free_form.assert_called_once()
+    mock_get_dbb_client().put_item.assert_called_once()
+
+  @patch('herepy.GeocoderApi')
+  def test_get_coords_from_addresses_batch(self, mock_GeocoderApi):
+    """
+    Test when a list of addresses is geocoded in one call, with duplicates, cached addresses and an address not found
+    """
+
+    os.environ['HERE_RATE_LIMIT'] = '1000'
+
+    def free_form(search_text):
+      items = [] if search_text == 'nowhere' else [{
+        'address': {
+          'label': search_text,
+          'city': 'some_city',
+          'state': 'some_state',
+          'countryCode': 'some_country_code'
+        },
+        'position': {
+          'lat': 1.5,
+          'lng': 2.5
+        }
+      }]
+      return GeocoderResponse().new_from_jsondict({'items': items})
+
+    mock_GeocoderApi().free_form.side_effect = free_form
+    geocodingCache.remember('address#cached address', {'street': 'from-cache'}, 10)
+
+    context = Mock()
+    context.get_remaining_time_in_millis.return_value = 30000
+
+    event = {
+      'operation': 'getCoordsFromAddresses',
+      'arguments': {
+        'addresses': ['1 Main St', 'nowhere', 'Cached Address', '1 MAIN ST.']
+      }
+    }
+
+    response = getCoordsFromAddress.handler(event, context)
+
+    self.assertEqual(mock_GeocoderApi().free_form.call_count, 2)
+    self.assertEqual([item['address'] for item in response], event['arguments']['addresses'])
+    self.assertEqual(response[0]['result']['street'], '1 Main St')
+    self.assertEqual(response[3]['result'], response[0]['result'])
+    self.assertIsNone(response[0]['error'])
+    self.assertIsNone(response[1]['result'])
+    self.assertTrue(response[1]['error'].startswith('NotFoundException'))
+    self.assertEqual(response[2]['result'], {'street': 'from-cache'})
+
+    del os.environ['HERE_RATE_LIMIT']
+
+  @patch('getCoordsFromAddress.geocode_address')
+  @patch('getCoordsFromAddress.get_dbb_client')
+  def test_get_coords_from_addresses_batch_cache_reads(self, mock_get_dbb_client, mock_geocode_address):
+    """
+    Test when the cache table is read 100 keys at a time, the unprocessed keys being read again
+    """
+
+    os.environ[TestGetCoordsFromAddress.ENV_GEOCODING_CACHE_TABLE] = TestGetCoordsFromAddress.GEOCODING_CACHE_TABLE
+    os.environ['HERE_RATE_LIMIT'] = '1000'
+
+    table = TestGetCoordsFromAddress.GEOCODING_CACHE_TABLE
+    cached_item = {
+      'cacheKey': {'S': 'address#address 7'},
+      'value': {'S': json.dumps({'street': 'from-table'})},
+      'expiresAt': {'N': '9999999999'}
+    }
+    responses = []
+
+    def batch_get_item(RequestItems):
+      keys = RequestItems[table]['Keys']
+      if len(responses) == 0:
+        responses.append(keys)
+        return {'Responses': {table: []}, 'UnprocessedKeys': {table: {'Keys': keys[6:8]}}}
+      responses.append(keys)
+      return {'Responses': {table: [cached_item] if {'cacheKey': {'S': 'address#address 7'}} in keys else []}}
+
+    mock_get_dbb_client().batch_get_item.side_effect = batch_get_item
+    mock_geocode_address.side_effect = lambda search_text: {'street': search_text}
+
+    event = {
+      'operation': 'getCoordsFromAddresses',
+      'arguments': {
+        'addresses': [f'Address {index}' for index in range(150)]
+      }
+    }
+
+    with patch('time.sleep'):
+      response = getCoordsFromAddress.handler(event, None)
+
+    self.assertEqual([len(keys) for keys in responses], [100, 2, 50])
+    self.assertEqual(response[7]['result'], {'street': 'from-table'})
+    self.assertEqual(mock_geocode_address.call_count, 149)
+    mock_get_dbb_client().get_item.assert_not_called()
+
+    del os.environ['HERE_RATE_LIMIT']
+
+  @patch.dict(os.environ, {'HERE_RATE_LIMIT': '1000', 'HERE_MAX_CONCURRENCY': '1'})
+  @patch('getCoordsFromAddress.time_budget_margin_seconds', 0.2)
+  @patch('getCoordsFromAddress.geocode_address')
+  @patch('getCoordsFromAddress.get_dbb_client')
+  def test_get_coords_from_addresses_stops_after_deadline(self, mock_get_dbb_client, mock_geocode_address):
+    """
+    Test when the geocoding still running after the Lambda time budget neither calls HERE again nor writes to the cache
+    """
+
+    os.environ[TestGetCoordsFromAddress.ENV_GEOCODING_CACHE_TABLE] = TestGetCoordsFromAddress.GEOCODING_CACHE_TABLE
+    mock_get_dbb_client().batch_get_item.return_value = {'Responses': {TestGetCoordsFromAddress.GEOCODING_CACHE_TABLE: []}}
+
+    released = threading.Event()
+    finished = threading.Event()
+
+    def geocode_address(search_text):
+      released.wait(5)
+      finished.set()
+      return {'street': search_text}
+
+    mock_geocode_address.side_effect = geocode_address
+    context = Mock()
+    context.get_remaining_time_in_millis.return_value = 300
+
+    event = {
+      'operation': 'getCoordsFromAddresses',
+      'arguments': {
+        'addresses': ['Address 1', 'Address 2', 'Address 3']
+      }
+    }
+
+    response = getCoordsFromAddress.handler(event, context)
+    released.set()
+    finished.wait(5)
+    time.sleep(0.05)
+
+    self.assertTrue(all(result['error'].startswith('TimeoutError') for result in response))
+    self.assertEqual(mock_geocode_address.call_count, 1)
+    mock_get_dbb_client().put_item.assert_not_called()
+
+  def test_rate_limiter_respects_deadline(self):
+    """
+    Test when the rate limiter refuses the requests that would start after the deadline
+    """
+
+    acquire = rateLimiter.create_rate_limiter(10)
+    deadline = getCoordsFromAddress.time.monotonic() + 0.15
+
+    self.assertEqual([acquire(deadline) for _ in range(4)], [True, True, False, False])
+
+  @patch('herepy.GeocoderApi')
+  def test_here_client_reused_with_timeouts(self, mock_GeocoderApi):
+    """
+    Test when the HERE client is created once per container with the connect and read timeouts
+    """
+
+    self.assertIs(hereClient.get_client(mock_GeocoderApi), hereClient.get_client(mock_GeocoderApi))
+    mock_GeocoderApi.assert_called_once_with(TestGetCoordsFromAddress.HERE_API_KEY, timeout = (1.0, 3.0))
+
+  def test_circuit_breaker_fails_fast(self):
+    """
+    Test when the circuit breaker opens after consecutive HERE failures and stops calling HERE
+    """
+
+    os.environ['HERE_FAILURE_THRESHOLD'] = '2'
+    failing = Mock(side_effect = requests.exceptions.ReadTimeout('read timed out'))
+
+    for _ in range(2):
+      with self.assertRaises(requests.exceptions.ReadTimeout):
+        hereClient.call(failing, 'some-address')
+
+    with self.assertRaises(hereClient.CircuitOpenError):
+      hereClient.call(failing, 'some-address')
+
+    self.assertEqual(failing.call_count, 2)
+
+    hereClient.breaker['open_until'] = time.monotonic() - 1
+    self.assertEqual(hereClient.call(Mock(return_value = 'ok')), 'ok')
+    self.assertEqual(hereClient.breaker['failures'], 0)
+
+    del os.environ['HERE_FAILURE_THRESHOLD']
+
+  @patch.dict(os.environ, {'HERE_FAILURE_THRESHOLD': '1'})
+  def test_circuit_breaker_lets_a_single_probe_through(self):
+    """
+    Test when the cooldown is over and a single call probes HERE, the concurrent calls failing fast until it is done
+    """
+
+    with self.assertRaises(requests.exceptions.ReadTimeout):
+      hereClient.call(Mock(side_effect = requests.exceptions.ReadTimeout('read timed out')))
+    hereClient.breaker['open_until'] = time.monotonic() - 1
+
+    concurrent = Mock(return_value = 'ok')
+
+    def probe():
+      with self.assertRaises(hereClient.CircuitOpenError):
+        hereClient.call(concurrent)
+      raise requests.exceptions.ReadTimeout('read timed out')
+
+    with self.assertRaises(requests.exceptions.ReadTimeout):
+      hereClient.call(probe)
+
+    concurrent.assert_not_called()
+    self.assertGreater(hereClient.breaker['open_until'], time.monotonic())
+    self.assertFalse(hereClient.breaker['probing'])
+
+    hereClient.breaker['open_until'] = time.monotonic() - 1
+    self.assertEqual(hereClient.call(concurrent), 'ok')
+    self.assertEqual(hereClient.breaker, {'failures': 0, 'open_until': 0.0, 'probing': False})
+
+  @patch.dict(os.environ, {'SYNC_TABLE_NAME': 'geofence-sync-table', 'PREFIX_INDEX_BUCKET': 'geofence-data-bucket'})
+  @patch('getCoordsFromAddress.get_s3_client')
+  @patch('getCoordsFromAddress.get_dbb_client')
+  @patch('herepy.GeocoderAutoCompleteApi')
+  def test_autocomplete_address(self, mock_GeocoderAutoCompleteApi, mock_get_dbb_client, mock_get_s3_client):
+    """
+    Test when prefixes are answered from the geofence names published by the scheduled build first, and from HERE
+    autosuggest once per cold prefix, without reading the tables
+    """
+
+    mock_get_s3_client().get_object.side_effect = ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'not found'}}, 'GetObject')
+    mock_get_dbb_client().query.side_effect = lambda **kwargs: {
+      'Items': [
+        {'id': {'S': 'id-1'}, 'version': {'N': '1'}, 'name': {'S': 'Seattle Store'}, 'address': {'S': '400 Pine St, Seattle'}},
+        {'id': {'S': 'id-2'}, 'version': {'N': '2'}, 'name': {'S': 'Main Street Store'}}
+      ] if kwargs['ExpressionAttributeValues'][':syncGroup']['S'].endswith('#0') else []
+    }
+    mock_GeocoderAutoCompleteApi().limit_results_byaddress.return_value = GeocoderAutoCompleteResponse().new_from_jsondict({
+      'items': [
+        {'title': 'Main St', 'address': {'label': 'Main St, Springfield, IL, United States'}},
+        {'title': 'Main Ave'}
+      ]
+    })
+
+    self.assertEqual(getCoordsFromAddress.handler({'operation': 'buildPrefixIndex', 'arguments': {}}, None), {'suggestions': 3, 'version': 2})
+    mock_get_dbb_client().scan.assert_not_called()
+    put_args = mock_get_s3_client().put_object.call_args[1]
+    self.assertEqual(put_args['Key'], 'prefix-index/suggestions.json.gz')
+    mock_get_s3_client().get_object.side_effect = lambda **kwargs: {'Body': io.BytesIO(put_args['Body'])}
+    mock_get_s3_client().get_object.reset_mock()
+    mock_get_dbb_client().query.reset_mock()
+
+    def autocomplete(prefix, limit):
+      event = {
+        'operation': 'autocompleteAddress',
+        'arguments': {'prefix': prefix, 'limit': limit}
+      }
+      return getCoordsFromAddress.handler(event, None)
+
+    self.assertEqual(autocomplete('SEA', 1), [{'label': 'Seattle Store', 'source': 'geofence'}])
+    self.assertEqual(autocomplete('ma', 5), [{'label': 'Main Street Store', 'source': 'geofence'}])
+    mock_GeocoderAutoCompleteApi().limit_results_byaddress.assert_not_called()
+
+    suggestions = autocomplete('Main', 5)
+    self.assertEqual([suggestion['label'] for suggestion in suggestions], ['Main Street Store', 'Main St, Springfield, IL, United States', 'Main Ave'])
+    self.assertEqual(mock_GeocoderAutoCompleteApi().limit_results_byaddress.call_args[0], ('Main', 'USA'))
+
+    self.assertEqual(autocomplete('main', 5), suggestions)
+    self.assertEqual(mock_GeocoderAutoCompleteApi().limit_results_byaddress.call_count, 1)
+    self.assertEqual(mock_get_s3_client().get_object.call_count, 1)
+    mock_get_dbb_client().query.assert_not_called()
+
+  @patch.dict(os.environ, {'SYNC_TABLE_NAME': 'geofence-sync-table', 'PREFIX_INDEX_BUCKET': 'geofence-data-bucket'})
+  @patch('getCoordsFromAddress.get_s3_client')
+  @patch('getCoordsFromAddress.get_dbb_client')
+  def test_build_prefix_index_incrementally(self, mock_get_dbb_client, mock_get_s3_client):
+    """
+    Test when the scheduled build applies only the sync table changes since the published version, and stops at the
+    maximum number of entries when loading the index
+    """
+
+    published = {
+      'version': 2,
+      'rebuiltAt': int(time.time()),
+      'geofences': {'id-1': ['Seattle Store'], 'id-2': ['Main Street Store']},
+      'addresses': ['Main St, Springfield, IL, United States']
+    }
+    mock_get_s3_client().get_object.return_value = {'Body': io.BytesIO(gzip.compress(json.dumps(published).encode('utf-8')))}
+    mock_get_dbb_client().query.side_effect = lambda **kwargs: {
+      'Items': [
+        {'id': {'S': 'id-1'}, 'version': {'N': '3'}, 'deleted': {'BOOL': True}},
+        {'id': {'S': 'id-3'}, 'version': {'N': '4'}, 'name': {'S': 'Market Store'}, 'deleted': {'BOOL': False}}
+      ] if kwargs['ExpressionAttributeValues'][':syncGroup']['S'].endswith('#0') else []
+    }
+
+    self.assertEqual(getCoordsFromAddress.handler({'operation': 'buildPrefixIndex', 'arguments': {}}, None), {'suggestions': 3, 'version': 4})
+    mock_get_dbb_client().scan.assert_not_called()
+    self.assertEqual(mock_get_dbb_client().query.call_args[1]['ExpressionAttributeValues'][':sinceVersion'], {'N': '2'})
+
+    put_args = mock_get_s3_client().put_object.call_args[1]
+    self.assertEqual(json.loads(gzip.decompress(put_args['Body'])), {
+      'version': 4,
+      'rebuiltAt': published['rebuiltAt'],
+      'geofences': {'id-2': ['Main Street Store'], 'id-3': ['Market Store']},
+      'addresses': ['Main St, Springfield, IL, United States']
+    })
+
+    mock_get_s3_client().get_object.return_value = {'Body': io.BytesIO(put_args['Body'])}
+    with patch('getCoordsFromAddress.max_trie_entries', 2):
+      prefix_index = getCoordsFromAddress.get_trie()
+
+    self.assertEqual(prefix_index['size'], 2)
+    self.assertEqual(getCoordsFromAddress.addressTrie.search(prefix_index, 'main st'), [{'label': 'Main Street Store', 'source': 'geofence'}])
+
+  @patch.dict(os.environ, {'PREFIX_INDEX_BUCKET': 'geofence-data-bucket'})
+  @patch('getCoordsFromAddress.get_s3_client')
+  @patch('herepy.GeocoderAutoCompleteApi')
+  def test_autocomplete_address_without_prefix_index(self, mock_GeocoderAutoCompleteApi, mock_get_s3_client):
+    """
+    Test when the prefix index was not published yet and the prefixes are answered by HERE autosuggest
+    """
+
+    mock_get_s3_client().get_object.side_effect = ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'not found'}}, 'GetObject')
+    mock_GeocoderAutoCompleteApi().limit_results_byaddress.return_value = GeocoderAutoCompleteResponse().new_from_jsondict({
+      'items': [{'title': 'Main St', 'address': {'label': 'Main St, Springfield, IL, United States'}}]
+    })
+
+    suggestions = getCoordsFromAddress.handler({'operation': 'autocompleteAddress', 'arguments': {'prefix': 'Main'}}, None)
+
+    self.assertEqual(suggestions, [{'label': 'Main St, Springfield, IL, United States', 'source': 'here'}])
+
 if __name__ == '__main__':
     unittest.main()    
     
\ No newline at end of file
@@ -0,0 +1,211 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Reader and writer of the compact gazetteer used to answer reverse geocoding requests offline, when HERE is slow or
+unavailable.
+
+The gazetteer file is memory-mapped on first use and indexed by a grid of 1 degree cells, so the nearest place of a
+location is found by looking at a few cells around it instead of every place. All values are little-endian:
+
+  header        magic 'GZTR', format (uint16), flags (uint16), count (uint32), names size (uint32)
+  cell offsets  uint32[180 * 360 + 1], index of the first place of each cell, cells ordered by row then column
+  latitudes     float32[count]
+  longitudes    float32[count]
+  name offsets  uint32[count + 1], offsets of each place names in the name dictionary
+  names         utf-8 'city<TAB>state<TAB>country' records, one after the other
+
+Places are sorted by cell, so the places of a cell are contiguous in every section.
+"""
+
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+magic = b'GZTR'
+gazetteer_format = 1
+header = struct.Struct('<4sHHII')
+grid_rows = 180
+grid_columns = 360
+max_search_rings = 3
+earth_radius = 6371008.8
+
+default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gazetteer.bin')
+
+gazetteer = None
+
+def get_cell(latitude, longitude):
+  """
+  Returns the grid cell of a location.
+  """
+
+  row = min(max(int(math.floor(latitude + 90)), 0), grid_rows - 1)
+  column = int(math.floor(longitude + 180)) % grid_columns
+  return row, column
+
+def pack_gazetteer(places):
+  """
+  Packs the places, a list of (latitude, longitude, city, state, country) tuples, into gazetteer bytes.
+  """
+
+  places = sorted(places, key = lambda place: get_cell(place[0], place[1]))
+  counts = [0] * (grid_rows * grid_columns)
+  for place in places:
+    row, column = get_cell(place[0], place[1])
+    counts[row * grid_columns + column] += 1
+
+  cell_offsets = array('I', [0])
+  for count in counts:
+    cell_offsets.append(cell_offsets[-1] + count)
+
+  latitudes = array('f', (place[0] for place in places))
+  longitudes = array('f', (place[1] for place in places))
+
+  encoded_names = ['\t'.join(name or '' for name in place[2:5]).encode('utf-8') for place in places]
+  names = b''.join(encoded_names)
+  name_offsets = array('I', [0])
+  for encoded_name in encoded_names:
+    name_offsets.append(name_offsets[-1] + len(encoded_name))
+
+  if sys.byteorder != 'little':
+    for values in (cell_offsets, latitudes, longitudes, name_offsets):
+      values.byteswap()
+
+  return b''.join([
+    header.pack(magic, gazetteer_format, 0, len(places), len(names)),
+    cell_offsets.tobytes(),
+    latitudes.tobytes(),
+    longitudes.tobytes(),
+    name_offsets.tobytes(),
+    names
+  ])
+
+def read_gazetteer(data):
+  """
+  Reads gazetteer bytes (or a memory map) and returns its sections, without copying them on little-endian machines.
+  """
+
+  buffer = memoryview(data)
+  gazetteer_magic, data_format, flags, count, names_size = header.unpack_from(buffer, 0)
+
+  if gazetteer_magic != magic or data_format != gazetteer_format:
+    raise ValueError('Not a gazetteer or unsupported gazetteer format')
+
+  offset = header.size
+  sections = {}
+
+  for name, typecode, length in (('cell_offsets', 'I', grid_rows * grid_columns + 1), ('latitudes', 'f', count), ('longitudes', 'f', count), ('name_offsets', 'I', count + 1)):
+    size = length * 4
+    sections[name] = cast_section(buffer[offset:offset + size], typecode)
+    offset += size
+
+  if len(buffer) != offset + names_size:
+    raise ValueError('Truncated gazetteer')
+
+  sections['count'] = count
+  sections['names'] = buffer[offset:offset + names_size]
+  return sections
+
+def cast_section(section, typecode):
+  """
+  Returns a little-endian section as a sequence of numbers, zero-copy when the machine is little-endian.
+  """
+
+  if sys.byteorder == 'little':
+    return section.cast(typecode)
+
+  values = array(typecode, section.tobytes())
+  values.byteswap()
+  return values
+
+def load(path = None):
+  """
+  Returns the gazetteer, memory-mapping its file on first use, or None when there is no gazetteer file.
+  """
+
+  global gazetteer
+
+  if gazetteer is None:
+    path = path or os.environ.get('GAZETTEER_PATH', default_path)
+    if not os.path.exists(path):
+      return None
+
+    with open(path, 'rb') as gazetteer_file:
+      gazetteer = read_gazetteer(mmap.mmap(gazetteer_file.fileno(), 0, access = mmap.ACCESS_READ))
+
+  return gazetteer
+
+def find_nearest(gazetteer, latitude, longitude):
+  """
+  Returns the nearest place of a location as (city, state, country, distance in meters), or None when there is no
+  place within a few cells of the location.
+
+  Cells are searched in rings around the cell of the location. Once a place is found, one more ring is searched since
+  a place in the next ring can still be closer than the one found.
+  """
+
+  row, column = get_cell(latitude, longitude)
+  cell_offsets = gazetteer['cell_offsets']
+  latitudes = gazetteer['latitudes']
+  longitudes = gazetteer['longitudes']
+
+  best_index = None
+  best_distance = math.inf
+  last_ring = max_search_rings
+
+  for ring in range(max_search_rings + 1):
+    if ring > last_ring:
+      break
+
+    for ring_row in range(row - ring, row + ring + 1):
+      if ring_row < 0 or ring_row >= grid_rows:
+        continue
+
+      for ring_column in range(column - ring, column + ring + 1):
+        # only the border of the ring, the inner cells were searched already
+        if ring and abs(ring_row - row) != ring and abs(ring_column - column) != ring:
+          continue
+
+        cell = ring_row * grid_columns + ring_column % grid_columns
+        for index in range(cell_offsets[cell], cell_offsets[cell + 1]):
+          place_distance = distance(latitude, longitude, latitudes[index], longitudes[index])
+          if place_distance < best_distance:
+            best_index = index
+            best_distance = place_distance
+
+    if best_index is not None and last_ring == max_search_rings:
+      last_ring = min(ring + 1, max_search_rings)
+
+  if best_index is None:
+    return None
+
+  name_offsets = gazetteer['name_offsets']
+  city, state, country = bytes(gazetteer['names'][name_offsets[best_index]:name_offsets[best_index + 1]]).decode('utf-8').split('\t')
+  return city, state, country, best_distance
+
+def distance(latitude1, longitude1, latitude2, longitude2):
+  """
+  Returns the haversine distance in meters between two locations.
+  """
+
+  lat1 = math.radians(latitude1)
+  lat2 = math.radians(latitude2)
+  a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2
+  return 2 * earth_radius * math.asin(min(1.0, math.sqrt(a)))
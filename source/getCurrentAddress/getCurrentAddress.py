@@ -17,12 +17,31 @@
 
 """
 Lambda function used as an AWS AppSync datasource to return an address based in the coordinates passed as parameter.
+
+Coordinates are quantized to a geohash cell of a configurable precision, and the address resolved for a cell is cached
+in the container and in the geocoding cache table, so devices reporting from the same block do not call the HERE API
+again.
+
+When HERE fails, the city, state and country are answered from the nearest place of the local gazetteer shipped with
+the function, and the address is flagged as approximate.
+
+The HERE clients are imported on the first cache miss only, so the containers answering from the cache do not pay for
+them at cold start.
 """
 
 import json
-import uuid 
 import os
-import herepy
+import time
+import boto3
+
+import geohash
+import geocodingCache
+import gazetteer
+
+default_geohash_precision = 7
+default_cache_ttl_seconds = 30 * 24 * 60 * 60
+
+dbb_client = None
 
 def handler(event, context):
     """
@@ -35,22 +54,99 @@ def handler(event, context):
     latitude = float(event['arguments']['coordinates']['latitude'])
     longitude = float(event['arguments']['coordinates']['longitude'])
 
-    here_api_key = os.environ['HERE_API_KEY']
-    geocoder_reverse_api = herepy.GeocoderReverseApi(here_api_key)
-    response_here = geocoder_reverse_api.retrieve_addresses([latitude,longitude])
+    cache_table_name = os.environ.get('GEOCODING_CACHE_TABLE')
+    cache_client = get_dbb_client() if cache_table_name else None
+    cell = geohash.encode(latitude, longitude, int(os.environ.get('GEOHASH_PRECISION', default_geohash_precision)))
+    cache_key = geocodingCache.create_key('reverse', cell)
+    address, cache_tier = geocodingCache.get(cache_client, cache_table_name, cache_key)
+
+    metrics = {
+      'CacheHit': (1 if address else 0, 'Count'),
+      'MemoryCacheHit': (1 if cache_tier == 'memory' else 0, 'Count'),
+      'TableCacheHit': (1 if cache_tier == 'table' else 0, 'Count')
+    }
+
+    if not address:
+      import requests
+      import herepy
+      import hereClient
+
+      started = time.perf_counter()
+
+      try:
+        address = reverse_geocode(latitude, longitude)
+      except (requests.exceptions.RequestException, herepy.HEREError, hereClient.CircuitOpenError) as ex:
+        address = approximate_address(latitude, longitude)
+        if not address:
+          raise
+
+        print(f'HERE reverse geocoding failed, approximate address returned: {type(ex).__name__}: {ex}')
+        metrics['GazetteerFallback'] = (1, 'Count')
+      else:
+        metrics['UpstreamLatency'] = ((time.perf_counter() - started) * 1000, 'Milliseconds')
+        geocodingCache.put(cache_client, cache_table_name, cache_key, address, int(os.environ.get('CACHE_TTL_SECONDS', default_cache_ttl_seconds)))
+
+    geocodingCache.emit_metrics('getCurrentAddress', metrics)
+
+    print('response: {}'.format(json.dumps(address)))    
+    return address
+
+def reverse_geocode(latitude, longitude):
+    """
+    Gets the address of the coordinates from the Geocoder Reverse HERE API.
+    """
+
+    import herepy
+    import hereClient
+
+    response_here = hereClient.call(hereClient.get_client(herepy.GeocoderReverseApi).retrieve_addresses, [latitude,longitude])
     
     response_location = response_here.items[0]
     response_address = response_location['address'] 
     response_location = response_location['position']
     
-    address = {
+    return {
       'street': response_address['label'],
       'city': response_address['city'],
       'state': response_address['state'],
       'country': response_address['countryCode'],
       'latitude': response_location['lat'],
-      'longitude': response_location['lng']
+      'longitude': response_location['lng'],
+      'approximate': False
     }
-  
-    print('response: {}'.format(json.dumps(address)))    
-    return address
+
+def approximate_address(latitude, longitude):
+    """
+    Returns the address of the nearest place of the local gazetteer, or None when there is no gazetteer or no place
+    near the coordinates. The street is unknown and the coordinates are the ones of the device.
+    """
+
+    places = gazetteer.load()
+    nearest = gazetteer.find_nearest(places, latitude, longitude) if places else None
+
+    if not nearest:
+      return None
+
+    city, state, country, distance = nearest
+
+    return {
+      'street': None,
+      'city': city,
+      'state': state,
+      'country': country,
+      'latitude': latitude,
+      'longitude': longitude,
+      'approximate': True
+    }
+
+def get_dbb_client():
+    """
+    Returns the Amazon DynamoDB client, creating it only once per container.
+    """
+
+    global dbb_client
+
+    if dbb_client is None:
+      dbb_client = boto3.client('dynamodb')
+
+    return dbb_client
@@ -21,6 +21,12 @@ from unittest.mock import Mock, patch
 import os
 import json
 import getCurrentAddress
+import geocodingCache
+import hereClient
+import gazetteer
+import tempfile
+import requests
+from botocore.exceptions import ClientError
 from herepy.models import GeocoderReverseResponse
 
 class TestGetCurrentAddress(unittest.TestCase):
@@ -30,12 +36,20 @@ class TestGetCurrentAddress(unittest.TestCase):
 
   ENV_HERE_API_KEY = 'HERE_API_KEY'
   HERE_API_KEY = 'some-sample-key'
+  ENV_GEOCODING_CACHE_TABLE = 'GEOCODING_CACHE_TABLE'
+  GEOCODING_CACHE_TABLE = 'geocoding-cache-table'
+  ENV_GEOHASH_PRECISION = 'GEOHASH_PRECISION'
 
   def setUp(self):
     """
     Setting up the test case
     """
     os.environ[TestGetCurrentAddress.ENV_HERE_API_KEY] = TestGetCurrentAddress.HERE_API_KEY
+    os.environ.pop(TestGetCurrentAddress.ENV_GEOCODING_CACHE_TABLE, None)
+    os.environ.pop(TestGetCurrentAddress.ENV_GEOHASH_PRECISION, None)
+    geocodingCache.lru.clear()
+    hereClient.clients.clear()
+    hereClient.breaker.update({'failures': 0, 'open_until': 0.0, 'probing': False})
   
   @patch('herepy.GeocoderReverseApi')
   def test_get_current_address_successfully(self, mock_GeocoderReverseApi):
@@ -89,6 +103,109 @@ class TestGetCurrentAddress(unittest.TestCase):
     self.assertEqual(returned_address['latitude'], -11.1234567)
     self.assertEqual(returned_address['longitude'], -99.0987654)
 
+  @patch('getCurrentAddress.get_dbb_client')
+  @patch('herepy.GeocoderReverseApi')
+  def test_get_current_address_cached_by_geohash(self, mock_GeocoderReverseApi, mock_get_dbb_client):
+    """
+    Test when coordinates in the same geohash cell are resolved once, and coordinates in another cell call HERE again
+    """
+
+    os.environ[TestGetCurrentAddress.ENV_GEOCODING_CACHE_TABLE] = TestGetCurrentAddress.GEOCODING_CACHE_TABLE
+    os.environ[TestGetCurrentAddress.ENV_GEOHASH_PRECISION] = '7'
+
+    returned_address = {
+      'items': [{
+        'address': {
+          'label': 'some_address',
+          'city': 'some_city',
+          'state': 'some_state',
+          'countryCode': 'some_country_code'
+        },
+        'position': {
+          'lat': 57.64911,
+          'lng': 10.40744
+        }
+      }]
+    }
+
+    mock_GeocoderReverseApi().retrieve_addresses.return_value = GeocoderReverseResponse().new_from_jsondict(returned_address)
+    mock_get_dbb_client().get_item.return_value = {}
+
+    def create_event(latitude, longitude):
+      return {'arguments': {'coordinates': {'latitude': latitude, 'longitude': longitude}}}
+
+    getCurrentAddress.handler(create_event(57.64911, 10.40744), None)
+    returned_address = getCurrentAddress.handler(create_event(57.64915, 10.40750), None)
+
+    self.assertEqual(mock_GeocoderReverseApi().retrieve_addresses.call_count, 1)
+    self.assertEqual(returned_address['city'], 'some_city')
+    self.assertEqual(mock_get_dbb_client().put_item.call_args[1]['Item']['cacheKey'], {'S': 'reverse#u4pruyd'})
+
+    getCurrentAddress.handler(create_event(57.66, 10.45), None)
+    self.assertEqual(mock_GeocoderReverseApi().retrieve_addresses.call_count, 2)
+
+  @patch('getCurrentAddress.get_dbb_client')
+  @patch('herepy.GeocoderReverseApi')
+  def test_get_current_address_cache_table_throttled(self, mock_GeocoderReverseApi, mock_get_dbb_client):
+    """
+    Test when the cache table throttles and HERE fails, the address is still answered from the local gazetteer
+    """
+
+    os.environ[TestGetCurrentAddress.ENV_GEOCODING_CACHE_TABLE] = TestGetCurrentAddress.GEOCODING_CACHE_TABLE
+
+    throttled = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'throttled'}}, 'GetItem')
+    mock_get_dbb_client().get_item.side_effect = throttled
+    mock_GeocoderReverseApi().retrieve_addresses.side_effect = requests.exceptions.ReadTimeout('read timed out')
+
+    with tempfile.NamedTemporaryFile(suffix = '.bin') as gazetteer_file:
+      gazetteer_file.write(gazetteer.pack_gazetteer([(40.7128, -74.0060, 'New York', 'New York', 'USA')]))
+      gazetteer_file.flush()
+
+      with patch.dict(os.environ, {'GAZETTEER_PATH': gazetteer_file.name}), patch.object(gazetteer, 'gazetteer', None):
+        returned_address = getCurrentAddress.handler({'arguments': {'coordinates': {'latitude': 40.73, 'longitude': -73.99}}}, None)
+
+    self.assertEqual(returned_address['city'], 'New York')
+    self.assertTrue(returned_address['approximate'])
+    mock_GeocoderReverseApi().retrieve_addresses.assert_called_once()
+
+  @patch('herepy.GeocoderReverseApi')
+  def test_get_current_address_from_gazetteer(self, mock_GeocoderReverseApi):
+    """
+    Test when HERE fails and the approximate address is answered from the local gazetteer
+    """
+
+    places = [
+      (40.7128, -74.0060, 'New York', 'New York', 'USA'),
+      (40.7282, -73.7949, 'Queens', 'New York', 'USA'),
+      (34.0522, -118.2437, 'Los Angeles', 'California', 'USA')
+    ]
+
+    with tempfile.NamedTemporaryFile(suffix = '.bin') as gazetteer_file:
+      gazetteer_file.write(gazetteer.pack_gazetteer(places))
+      gazetteer_file.flush()
+
+      mock_GeocoderReverseApi().retrieve_addresses.side_effect = requests.exceptions.ConnectTimeout('connect timed out')
+
+      event = {
+        'arguments': {
+          'coordinates': {
+            'latitude': 40.73,
+            'longitude': -73.99
+          }
+        }
+      }
+
+      with patch.dict(os.environ, {'GAZETTEER_PATH': gazetteer_file.name}), patch.object(gazetteer, 'gazetteer', None):
+        returned_address = getCurrentAddress.handler(event, None)
+
+        self.assertEqual(returned_address['city'], 'New York')
+        self.assertEqual(returned_address['country'], 'USA')
+        self.assertIsNone(returned_address['street'])
+        self.assertEqual(returned_address['latitude'], 40.73)
+        self.assertTrue(returned_address['approximate'])
+        self.assertEqual(gazetteer.find_nearest(gazetteer.gazetteer, 40.75, -73.80)[0], 'Queens')
+        self.assertIsNone(gazetteer.find_nearest(gazetteer.gazetteer, -33.87, 151.21))
+
 if __name__ == '__main__':
     unittest.main()    
     
\ No newline at end of file
@@ -0,0 +1,500 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Lambda function used to import geofences in bulk from a CSV or GeoJSON file uploaded to the imports/ folder of the
+geofence data bucket.
+
+The file is streamed from Amazon S3 and processed row by row, so the memory used does not depend on its size. Valid rows
+are written to the geofences table with BatchWriteItem, in chunks of 25 items sent by a small thread pool, and rows
+without coordinates are geocoded with the HERE API. The geofences already in the table are updated instead, keeping
+their visits count. A JSON report with the progress and the rejected rows is written
+to the reports/ folder of the bucket while the import runs.
+
+Rows without an id get one derived from their name and coordinates, so importing a file again, to resume an INCOMPLETE
+or FAILED import for example, updates the geofences already imported instead of duplicating them.
+
+CSV files have a header row with the geofence fields (id, name, branch, address, city, country, region, latitude,
+longitude, definition). GeoJSON files are a FeatureCollection, or one Feature per line, with the fields as properties
+and a Point or Polygon geometry.
+"""
+
+import codecs
+import json
+import os
+import re
+import time
+import uuid
+import random
+import datetime
+import posixpath
+from collections import OrderedDict
+from urllib.parse import unquote_plus
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import csv
+import boto3
+import herepy
+
+import hereClient
+
+batch_write_size = 25
+# calls of a batch request before its unprocessed items are reported as failed
+max_write_attempts = 8
+default_concurrency = 4
+progress_interval = 5000
+max_reported_errors = 1000
+read_chunk_size = 64 * 1024
+# time kept to write the report before the Lambda times out
+time_budget_margin_seconds = 30
+# addresses whose coordinates are kept while importing a file, the least recently used being dropped first
+max_geocoded_addresses = 5000
+# namespace of the ids derived from the name and coordinates of the rows without one
+geofence_id_namespace = uuid.UUID('b818ba2e-6139-49a8-9d9f-be57a804cbcb')
+
+fields = ['id', 'name', 'branch', 'address', 'city', 'country', 'region', 'latitude', 'longitude', 'definition']
+number_fields = ['latitude', 'longitude']
+definition_pattern = re.compile(r'^\s*(RADIUS\s*:\s*\(\s*[0-9.]+\s*\)|POLYGON\s*:\s*\(.+\))\s*$', re.IGNORECASE | re.DOTALL)
+
+def handler(event, context):
+  """
+  Main handler function, invoked by the Amazon S3 event of an uploaded file or directly with the bucket and key of the
+  file to import. A direct invocation can set startRow to resume an import stopped by the Lambda time budget.
+  """
+
+  print('Request: {}'.format(json.dumps(event)))
+
+  if 'Records' in event:
+    imports = [(record['s3']['bucket']['name'], unquote_plus(record['s3']['object']['key']), 0) for record in event['Records']]
+  else:
+    imports = [(event['bucket'], event['key'], int(event.get('startRow', 0)))]
+
+  return [import_geofences(bucket, key, start_row, context) for bucket, key, start_row in imports]
+
+def import_geofences(bucket, key, start_row, context):
+  """
+  Imports the geofences of a file and returns the import report.
+  """
+
+  s3_client = boto3.client('s3')
+  dbb_client = boto3.client('dynamodb')
+  dbb_table_name = os.environ['DBB_TABLE_NAME']
+  deadline = None if context is None else time.monotonic() + context.get_remaining_time_in_millis() / 1000 - time_budget_margin_seconds
+
+  report = {
+    'bucket': bucket,
+    'key': key,
+    'status': 'IN_PROGRESS',
+    'startRow': start_row,
+    'lastRow': start_row,
+    'imported': 0,
+    'rejected': 0,
+    'errors': []
+  }
+  report_key = 'reports/' + posixpath.basename(key) + '.json'
+
+  body = s3_client.get_object(Bucket = bucket, Key = key)['Body']
+  if key.lower().endswith(('.geojsonl', '.ndjson')):
+    rows = read_geojson(body, line_delimited = True)
+  elif key.lower().endswith(('.geojson', '.json')):
+    rows = read_geojson(body)
+  else:
+    rows = read_csv(body)
+
+  concurrency = int(os.environ.get('IMPORT_CONCURRENCY', default_concurrency))
+  executor = ThreadPoolExecutor(max_workers = concurrency)
+  pending = set()
+  chunk = {}
+  geocoded = OrderedDict()
+
+  def flush():
+    nonlocal pending
+    if len(pending) >= concurrency * 2:
+      done, pending = wait(pending, return_when = FIRST_COMPLETED)
+      for future in done:
+        record_write(report, future)
+    pending.add(executor.submit(write_items, dbb_client, dbb_table_name, list(chunk.values())))
+    chunk.clear()
+
+  try:
+    for row_number, row in enumerate(rows, start = 1):
+      if row_number <= start_row:
+        continue
+
+      if deadline is not None and time.monotonic() > deadline:
+        report['status'] = 'INCOMPLETE'
+        break
+
+      report['lastRow'] = row_number
+
+      try:
+        item = create_item(validate_row(row, geocoded))
+      except ValueError as ex:
+        add_error(report, row_number, str(ex))
+        continue
+
+      # the same id twice in a BatchWriteItem request is rejected
+      if item['id']['S'] in chunk:
+        flush()
+      chunk[item['id']['S']] = (row_number, item)
+
+      if len(chunk) == batch_write_size:
+        flush()
+
+      if row_number % progress_interval == 0:
+        print(f"Row {row_number}: {report['imported']} geofences imported, {report['rejected']} rows rejected")
+        put_report(s3_client, bucket, report_key, report)
+
+  except (ValueError, UnicodeDecodeError, csv.Error) as ex:
+    # the file itself can not be read any further, the rows read so far are still written
+    report['status'] = 'FAILED'
+    add_error(report, report['lastRow'] + 1, f'{type(ex).__name__}: {ex}')
+
+  if chunk:
+    flush()
+
+  for future in pending:
+    record_write(report, future)
+  executor.shutdown()
+
+  if report['status'] == 'IN_PROGRESS':
+    report['status'] = 'COMPLETED'
+
+  put_report(s3_client, bucket, report_key, report)
+  print(f"Import of {bucket}/{key} {report['status']}: {report['imported']} geofences imported, {report['rejected']} rows rejected")
+  return report
+
+def read_csv(body):
+  """
+  Yields the rows of a CSV file as dicts, decoding the Amazon S3 stream on the fly.
+  """
+
+  lines = codecs.getreader('utf-8-sig')(body)
+  for row in csv.DictReader(lines):
+    yield {k.strip(): v for k, v in row.items() if k}
+
+def read_geojson(body, line_delimited = False):
+  """
+  Yields the properties of each feature of a GeoJSON file, with the coordinates or the definition taken from its
+  geometry.
+
+  The features of a FeatureCollection are decoded one at a time from the stream, so only the feature being read is kept
+  in memory. Files with one feature per line are read the same way once line_delimited is set.
+  """
+
+  decoder = json.JSONDecoder()
+  reader = codecs.getincrementaldecoder('utf-8-sig')()
+  buffer = ''
+  position = 0
+  in_features = line_delimited
+  chunk = True
+
+  while chunk:
+    chunk = body.read(read_chunk_size)
+    buffer = buffer[position:] + reader.decode(chunk or b'', final = not chunk)
+    position = 0
+
+    if not in_features:
+      match = re.search(r'"features"\s*:\s*\[', buffer)
+      if not match:
+        continue
+      in_features = True
+      position = match.end()
+
+    while True:
+      # skips the separators between the features
+      while position < len(buffer) and buffer[position] in ' \t\r\n,':
+        position += 1
+
+      if position == len(buffer) or (buffer[position] == ']' and not line_delimited):
+        break
+
+      try:
+        feature, position = decoder.raw_decode(buffer, position)
+      except ValueError:
+        if not chunk:
+          raise ValueError(f'Invalid GeoJSON feature: {buffer[position:position + 100]}')
+        # the feature is not complete yet, more data is needed
+        break
+
+      yield feature_to_row(feature)
+
+    if not line_delimited and position < len(buffer) and buffer[position] == ']':
+      return
+
+  if not in_features:
+    raise ValueError('No features found in the GeoJSON file')
+
+def feature_to_row(feature):
+  """
+  Converts a GeoJSON feature to a row with the geofence fields.
+  """
+
+  row = dict(feature.get('properties') or {})
+  geometry = feature.get('geometry') or {}
+
+  if geometry.get('type') == 'Point':
+    row.setdefault('longitude', geometry['coordinates'][0])
+    row.setdefault('latitude', geometry['coordinates'][1])
+  elif geometry.get('type') == 'Polygon':
+    ring = geometry['coordinates'][0]
+    if len(ring) > 1 and ring[0] == ring[-1]:
+      ring = ring[:-1]
+    row.setdefault('definition', 'POLYGON:(' + ', '.join(f'{lat} {lon}' for lon, lat in ring) + ')')
+    row.setdefault('longitude', sum(lon for lon, lat in ring) / len(ring))
+    row.setdefault('latitude', sum(lat for lon, lat in ring) / len(ring))
+
+  return row
+
+def validate_row(row, geocoded):
+  """
+  Returns the geofence fields of a row, geocoding its address when the coordinates are missing. Raises a ValueError
+  describing the first problem found.
+  """
+
+  geofence = {field: row[field] for field in fields if row.get(field) not in (None, '')}
+
+  if 'name' not in geofence:
+    raise ValueError('name is required')
+  if 'definition' not in geofence or not definition_pattern.match(str(geofence['definition'])):
+    raise ValueError("definition must be 'RADIUS:(meters)' or 'POLYGON:(lat lng, ...)'")
+
+  if 'latitude' not in geofence or 'longitude' not in geofence:
+    if 'address' not in geofence:
+      raise ValueError('latitude and longitude, or an address to geocode, are required')
+    geofence.update(geocode_address(geofence, geocoded))
+
+  for field in number_fields:
+    try:
+      geofence[field] = float(geofence[field])
+    except (TypeError, ValueError):
+      raise ValueError(f'{field} must be a number')
+
+  if abs(geofence['latitude']) > 90 or abs(geofence['longitude']) > 180:
+    raise ValueError('latitude or longitude out of range')
+
+  return geofence
+
+def geocode_address(geofence, geocoded):
+  """
+  Returns the coordinates of the address of a geofence from the Geocoder HERE API. Addresses repeated in the file are
+  geocoded once, as long as they are among the last max_geocoded_addresses ones.
+  """
+
+  search_text = ', '.join(str(geofence[field]) for field in ('address', 'city', 'region', 'country') if field in geofence)
+
+  if search_text in geocoded:
+    geocoded.move_to_end(search_text)
+  else:
+    try:
+      response_here = hereClient.call(hereClient.get_client(herepy.GeocoderApi).free_form, search_text)
+      position = response_here.items[0]['position']
+      geocoded[search_text] = {'latitude': position['lat'], 'longitude': position['lng']}
+    except IndexError:
+      geocoded[search_text] = None
+    except Exception as ex:
+      raise ValueError(f'address could not be geocoded: {type(ex).__name__}: {ex}')
+
+    if len(geocoded) > max_geocoded_addresses:
+      geocoded.popitem(last = False)
+
+  if geocoded[search_text] is None:
+    raise ValueError(f'address not found: {search_text}')
+
+  return geocoded[search_text]
+
+def create_item(geofence):
+  """
+  Creates the geofences table item, with the same attributes the AWS AppSync createGeofence resolver sets.
+  """
+
+  now = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+  item = {
+    'id': {'S': str(geofence.get('id') or create_id(geofence))},
+    'visits': {'N': '0'},
+    'createdAt': {'S': now},
+    'updatedAt': {'S': now},
+    '__typename': {'S': 'Geofence'}
+  }
+
+  for field, value in geofence.items():
+    if field != 'id':
+      item[field] = {'N': repr(value)} if field in number_fields else {'S': str(value)}
+
+  return item
+
+def create_id(geofence):
+  """
+  Returns the id of a geofence imported without one, the same for every import of the same name and coordinates.
+  """
+
+  return str(uuid.uuid5(geofence_id_namespace, f"{geofence['name']}|{geofence['latitude']!r}|{geofence['longitude']!r}"))
+
+def write_items(dbb_client, dbb_table_name, rows):
+  """
+  Writes up to 25 items and returns the number of items written and the rows that failed.
+
+  The geofences not in the table yet are written with BatchWriteItem. The existing ones are updated one by one instead,
+  so their visits count and creation date are kept when a file is imported again.
+  """
+
+  try:
+    existing_ids = get_existing_ids(dbb_client, dbb_table_name, [item['id']['S'] for row_number, item in rows])
+  except Exception as ex:
+    return 0, [(row_number, f'{type(ex).__name__}: {ex}') for row_number, item in rows]
+
+  new_rows = [(row_number, item) for row_number, item in rows if item['id']['S'] not in existing_ids]
+  failures = put_items(dbb_client, dbb_table_name, new_rows) if new_rows else []
+
+  for row_number, item in rows:
+    if item['id']['S'] in existing_ids:
+      try:
+        dbb_client.update_item(**create_update_args(dbb_table_name, item))
+      except Exception as ex:
+        failures.append((row_number, f'{type(ex).__name__}: {ex}'))
+
+  return len(rows) - len(failures), failures
+
+def get_existing_ids(dbb_client, dbb_table_name, ids):
+  """
+  Returns the ids already in the geofences table, read with BatchGetItem. The ids still unprocessed after
+  max_write_attempts calls are returned too, updating a geofence being as safe as creating it.
+  """
+
+  request_items = {
+    dbb_table_name: {
+      'Keys': [{'id': {'S': geofence_id}} for geofence_id in ids],
+      'ProjectionExpression': 'id'
+    }
+  }
+  existing_ids = set()
+
+  for attempt in range(max_write_attempts):
+    response_batch = dbb_client.batch_get_item(RequestItems = request_items)
+    existing_ids.update(item['id']['S'] for item in response_batch.get('Responses', {}).get(dbb_table_name, []))
+    request_items = response_batch.get('UnprocessedKeys')
+
+    if not request_items:
+      return existing_ids
+    backoff(attempt)
+
+  return existing_ids | {key['id']['S'] for key in request_items[dbb_table_name]['Keys']}
+
+def put_items(dbb_client, dbb_table_name, rows):
+  """
+  Writes the items with BatchWriteItem, retrying the unprocessed items up to max_write_attempts calls with a jittered
+  exponential backoff. Returns the rows that failed.
+  """
+
+  request_items = {
+    dbb_table_name: [{'PutRequest': {'Item': item}} for row_number, item in rows]
+  }
+
+  try:
+    for attempt in range(max_write_attempts):
+      response_batch = dbb_client.batch_write_item(RequestItems = request_items)
+      request_items = response_batch.get('UnprocessedItems')
+
+      if not request_items:
+        return []
+      backoff(attempt)
+  except Exception as ex:
+    return [(row_number, f'{type(ex).__name__}: {ex}') for row_number, item in rows]
+
+  unprocessed_ids = {request['PutRequest']['Item']['id']['S'] for request in request_items[dbb_table_name]}
+  return [(row_number, f'UnprocessedItems: not written after {max_write_attempts} attempts') for row_number, item in rows if item['id']['S'] in unprocessed_ids]
+
+def backoff(attempt):
+  """
+  Sleeps before the next attempt of a throttled batch request, a random time up to an exponential bound (full jitter).
+  """
+
+  time.sleep(random.uniform(0, min(0.05 * (2 ** (attempt + 1)), 2)))
+
+def create_update_args(dbb_table_name, item):
+  """
+  Creates the UpdateItem arguments of an existing geofence: the imported fields are set, the ones missing from the row
+  removed, and the visits count and creation date set only when missing.
+  """
+
+  expression_names = {}
+  expression_values = {}
+  set_expressions = []
+
+  for name, value in item.items():
+    if name == 'id':
+      continue
+
+    expression_names[f'#{name}'] = name
+    expression_values[f':{name}'] = value
+
+    if name in ('visits', 'createdAt'):
+      set_expressions.append(f'#{name} = if_not_exists(#{name}, :{name})')
+    else:
+      set_expressions.append(f'#{name} = :{name}')
+
+  remove_expressions = []
+  for name in fields:
+    if name != 'id' and name not in item:
+      expression_names[f'#{name}'] = name
+      remove_expressions.append(f'#{name}')
+
+  update_expression = 'SET ' + ', '.join(set_expressions)
+  if remove_expressions:
+    update_expression += ' REMOVE ' + ', '.join(remove_expressions)
+
+  return {
+    'TableName': dbb_table_name,
+    'Key': {
+      'id': item['id']
+    },
+    'UpdateExpression': update_expression,
+    'ExpressionAttributeNames': expression_names,
+    'ExpressionAttributeValues': expression_values
+  }
+
+def record_write(report, future):
+  """
+  Adds the result of a BatchWriteItem chunk to the report.
+  """
+
+  imported, failures = future.result()
+  report['imported'] += imported
+  for row_number, message in failures:
+    add_error(report, row_number, message)
+
+def add_error(report, row_number, message):
+  """
+  Adds a rejected row to the report, keeping the first max_reported_errors errors only.
+  """
+
+  report['rejected'] += 1
+  if len(report['errors']) < max_reported_errors:
+    report['errors'].append({'row': row_number, 'error': message})
+
+def put_report(s3_client, bucket, report_key, report):
+  """
+  Writes the import report to the reports/ folder of the bucket of the imported file.
+  """
+
+  s3_client.put_object(
+    Bucket = bucket,
+    Key = report_key,
+    Body = json.dumps(report, indent = 2).encode('utf-8'),
+    ContentType = 'application/json'
+  )
@@ -0,0 +1,289 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+import unittest
+from unittest.mock import Mock, patch
+
+import io
+import os
+import json
+import importGeofences
+import hereClient
+from herepy.models import GeocoderResponse
+
+class TestImportGeofences(unittest.TestCase):
+  """
+  Test class for the ImportGeofences function
+  """
+
+  ENV_DBB_TABLE_NAME = 'DBB_TABLE_NAME'
+  DBB_TABLE_NAME = 'some-geofences-table'
+  ENV_HERE_API_KEY = 'HERE_API_KEY'
+  HERE_API_KEY = 'some-sample-key'
+  BUCKET = 'some-geofence-data-bucket'
+
+  def setUp(self):
+    """
+    Setting up the test case
+    """
+    os.environ[TestImportGeofences.ENV_DBB_TABLE_NAME] = TestImportGeofences.DBB_TABLE_NAME
+    os.environ[TestImportGeofences.ENV_HERE_API_KEY] = TestImportGeofences.HERE_API_KEY
+    hereClient.clients.clear()
+    hereClient.breaker.update({'failures': 0, 'open_until': 0.0, 'probing': False})
+
+  def create_clients(self, mock_boto3_client, content):
+    """
+    Returns the mocked Amazon S3 and Amazon DynamoDB clients, with the S3 client serving the file content
+    """
+    s3_client = Mock()
+    s3_client.get_object.return_value = {'Body': io.BytesIO(content.encode('utf-8'))}
+    dbb_client = Mock()
+    dbb_client.batch_write_item.return_value = {'UnprocessedItems': {}}
+    dbb_client.batch_get_item.return_value = {'Responses': {TestImportGeofences.DBB_TABLE_NAME: []}}
+    mock_boto3_client.side_effect = lambda service: s3_client if service == 's3' else dbb_client
+    return s3_client, dbb_client
+
+  def get_report(self, s3_client):
+    """
+    Returns the last report written to Amazon S3
+    """
+    return json.loads(s3_client.put_object.call_args[1]['Body'])
+
+  @patch('herepy.GeocoderApi')
+  @patch('boto3.client')
+  def test_import_csv_successfully(self, mock_boto3_client, mock_GeocoderApi):
+    """
+    Test when importing a CSV file with a row to geocode and an invalid row
+    """
+
+    content = '﻿' + '\n'.join([
+      'id,name,branch,address,city,country,region,latitude,longitude,definition',
+      'geofence-1,Some Store,Main,,,,,40.7128,-74.006,RADIUS:(100)',
+      'geofence-2,Other Store,Downtown,5th Avenue,New York,USA,NY,,,RADIUS:(50)',
+      ',Missing Definition,,,,,,40.7,-74.0,'
+    ])
+    s3_client, dbb_client = self.create_clients(mock_boto3_client, content)
+
+    mock_GeocoderApi().free_form.return_value = GeocoderResponse().new_from_jsondict({
+      'items': [{'position': {'lat': 40.7736, 'lng': -73.9655}}]
+    })
+
+    event = {
+      'Records': [{
+        's3': {
+          'bucket': {'name': TestImportGeofences.BUCKET},
+          'object': {'key': 'imports/some+stores.csv'}
+        }
+      }]
+    }
+
+    report = importGeofences.handler(event, None)[0]
+
+    self.assertEqual(report['status'], 'COMPLETED')
+    self.assertEqual(report['imported'], 2)
+    self.assertEqual(report['rejected'], 1)
+    self.assertEqual(report['errors'][0]['row'], 3)
+    self.assertEqual(report['lastRow'], 3)
+
+    s3_client.get_object.assert_called_once_with(Bucket = TestImportGeofences.BUCKET, Key = 'imports/some stores.csv')
+    self.assertEqual(s3_client.put_object.call_args[1]['Key'], 'reports/some stores.csv.json')
+    self.assertEqual(self.get_report(s3_client)['imported'], 2)
+
+    request_items = dbb_client.batch_write_item.call_args[1]['RequestItems'][TestImportGeofences.DBB_TABLE_NAME]
+    items = [request['PutRequest']['Item'] for request in request_items]
+    self.assertEqual(items[0]['id'], {'S': 'geofence-1'})
+    self.assertEqual(items[0]['visits'], {'N': '0'})
+    self.assertEqual(items[1]['latitude'], {'N': '40.7736'})
+    self.assertEqual(items[1]['__typename'], {'S': 'Geofence'})
+    mock_GeocoderApi().free_form.assert_called_once_with('5th Avenue, New York, NY, USA')
+
+  @patch('herepy.GeocoderApi')
+  @patch('boto3.client')
+  def test_import_rows_without_id_again(self, mock_boto3_client, mock_GeocoderApi):
+    """
+    Test when a file with rows without id is imported again, the rows getting the same ids, and when the addresses
+    geocoded are more than the ones kept while importing
+    """
+
+    content = '\n'.join([
+      'name,address,latitude,longitude,definition',
+      'Some Store,,40.7128,-74.006,RADIUS:(100)',
+      'Other Store,5th Avenue,,,RADIUS:(50)',
+      'Third Store,Broadway,,,RADIUS:(50)',
+      'Fourth Store,5th Avenue,,,RADIUS:(50)'
+    ])
+
+    mock_GeocoderApi().free_form.return_value = GeocoderResponse().new_from_jsondict({
+      'items': [{'position': {'lat': 40.7736, 'lng': -73.9655}}]
+    })
+
+    ids = []
+    for _ in range(2):
+      s3_client, dbb_client = self.create_clients(mock_boto3_client, content)
+
+      with patch('importGeofences.max_geocoded_addresses', 1):
+        report = importGeofences.handler({'bucket': TestImportGeofences.BUCKET, 'key': 'imports/stores.csv'}, None)[0]
+
+      self.assertEqual(report['imported'], 4)
+      request_items = dbb_client.batch_write_item.call_args[1]['RequestItems'][TestImportGeofences.DBB_TABLE_NAME]
+      ids.append([request['PutRequest']['Item']['id']['S'] for request in request_items])
+
+    self.assertEqual(ids[0], ids[1])
+    self.assertEqual(len(set(ids[0])), 4)
+    self.assertEqual(mock_GeocoderApi().free_form.call_count, 6)
+
+  @patch('time.sleep')
+  @patch('boto3.client')
+  def test_import_retries_unprocessed_items(self, mock_boto3_client, mock_sleep):
+    """
+    Test when BatchWriteItem returns unprocessed items and a direct invocation resumes from a row
+    """
+
+    rows = [f'geofence-{i},Store {i},,,,,,{i},{i},RADIUS:(100)' for i in range(1, 31)]
+    content = '\n'.join(['id,name,branch,address,city,country,region,latitude,longitude,definition'] + rows)
+    s3_client, dbb_client = self.create_clients(mock_boto3_client, content)
+
+    unprocessed = {TestImportGeofences.DBB_TABLE_NAME: [{'PutRequest': {'Item': {'id': {'S': 'geofence-3'}}}}]}
+    dbb_client.batch_write_item.side_effect = [{'UnprocessedItems': unprocessed}, {'UnprocessedItems': {}}, {}]
+
+    event = {
+      'bucket': TestImportGeofences.BUCKET,
+      'key': 'imports/stores.csv',
+      'startRow': 2
+    }
+
+    with patch.dict(os.environ, {'IMPORT_CONCURRENCY': '1'}):
+      report = importGeofences.handler(event, None)[0]
+
+    self.assertEqual(report['status'], 'COMPLETED')
+    self.assertEqual(report['startRow'], 2)
+    self.assertEqual(report['imported'], 28)
+    self.assertEqual(dbb_client.batch_write_item.call_count, 3)
+    self.assertEqual(dbb_client.batch_write_item.call_args_list[1][1]['RequestItems'], unprocessed)
+    first_chunk = dbb_client.batch_write_item.call_args_list[0][1]['RequestItems'][TestImportGeofences.DBB_TABLE_NAME]
+    self.assertEqual(len(first_chunk), 25)
+    self.assertEqual(first_chunk[0]['PutRequest']['Item']['id'], {'S': 'geofence-3'})
+    mock_sleep.assert_called_once()
+
+  @patch('time.sleep')
+  @patch('boto3.client')
+  def test_import_reports_items_still_unprocessed(self, mock_boto3_client, mock_sleep):
+    """
+    Test when BatchWriteItem keeps returning an unprocessed item, which is reported as rejected after the last attempt
+    """
+
+    content = '\n'.join([
+      'id,name,branch,address,city,country,region,latitude,longitude,definition',
+      'geofence-1,Some Store,,,,,,40.7,-74.0,RADIUS:(100)',
+      'geofence-2,Other Store,,,,,,40.8,-74.1,RADIUS:(100)'
+    ])
+    s3_client, dbb_client = self.create_clients(mock_boto3_client, content)
+
+    unprocessed = {TestImportGeofences.DBB_TABLE_NAME: [{'PutRequest': {'Item': {'id': {'S': 'geofence-2'}}}}]}
+    dbb_client.batch_write_item.return_value = {'UnprocessedItems': unprocessed}
+
+    report = importGeofences.handler({'bucket': TestImportGeofences.BUCKET, 'key': 'imports/stores.csv'}, None)[0]
+
+    self.assertEqual(dbb_client.batch_write_item.call_count, importGeofences.max_write_attempts)
+    self.assertEqual(report['imported'], 1)
+    self.assertEqual(report['rejected'], 1)
+    self.assertEqual(report['errors'][0]['row'], 2)
+    self.assertTrue(report['errors'][0]['error'].startswith('UnprocessedItems'))
+    self.assertTrue(all(call[0][0] <= 2 for call in mock_sleep.call_args_list))
+
+  @patch('boto3.client')
+  def test_import_keeps_visits_of_existing_geofences(self, mock_boto3_client):
+    """
+    Test when a file is imported again and the existing geofences are updated without resetting their visits
+    """
+
+    content = '\n'.join([
+      'id,name,branch,address,city,country,region,latitude,longitude,definition',
+      'geofence-1,Some Store,,,,,,40.7,-74.0,RADIUS:(100)',
+      'geofence-2,New Store,Main,,,,,40.8,-74.1,RADIUS:(100)'
+    ])
+    s3_client, dbb_client = self.create_clients(mock_boto3_client, content)
+    dbb_client.batch_get_item.return_value = {'Responses': {TestImportGeofences.DBB_TABLE_NAME: [{'id': {'S': 'geofence-1'}}]}}
+
+    report = importGeofences.handler({'bucket': TestImportGeofences.BUCKET, 'key': 'imports/stores.csv'}, None)[0]
+
+    self.assertEqual(report['imported'], 2)
+    request_items = dbb_client.batch_write_item.call_args[1]['RequestItems'][TestImportGeofences.DBB_TABLE_NAME]
+    self.assertEqual([request['PutRequest']['Item']['id'] for request in request_items], [{'S': 'geofence-2'}])
+
+    update_args = dbb_client.update_item.call_args[1]
+    self.assertEqual(update_args['Key'], {'id': {'S': 'geofence-1'}})
+    self.assertIn('#visits = if_not_exists(#visits, :visits)', update_args['UpdateExpression'])
+    self.assertIn('#createdAt = if_not_exists(#createdAt, :createdAt)', update_args['UpdateExpression'])
+    self.assertIn(' REMOVE #branch, #address', update_args['UpdateExpression'])
+    self.assertEqual(update_args['ExpressionAttributeValues'][':name'], {'S': 'Some Store'})
+
+  @patch('boto3.client')
+  def test_import_geojson_successfully(self, mock_boto3_client):
+    """
+    Test when importing a GeoJSON FeatureCollection read in small chunks
+    """
+
+    content = json.dumps({
+      'type': 'FeatureCollection',
+      'features': [{
+        'type': 'Feature',
+        'properties': {'id': 'geofence-1', 'name': 'Some Store', 'definition': 'RADIUS:(100)'},
+        'geometry': {'type': 'Point', 'coordinates': [-74.006, 40.7128]}
+      }, {
+        'type': 'Feature',
+        'properties': {'id': 'geofence-2', 'name': 'Some Park'},
+        'geometry': {'type': 'Polygon', 'coordinates': [[[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]]]}
+      }]
+    })
+    s3_client, dbb_client = self.create_clients(mock_boto3_client, content)
+
+    with patch.object(importGeofences, 'read_chunk_size', 16):
+      report = importGeofences.handler({'bucket': TestImportGeofences.BUCKET, 'key': 'imports/stores.geojson'}, None)[0]
+
+    self.assertEqual(report['status'], 'COMPLETED')
+    self.assertEqual(report['imported'], 2)
+
+    request_items = dbb_client.batch_write_item.call_args[1]['RequestItems'][TestImportGeofences.DBB_TABLE_NAME]
+    items = [request['PutRequest']['Item'] for request in request_items]
+    self.assertEqual(items[0]['latitude'], {'N': '40.7128'})
+    self.assertEqual(items[1]['definition'], {'S': 'POLYGON:(0 0, 0 2, 2 2, 2 0)'})
+    self.assertEqual(items[1]['latitude'], {'N': '1.0'})
+
+  @patch('boto3.client')
+  def test_import_invalid_geojson(self, mock_boto3_client):
+    """
+    Test when a line delimited GeoJSON file has a truncated feature
+    """
+
+    feature = {
+      'type': 'Feature',
+      'properties': {'name': 'Some Store', 'definition': 'RADIUS:(100)'},
+      'geometry': {'type': 'Point', 'coordinates': [-74.006, 40.7128]}
+    }
+    content = json.dumps(feature) + '\n' + json.dumps(feature)[:40]
+    s3_client, dbb_client = self.create_clients(mock_boto3_client, content)
+
+    report = importGeofences.handler({'bucket': TestImportGeofences.BUCKET, 'key': 'imports/stores.ndjson'}, None)[0]
+
+    self.assertEqual(report['status'], 'FAILED')
+    self.assertEqual(report['imported'], 1)
+    self.assertEqual(report['rejected'], 1)
+    self.assertEqual(report['errors'][0]['row'], 2)
+
+if __name__ == '__main__':
+  unittest.main()
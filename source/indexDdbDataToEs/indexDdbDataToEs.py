@@ -17,23 +17,45 @@
 
 """
 Lambda function used together with DynamoDB Streams to index data into Amazon ElasticSearch.
+
+The ElasticSearch client is created on the first invocation and kept for the following ones of the container.
+
+The geofences are written through the index-geofences alias, pointing to a versioned index created with the mapping of
+index_settings. The index is created and migrated at deploy time by the GeofenceIndexCustomResource of the stack, never
+from the stream: when the mapping changes, index_version is bumped, and the custom resource creates the new index,
+blocks the writes to the previous one, copies its documents with their location and shape fields rebuilt, then moves
+the alias in one atomic update and drops the previous index. Domains created before the alias existed have a plain
+index-geofences index, which is migrated the same way. The stream records written while the previous index is blocked
+fail their batch, which is retried until the alias points to the new index.
 """
 
 import json
 import os
-import decimal
+import urllib.request
 
 import boto3
-from boto3.dynamodb.types import TypeDeserializer
-from elasticsearch import Elasticsearch, RequestsHttpConnection
-from requests_aws4auth import AWS4Auth
 
-region = os.environ['REGION']
-host = os.environ['ES_HOST']
+import geofenceItems
 
 service = 'es'
-credentials = boto3.Session().get_credentials()
-awsauth = AWS4Auth(credentials.access_key, credentials.secret_key, region, service, session_token=credentials.token)
+
+index_alias = 'index-geofences'
+index_version = 'index-geofences-v2'
+
+index_settings = {
+  'settings': {
+    'index.mapping.coerce': True
+  },
+  'mappings': {
+    'properties': {
+      'id': {'type': 'keyword'},
+      'location': {'type': 'geo_point'},
+      'shape': {'type': 'geo_shape'}
+    }
+  }
+}
+
+es_client = None
 
 def handler(event, context):
   """
@@ -41,16 +63,14 @@ def handler(event, context):
   """
 
   print('Request: {}'.format(json.dumps(event, indent = 4)))
+
+  if 'RequestType' in event:
+    return handle_custom_resource(event, context)
+
   count = 0
-  index_name = 'index-geofences'
-
-  es = Elasticsearch(
-    hosts = [{'host': host, 'port': 443}],
-    http_auth = awsauth,
-    use_ssl = True,
-    verify_certs = True,
-    connection_class = RequestsHttpConnection
-  )
+  index_name = index_alias
+
+  es = get_es_client()
 
   print('Cluster Info: {}'.format(json.dumps(es.info(), indent = 4))) 
 
@@ -69,41 +89,151 @@ def handler(event, context):
       print("Failed to process:")
       print('Record: {}'.format(json.dumps(record, indent = 4)))
       print("ERROR: " + repr(e))
+
+      # the index is being migrated, the batch is retried once the alias points to the new index
+      if getattr(e, 'error', None) == 'cluster_block_exception':
+        raise
       continue  
 
     count += 1
   return f'{count} records processed.'
   
-def index_geofence(es, record, index_name):
+def get_es_client():
   """
-  Index data into the Amazon ElstichSearch cluster
+  Returns the Amazon ElasticSearch client, creating it only once per container.
   """
 
-  print('Indexing data into ES...')
+  global es_client
+
+  if es_client is None:
+    from elasticsearch import Elasticsearch, RequestsHttpConnection
+    from requests_aws4auth import AWS4Auth
+
+    credentials = boto3.Session().get_credentials()
+    awsauth = AWS4Auth(credentials.access_key, credentials.secret_key, os.environ['REGION'], service, session_token=credentials.token)
+
+    es_client = Elasticsearch(
+      hosts = [{'host': os.environ['ES_HOST'], 'port': 443}],
+      http_auth = awsauth,
+      use_ssl = True,
+      verify_certs = True,
+      connection_class = RequestsHttpConnection
+    )
+
+  return es_client
+
+def handle_custom_resource(event, context):
+  """
+  Migrates the index when the GeofenceIndexCustomResource is created or updated, then answers CloudFormation.
+  """
+
+  status = 'SUCCESS'
+
+  try:
+    if event['RequestType'] in ['Create', 'Update']:
+      migrate_index(get_es_client())
+  except Exception as e:
+    print("ERROR: " + repr(e))
+    status = 'FAILED'
+
+  response_body = json.dumps({
+    'Status': status,
+    'Reason': 'See the details in CloudWatch Log Stream: ' + context.log_stream_name,
+    'PhysicalResourceId': index_alias,
+    'StackId': event['StackId'],
+    'RequestId': event['RequestId'],
+    'LogicalResourceId': event['LogicalResourceId'],
+    'Data': {}
+  }).encode('utf-8')
+
+  urllib.request.urlopen(urllib.request.Request(
+    event['ResponseURL'],
+    data = response_body,
+    headers = {'content-type': '', 'content-length': str(len(response_body))},
+    method = 'PUT'
+  ))
+
+  return status
+
+def migrate_index(es):
+  """
+  Makes the index alias point to the current index version, creating the index with its mapping and migrating the
+  documents of the previous index when needed.
+  """
+
+  from elasticsearch.exceptions import RequestError
+
+  previous_index = None
 
-  if es.indices.exists(index_name) == False:
-    print(f'Index {index_name} not found. Creating it...')
+  if es.indices.exists_alias(name = index_alias):
+    previous_index = next(iter(es.indices.get_alias(name = index_alias)))
+  elif es.indices.exists(index_alias):
+    previous_index = index_alias
 
+  if previous_index == index_version:
+    print(f'Index {index_version} already exists...')
+    return
+
+  try:
     es.indices.create(
-      index_name,
-      body='{"settings": { "index.mapping.coerce": true } }')
+      index_version,
+      body = index_settings)
+
+    print(f'Index {index_version} created successfuly')
+  except RequestError as e:
+    if e.error != 'resource_already_exists_exception':
+      raise
+    print(f'Index {index_version} already exists...')
+
+  actions = [{'add': {'index': index_version, 'alias': index_alias}}]
+
+  if previous_index is not None:
+    print(f'Migrating the geofences of index {previous_index} to index {index_version}...')
+    es.indices.put_settings(index = previous_index, body = {'index.blocks.write': True})
+    count = reindex_geofences(es, previous_index, index_version)
+    actions.append({'remove_index': {'index': previous_index}})
+    print(f'{count} geofences migrated')
+
+  es.indices.update_aliases(body = {'actions': actions})
+  print(f'Alias {index_alias} points to index {index_version}')
+
+def reindex_geofences(es, source_index, target_index):
+  """
+  Copies the geofences of the source index to the target index, rebuilding their location and shape fields for the
+  mapping of the target index. Returns the number of geofences copied.
+  """
 
-    print(f'Index {index_name} created successfuly')
+  from elasticsearch import helpers
 
-  else:
-    print(f'Index {index_name} already exists...')
+  def generate_actions():
+    for hit in helpers.scan(es, index = source_index, query = {'query': {'match_all': {}}}):
+      geofence = hit['_source']
+      add_location(geofence)
+      add_shape(geofence)
+      yield {'_index': target_index, '_id': hit['_id'], '_source': geofence}
+
+  count, _ = helpers.bulk(es, generate_actions(), refresh = True)
+  return count
+
+def index_geofence(es, record, index_name):
+  """
+  Index data into the Amazon ElstichSearch cluster
+  """
+
+  print('Indexing data into ES...')
 
   geofence_to_index_id = get_id(record)
   print('geofence_to_index_id: {}'.format(geofence_to_index_id))
 
-  geofence_to_index = convert_from_dbb_format_to_obj(record['dynamodb']['NewImage'])
+  geofence_to_index = geofenceItems.convert_from_dbb_format_to_obj(record['dynamodb']['NewImage'])
+  add_location(geofence_to_index)
+  add_shape(geofence_to_index)
   print('geofence_to_index: {}'.format(geofence_to_index))
 
   es.index(
     index = index_name,
     body = geofence_to_index,
     id = geofence_to_index_id,
-    doc_type = index_name,
     refresh = True
   )
   print(f'Successly inserted geofence ID {geofence_to_index_id} to index {index_name}')
@@ -120,7 +250,6 @@ def unindex_geofence(es, record, index_name):
   es.delete(
     index = index_name,
     id = geofence_to_index_id,
-    doc_type = index_name,
     refresh = True
   )
 
@@ -136,7 +265,6 @@ def get_geofence(es, record, index_name):
 
   response_geofence = es.get(
     index = index_name, 
-    doc_type = index_name,
     id = geofence_to_index_id
   )
 
@@ -149,21 +277,28 @@ def get_id(record):
 
   return record['dynamodb']['Keys']['id']['S']
 
-def convert_from_dbb_format_to_obj(data):
+def add_location(geofence):
   """
-  Normalizes the object coming from Amazon DynamoDB in order to index a clean object in Amazon ElasticSearch.
+  Adds a geo_point friendly location field to the geofence so it can be used by geo_distance and geo_bounding_box queries.
   """
 
-  return {k: normalize_values(TypeDeserializer().deserialize(v)) for k,v in data.items()}
-  
-def normalize_values(value):
+  if geofence.get('latitude') is not None and geofence.get('longitude') is not None:
+    geofence['location'] = {
+      'lat': geofence['latitude'],
+      'lon': geofence['longitude']
+    }
+
+def add_shape(geofence):
   """
-  Normalize values coming from Amazon DynamoDB.
+  Adds a geo_shape friendly shape field to the polygon geofences, a closed GeoJSON ring of [lon, lat] positions built from
+  the polygon vertices stamped by the processGeofenceChanges function.
   """
 
-  if isinstance(value, decimal.Decimal):
-    if value % 1 == 0:
-      return int(value)
-    else:
-      return float(value)
-  return value     
+  if geofence.get('polygon'):
+    ring = [[vertex['longitude'], vertex['latitude']] for vertex in geofence['polygon']]
+    ring.append(ring[0])
+
+    geofence['shape'] = {
+      'type': 'polygon',
+      'coordinates': [ring]
+    }
@@ -0,0 +1,168 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+import unittest
+from unittest.mock import Mock, patch
+
+import json
+import indexDdbDataToEs
+from elasticsearch.exceptions import AuthorizationException, RequestError
+
+class TestIndexDdbDataToEs(unittest.TestCase):
+  """
+  Test class for the IndexDdbDataToEsLambda function 
+  """
+
+  def create_event(self):
+    return {
+      'Records': [{
+        'eventName': 'INSERT',
+        'dynamodb': {
+          'Keys': {'id': {'S': 'some-geofence'}},
+          'NewImage': {
+            'id': {'S': 'some-geofence'},
+            'name': {'S': 'some_name'},
+            'latitude': {'N': '-11.1234567'},
+            'longitude': {'N': '-99.0987654'}
+          }
+        }
+      }]
+    }
+
+  def create_custom_resource_event(self, request_type):
+    return {
+      'RequestType': request_type,
+      'ResponseURL': 'https://cloudformation-response',
+      'StackId': 'some-stack',
+      'RequestId': 'some-request',
+      'LogicalResourceId': 'GeofenceIndexCustomResource'
+    }
+
+  @patch('indexDdbDataToEs.get_es_client')
+  def test_index_geofence_through_alias(self, mock_get_es_client):
+    """
+    Test when a geofence is indexed through the alias, without checking or migrating the index from the stream
+    """
+
+    es = mock_get_es_client()
+    es.info.return_value = {}
+
+    returned = indexDdbDataToEs.handler(self.create_event(), None)
+
+    self.assertEqual(returned, '1 records processed.')
+    self.assertEqual(es.index.call_args[1]['index'], indexDdbDataToEs.index_alias)
+    self.assertEqual(es.index.call_args[1]['body']['location'], {'lat': -11.1234567, 'lon': -99.0987654})
+    self.assertEqual(es.indices.method_calls, [])
+
+  @patch('indexDdbDataToEs.get_es_client')
+  def test_index_geofence_retried_while_index_migrated(self, mock_get_es_client):
+    """
+    Test when the previous index blocks the writes during its migration, so the batch fails and is retried
+    """
+
+    es = mock_get_es_client()
+    es.info.return_value = {}
+    es.index.side_effect = AuthorizationException(403, 'cluster_block_exception', {})
+
+    with self.assertRaises(AuthorizationException):
+      indexDdbDataToEs.handler(self.create_event(), None)
+
+  @patch('urllib.request.urlopen')
+  @patch('indexDdbDataToEs.get_es_client')
+  def test_custom_resource_creates_index_behind_alias(self, mock_get_es_client, mock_urlopen):
+    """
+    Test when the index does not exist yet and is created with its mapping behind the alias
+    """
+
+    es = mock_get_es_client()
+    es.indices.exists_alias.return_value = False
+    es.indices.exists.return_value = False
+    context = Mock(log_stream_name = 'some-log-stream')
+
+    self.assertEqual(indexDdbDataToEs.handler(self.create_custom_resource_event('Create'), context), 'SUCCESS')
+    self.assertEqual(es.indices.create.call_args[0][0], indexDdbDataToEs.index_version)
+    self.assertEqual(es.indices.create.call_args[1]['body'], indexDdbDataToEs.index_settings)
+    self.assertEqual(es.indices.update_aliases.call_args[1]['body'], {
+      'actions': [{'add': {'index': indexDdbDataToEs.index_version, 'alias': indexDdbDataToEs.index_alias}}]
+    })
+    self.assertEqual(json.loads(mock_urlopen.call_args[0][0].data)['Status'], 'SUCCESS')
+
+  @patch('urllib.request.urlopen')
+  @patch('elasticsearch.helpers.bulk')
+  @patch('elasticsearch.helpers.scan')
+  @patch('indexDdbDataToEs.get_es_client')
+  def test_custom_resource_migrates_index_without_mapping(self, mock_get_es_client, mock_scan, mock_bulk, mock_urlopen):
+    """
+    Test when a plain index created without the geo mapping is blocked, migrated to the versioned index and replaced by
+    the alias, the versioned index having been created by an earlier attempt
+    """
+
+    es = mock_get_es_client()
+    es.indices.exists_alias.return_value = False
+    es.indices.exists.side_effect = lambda index: index == indexDdbDataToEs.index_alias
+    es.indices.create.side_effect = RequestError(400, 'resource_already_exists_exception', {})
+    mock_scan.return_value = [{
+      '_id': 'some-polygon',
+      '_source': {
+        'id': 'some-polygon',
+        'latitude': 1,
+        'longitude': 2,
+        'polygon': [{'latitude': 1, 'longitude': 2}, {'latitude': 1, 'longitude': 3}, {'latitude': 2, 'longitude': 3}]
+      }
+    }]
+    migrated = []
+
+    def bulk(es, actions, **kwargs):
+      migrated.extend(actions)
+      return len(migrated), []
+
+    mock_bulk.side_effect = bulk
+    context = Mock(log_stream_name = 'some-log-stream')
+
+    self.assertEqual(indexDdbDataToEs.handler(self.create_custom_resource_event('Update'), context), 'SUCCESS')
+
+    es.indices.put_settings.assert_called_once_with(index = indexDdbDataToEs.index_alias, body = {'index.blocks.write': True})
+    self.assertEqual(mock_scan.call_args[1]['index'], indexDdbDataToEs.index_alias)
+    self.assertEqual(migrated[0]['_index'], indexDdbDataToEs.index_version)
+    self.assertEqual(migrated[0]['_source']['location'], {'lat': 1, 'lon': 2})
+    self.assertEqual(migrated[0]['_source']['shape']['coordinates'], [[[2, 1], [3, 1], [3, 2], [2, 1]]])
+    self.assertEqual(es.indices.update_aliases.call_args[1]['body'], {
+      'actions': [
+        {'add': {'index': indexDdbDataToEs.index_version, 'alias': indexDdbDataToEs.index_alias}},
+        {'remove_index': {'index': indexDdbDataToEs.index_alias}}
+      ]
+    })
+
+  @patch('urllib.request.urlopen')
+  @patch('indexDdbDataToEs.get_es_client')
+  def test_custom_resource_alias_up_to_date(self, mock_get_es_client, mock_urlopen):
+    """
+    Test when the alias already points to the current index version and nothing is migrated
+    """
+
+    es = mock_get_es_client()
+    es.indices.exists_alias.return_value = True
+    es.indices.get_alias.return_value = {indexDdbDataToEs.index_version: {'aliases': {indexDdbDataToEs.index_alias: {}}}}
+    context = Mock(log_stream_name = 'some-log-stream')
+
+    self.assertEqual(indexDdbDataToEs.handler(self.create_custom_resource_event('Update'), context), 'SUCCESS')
+    es.indices.create.assert_not_called()
+    es.indices.update_aliases.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()    
+    
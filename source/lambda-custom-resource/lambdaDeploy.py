@@ -18,13 +18,18 @@
 """
 Custom resource function to be invoked by the CloudFormation stack in oder to create deploy a Lambda@Edge function.
 
-This function creates a Lambda function in the us-east-1 region to be deployed together with CloudFront. It will add security headers to the 
-administrator website.
+This function creates a Lambda function in the us-east-1 region to be deployed together with CloudFront. It will add security headers to the
+administrator website. The region and the AppSync endpoint of the Content-Security-Policy header are written in the function code, so
+the function makes no call to AWS services while serving the website.
 
-This custom resource will be processed only for the Create and Delete events.
+In the Update event, a new version of the function is published only when the code rendered with the stack parameters
+differs from the code of the deployed function.
 """
 
+import io
 import json
+import base64
+import hashlib
 import boto3
 import time
 import cfnResponse 
@@ -36,6 +41,12 @@ ssm_client = boto3.client('ssm', region_name='us-east-1')
 iam_client = boto3.client('iam')
 client_sts = boto3.client('sts')
 
+# longest time to wait for the new IAM role to be usable by Lambda
+role_propagation_timeout_seconds = 120
+max_role_propagation_delay_seconds = 8
+# time kept to send the response to CloudFormation before the function times out
+time_budget_margin_seconds = 10
+
 function_code = '''
 /*******************************************************************************************************************************************
 *  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved                                                                  *
@@ -56,40 +67,26 @@ function_code = '''
 
 'use strict';
 
-const AWS = require('aws-sdk')
-
-AWS.config.update({
-  region: 'us-east-1'
-})
+// the region and the AppSync endpoint are set when the function is deployed
+const secPolicyPlaceholder = "default-src 'none'; connect-src 'self' https://cognito-idp.REPLACE_AWS_REGION.amazonaws.com/ https://cognito-identity.REPLACE_AWS_REGION.amazonaws.com/ REPLACE_APPSYNC_ENDPOINT <ORIGIN_BUCKET>; font-src 'self' data: <ORIGIN_BUCKET>; frame-src 'self' <ORIGIN_BUCKET>; img-src 'self' data: https:; media-src 'self'; script-src 'self' 'unsafe-inline' <ORIGIN_BUCKET> data:; style-src 'self' 'unsafe-inline' <ORIGIN_BUCKET>; object-src 'none'";
 
-const parameterStore = new AWS.SSM()
+// the origin is always the website bucket, so the header is built once per container
+let secPolicyOrigin = null;
+let secPolicyHeader = null;
 
-const getParam = param => {
-  return new Promise((res, rej) => {
-    parameterStore.getParameter({
-      Name: param
-    }, (err, data) => {
-        if (err) {
-          return rej(err)
-        }
-        return res(data)
-    })
-  })
+const getSecPolicyHeader = origin => {
+    if (origin !== secPolicyOrigin) {
+        const bucketName = origin.substring(0, origin.indexOf(".")) + ".s3.amazonaws.com";
+        secPolicyHeader = secPolicyPlaceholder.split("<ORIGIN_BUCKET>").join(bucketName);
+        secPolicyOrigin = origin;
+    }
+    return secPolicyHeader;
 }
 
 exports.handler = async (event, context, callback) => {
-    const regionSSM = await getParam('REPLACE_REGION_SSM');
-    const region = regionSSM.Parameter.Value;
-    
     const request = event.Records[0].cf.request;
     const response = event.Records[0].cf.response;
     const headers = response.headers;
-    const origin = request.origin.s3.domainName;
-    
-    let bucketName = origin.substring(0, origin.indexOf(".")) + ".s3.amazonaws.com";
-    let secPolicyPlaceholder = "default-src 'none'; connect-src 'self' https://cognito-idp.<AWS_REGION>.amazonaws.com/ https://cognito-identity.<AWS_REGION>.amazonaws.com/ REPLACE_APPSYNC_ENDPOINT <ORIGIN_BUCKET>; font-src 'self' data: <ORIGIN_BUCKET>; frame-src 'self' <ORIGIN_BUCKET>; img-src 'self' data: https:; media-src 'self'; script-src 'self' 'unsafe-inline' <ORIGIN_BUCKET> data:; style-src 'self' 'unsafe-inline' <ORIGIN_BUCKET>; object-src 'none'";
-    let secPolicyHeader = secPolicyPlaceholder.split("<ORIGIN_BUCKET>").join(bucketName);
-    secPolicyHeader = secPolicyHeader.split("<AWS_REGION>").join(region);
 
     headers['strict-transport-security'] = [{
         key: 'Strict-Transport-Security', 
@@ -117,8 +114,8 @@ exports.handler = async (event, context, callback) => {
     }]; 
     
     headers['content-security-policy'] = [{
-        key: 'Content-Security-Policy', 
-        value: secPolicyHeader        
+        key: 'Content-Security-Policy',
+        value: getSecPolicyHeader(request.origin.s3.domainName)
     }]; 
     
     callback(null, response);
@@ -127,7 +124,7 @@ exports.handler = async (event, context, callback) => {
 
 def handler(event, context):
   """
-  Main handler to control wether to process the Custom Resource in the event of a stack creation or deletion.
+  Main handler to control wether to process the Custom Resource in the event of a stack creation, update or deletion.
   """
 
   print('request: {}'.format(json.dumps(event, indent = 4)))
@@ -160,8 +157,12 @@ def handler(event, context):
     )
 
   else:
-    print('Updating Stack. <No implementation>')
-    cfnResponse.send(event, context, cfnResponse.SUCCESS, {}, "LambdaEdgeCustomResourcePhysicalID")
+    print('Updating the Stack...')
+    handle_update(
+      event = event,
+      context = context,
+      stack_parameters = stack_parameters
+    )
 
 def handle_create(event, context, stack_parameters):
   """
@@ -169,20 +170,11 @@ def handle_create(event, context, stack_parameters):
   """
 
   try:
-    aws_region = stack_parameters['aws_region']
     lambda_name = stack_parameters['lambda_name']
-    ssm_parameter_name = stack_parameters['ssm_parameter_name']
     account_id = stack_parameters['account_id']   
     role_name = stack_parameters['role_name']
     policy_name = stack_parameters['policy_name']
-    app_sync_endpoint = stack_parameters['app_sync_endpoint']
 
-    response_ssm = ssm_client.put_parameter(
-        Name = ssm_parameter_name,
-        Value = aws_region,
-        Type = 'String'
-    )
-    
     trust_policy={
       "Version": "2012-10-17",
       "Statement": [
@@ -202,12 +194,6 @@ def handle_create(event, context, stack_parameters):
     managed_policy = {
         "Version": "2012-10-17",
         "Statement": [
-            {
-                "Sid": "AllowSSMParameter",
-                "Effect": "Allow",
-                "Action": "ssm:GetParameter*",
-                "Resource": f'arn:aws:ssm:us-east-1:{account_id}:parameter/{ssm_parameter_name}*'
-            },
             {
                 "Effect": "Allow",
                 "Action": "logs:CreateLogGroup",
@@ -243,35 +229,16 @@ def handle_create(event, context, stack_parameters):
         RoleName = role_name
     )
     
-    time.sleep(10)
-
-    function_code_replaced = function_code.replace("REPLACE_REGION_SSM", ssm_parameter_name)
-    function_code_replaced = function_code_replaced.replace("REPLACE_APPSYNC_ENDPOINT", app_sync_endpoint) 
+    code = create_function_zip(stack_parameters)
 
-    zf = zipfile.ZipFile('/tmp/function.zip', mode='w', compression=zipfile.ZIP_DEFLATED)
-    info = zipfile.ZipInfo('index.js')
-    info.external_attr = 0o664 << 16
-    zf.writestr(info, function_code_replaced)
-    zf.close()
-    
-    with open('/tmp/function.zip', 'rb') as f: 
-      code = f.read()
-    
-    response = lambda_client.create_function(
-        FunctionName = lambda_name,
-        Runtime = "nodejs12.x",
-        Role = f'arn:aws:iam::{account_id}:role/service-role/{role_name}',
-        Handler = "index.handler",
-        Code = { 
-          'ZipFile': code
-        }
+    create_function(
+      context = context,
+      lambda_name = lambda_name,
+      role_arn = f'arn:aws:iam::{account_id}:role/service-role/{role_name}',
+      code = code
     )
     
-    response_lambda = lambda_client.publish_version(
-        FunctionName = lambda_name
-    )    
-
-    version_arn = response_lambda['FunctionArn']
+    version_arn = publish_version(lambda_name, get_code_sha256(code))
     print(f'Lambda {version_arn} created properly in us-east-1 region')  
 
     lambda_arn = {
@@ -284,6 +251,150 @@ def handle_create(event, context, stack_parameters):
     print(f'Error deploying Lambda Edge in us-east-1 with error: {ex}')  
     cfnResponse.send(event, context, cfnResponse.FAILED, {}, "LambdaEdgeCustomResourcePhysicalID")
 
+def handle_update(event, context, stack_parameters):
+  """
+  Updates the code of the lambda function and publishes a new version when the rendered code changed. Otherwise, the
+  version already published for the current code is returned, so CloudFront is not redeployed.
+  """
+
+  try:
+    lambda_name = stack_parameters['lambda_name']
+
+    code = create_function_zip(stack_parameters)
+    code_sha256 = get_code_sha256(code)
+
+    response_function = lambda_client.get_function(
+      FunctionName = lambda_name
+    )
+
+    version_arn = None
+    if response_function['Configuration']['CodeSha256'] == code_sha256:
+      version_arn = get_published_version_arn(lambda_name, code_sha256)
+
+    if version_arn:
+      print(f'Lambda {version_arn} code unchanged. No new version published')
+
+    else:
+      lambda_client.update_function_code(
+        FunctionName = lambda_name,
+        ZipFile = code
+      )
+
+      version_arn = publish_version(lambda_name, code_sha256)
+      print(f'Lambda {version_arn} updated properly in us-east-1 region')
+
+    lambda_arn = {
+      'lambdaArn': version_arn
+    }
+
+    cfnResponse.send(event, context, cfnResponse.SUCCESS, lambda_arn, "LambdaEdgeCustomResourcePhysicalID")
+
+  except ClientError as ex:
+    print(f'Error updating Lambda Edge in us-east-1 with error: {ex}')
+    cfnResponse.send(event, context, cfnResponse.FAILED, {}, "LambdaEdgeCustomResourcePhysicalID")
+
+def create_function_zip(stack_parameters):
+  """
+  Renders the function code with the stack parameters and returns it zipped in memory. The zip entry has a fixed
+  timestamp, so the same code always gives the same zip and the same CodeSha256.
+  """
+
+  function_code_replaced = function_code.replace("REPLACE_AWS_REGION", stack_parameters['aws_region'])
+  function_code_replaced = function_code_replaced.replace("REPLACE_APPSYNC_ENDPOINT", stack_parameters['app_sync_endpoint'])
+
+  buffer = io.BytesIO()
+  with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+    info = zipfile.ZipInfo('index.js')
+    info.external_attr = 0o664 << 16
+    zf.writestr(info, function_code_replaced)
+
+  return buffer.getvalue()
+
+def create_function(context, lambda_name, role_arn, code):
+  """
+  Creates the lambda function with the role created just before. Until the role has propagated, Lambda rejects it as
+  a role that can not be assumed, so the creation is retried with an exponential backoff within a time budget.
+  """
+
+  deadline = get_deadline(context)
+  delay = 1
+
+  while True:
+    try:
+      return lambda_client.create_function(
+        FunctionName = lambda_name,
+        Runtime = "nodejs12.x",
+        Role = role_arn,
+        Handler = "index.handler",
+        Code = {
+          'ZipFile': code
+        }
+      )
+
+    except lambda_client.exceptions.InvalidParameterValueException as ex:
+      if 'role' not in str(ex) or time.monotonic() + delay > deadline:
+        raise
+
+      print(f'Role {role_arn} not propagated yet. Retrying in {delay} seconds...')
+      time.sleep(delay)
+      delay = min(delay * 2, max_role_propagation_delay_seconds)
+
+def get_deadline(context):
+  """
+  Returns the monotonic time after which the function creation is not retried anymore, leaving enough time to respond
+  to CloudFormation.
+  """
+
+  budget = role_propagation_timeout_seconds
+
+  if context is not None:
+    budget = min(budget, context.get_remaining_time_in_millis() / 1000 - time_budget_margin_seconds)
+
+  return time.monotonic() + budget
+
+def get_code_sha256(code):
+  """
+  Returns the SHA-256 of a deployment package the way Lambda reports it, base64 encoded.
+  """
+
+  return base64.b64encode(hashlib.sha256(code).digest()).decode('utf-8')
+
+def get_published_version_arn(lambda_name, code_sha256):
+  """
+  Returns the ARN of the latest published version of the function with the given code, None if there is none.
+  """
+
+  version_arn = None
+  latest_version = 0
+
+  for page in lambda_client.get_paginator('list_versions_by_function').paginate(FunctionName = lambda_name):
+    for version in page['Versions']:
+      if version['Version'] != '$LATEST' and version['CodeSha256'] == code_sha256 and int(version['Version']) > latest_version:
+        latest_version = int(version['Version'])
+        version_arn = version['FunctionArn']
+
+  return version_arn
+
+def publish_version(lambda_name, code_sha256):
+  """
+  Publishes a version of the function, waiting for the function creation or code update still in progress to finish.
+  """
+
+  for attempt in range(10):
+    try:
+      response_lambda = lambda_client.publish_version(
+        FunctionName = lambda_name,
+        CodeSha256 = code_sha256
+      )
+
+      return response_lambda['FunctionArn']
+
+    except lambda_client.exceptions.ResourceConflictException:
+      print(f'Code update of {lambda_name} in progress. Retrying to publish the version...')
+      time.sleep(2 ** min(attempt, 3))
+
+  raise ClientError({'Error': {'Code': 'ResourceConflictException', 'Message': f'Version of {lambda_name} not published'}}, 'PublishVersion')
+
 def handle_delete(event, context, stack_parameters):
   """
   When the stack is being deleted, this function will delete all resources previously created by this function in the Create event.
@@ -313,9 +424,7 @@ def handle_delete(event, context, stack_parameters):
         )
 
         if response_policy['ResponseMetadata']['HTTPStatusCode'] == 200:
-          response_ssm = ssm_client.delete_parameter(
-            Name = ssm_parameter_name
-          )  
+          response_ssm = delete_ssm_parameter(ssm_parameter_name)
 
           if response_ssm['ResponseMetadata']['HTTPStatusCode'] == 200:
             cfnResponse.send(event, context, cfnResponse.SUCCESS, {}, "LambdaEdgeCustomResourcePhysicalID")
@@ -331,4 +440,19 @@ def handle_delete(event, context, stack_parameters):
 
   except ClientError as ex:     
     print(f'Error deploying Lambda Edge in us-east-1 with error: {ex}')  
-    cfnResponse.send(event, context, cfnResponse.FAILED, {}, "LambdaEdgeCustomResourcePhysicalID")  
+    cfnResponse.send(event, context, cfnResponse.FAILED, {}, "LambdaEdgeCustomResourcePhysicalID")
+
+def delete_ssm_parameter(ssm_parameter_name):
+  """
+  Deletes the region parameter read by the functions deployed by the previous versions of the solution. The function
+  deployed now does not create it, so a missing parameter is deleted already.
+  """
+
+  try:
+    return ssm_client.delete_parameter(
+      Name = ssm_parameter_name
+    )
+
+  except ssm_client.exceptions.ParameterNotFound:
+    print(f'Parameter {ssm_parameter_name} not found. No need to delete it')
+    return {'ResponseMetadata': {'HTTPStatusCode': 200}}
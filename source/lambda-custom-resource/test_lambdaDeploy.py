@@ -0,0 +1,84 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+
+import unittest
+from unittest.mock import Mock, patch
+
+import lambdaDeploy
+
+class TestLambdaDeploy(unittest.TestCase):
+  """
+  Test class for the LambdaEdgeCustomResource function
+  """
+
+  stack_parameters = {
+    'aws_region': 'us-east-1',
+    'lambda_name': 'lambda-edge-function',
+    'app_sync_endpoint': 'https://some-api.appsync-api.us-east-1.amazonaws.com/graphql'
+  }
+
+  def create_event(self):
+    """
+    Creates the Update event of the custom resource
+    """
+
+    return {'RequestType': 'Update', 'ResponseURL': 'https://cloudformation-response-url', 'RequestId': 'some-request'}
+
+  @patch('lambdaDeploy.cfnResponse')
+  @patch('lambdaDeploy.lambda_client')
+  def test_update_with_unchanged_code(self, mock_lambda_client, mock_cfnResponse):
+    """
+    Test when the rendered code matches the deployed function and its published version is returned unchanged
+    """
+
+    code_sha256 = lambdaDeploy.get_code_sha256(lambdaDeploy.create_function_zip(self.stack_parameters))
+    mock_lambda_client.get_function.return_value = {'Configuration': {'CodeSha256': code_sha256}}
+    mock_lambda_client.get_paginator().paginate.return_value = [{
+      'Versions': [
+        {'Version': '$LATEST', 'CodeSha256': code_sha256, 'FunctionArn': 'arn:lambda-edge-function:$LATEST'},
+        {'Version': '2', 'CodeSha256': code_sha256, 'FunctionArn': 'arn:lambda-edge-function:2'},
+        {'Version': '3', 'CodeSha256': 'other-code', 'FunctionArn': 'arn:lambda-edge-function:3'}
+      ]
+    }]
+
+    event = self.create_event()
+    lambdaDeploy.handle_update(event, None, self.stack_parameters)
+
+    mock_lambda_client.update_function_code.assert_not_called()
+    mock_lambda_client.publish_version.assert_not_called()
+    mock_cfnResponse.send.assert_called_once_with(event, None, mock_cfnResponse.SUCCESS, {'lambdaArn': 'arn:lambda-edge-function:2'}, 'LambdaEdgeCustomResourcePhysicalID')
+
+  @patch('lambdaDeploy.cfnResponse')
+  @patch('lambdaDeploy.lambda_client')
+  def test_update_with_changed_code(self, mock_lambda_client, mock_cfnResponse):
+    """
+    Test when the rendered code differs from the deployed function and a new version is published
+    """
+
+    mock_lambda_client.get_function.return_value = {'Configuration': {'CodeSha256': 'previous-code'}}
+    mock_lambda_client.publish_version.return_value = {'FunctionArn': 'arn:lambda-edge-function:4'}
+
+    event = self.create_event()
+    lambdaDeploy.handle_update(event, None, self.stack_parameters)
+
+    mock_lambda_client.update_function_code.assert_called_once()
+    self.assertEqual(mock_lambda_client.publish_version.call_args[1]['CodeSha256'], lambdaDeploy.get_code_sha256(mock_lambda_client.update_function_code.call_args[1]['ZipFile']))
+    mock_cfnResponse.send.assert_called_once_with(event, None, mock_cfnResponse.SUCCESS, {'lambdaArn': 'arn:lambda-edge-function:4'}, 'LambdaEdgeCustomResourcePhysicalID')
+
+if __name__ == '__main__':
+    unittest.main()
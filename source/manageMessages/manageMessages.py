@@ -18,12 +18,52 @@
 """
 Lambda function used as an AWS AppSync datasource to handle push notification message templates operations.
 Message template is a feature in Amazon Pinpoint, so all requests are handled using the AWS Pinpoint SDK.
+
+A template holds the message of each push channel (APNS, GCM and DEFAULT) of a geofence, and the premium users get the
+messages of its -PREMIUM sibling template. Both can be created and read in a single operation.
+
+The batch operations (getMessages, createMessages and deleteMessages) run the same operation for many geofences in one
+call, sending the Amazon Pinpoint requests concurrently under a rate limit.
+
+The listMessages operation lists the geofences having push templates. The list is kept in a short lived cache of the
+Lambda container, cleared by the create and delete operations handled by the same container.
 """
 
 import json
+import os
+import time
+import bisect
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
 import boto3
 from botocore.exceptions import ClientError
 
+import rateLimiter
+
+max_batch_size = 100
+default_max_concurrency = 5
+default_rate_limit = 10
+# time kept to return the results before the Lambda times out
+time_budget_margin_seconds = 2
+
+premium_suffix = '-PREMIUM'
+# push channels of the GraphQL API and their keys in the Amazon Pinpoint push templates
+channel_keys = {
+  'APNS': 'APNS',
+  'GCM': 'GCM',
+  'DEFAULT': 'Default'
+}
+
+default_list_limit = 50
+default_templates_cache_ttl_seconds = 60
+# templates listed by the listMessages operation, kept between the invocations of the container
+templates_cache = {
+  'items': None,
+  'expires_at': 0.0
+}
+templates_cache_lock = threading.Lock()
+
 def handler(event, context):
     """
     Main handler function that get the input messaged passed as parameter along with the operation to be performed.
@@ -32,54 +72,190 @@ def handler(event, context):
     print('request: {}'.format(json.dumps(event, indent = 4)))
 
     pinpoint_client = boto3.client('pinpoint')
-    
-    message_input = {
-      'template_name': event['arguments']['template']
-    }
-
-    if 'input' in event['arguments']:
-      message_input['service'] = event['arguments']['input']['service']
-      message_input['action'] = event['arguments']['input']['action']
-      message_input['title'] = event['arguments']['input']['title']
-      message_input['body'] = event['arguments']['input']['body']        
 
     operations = {
       'getMessage': get_message,
       'createMessage': create_message,
-      'deleteMessage': delete_message
+      'deleteMessage': delete_message,
+      'listMessages': list_messages
+    }
+
+    batch_operations = {
+      'getMessages': get_message,
+      'createMessages': create_message,
+      'deleteMessages': delete_message
     }
 
-    response = operations[event['operation']](pinpoint_client, message_input)
+    if event['operation'] in batch_operations:
+      response = run_batch(
+        pinpoint_client,
+        batch_operations[event['operation']],
+        [create_message_input(arguments) for arguments in get_batch_arguments(event['arguments'])],
+        context
+      )
+    else:
+      response = operations[event['operation']](pinpoint_client, create_message_input(event['arguments']))
+
+    if event['operation'] in ('createMessage', 'deleteMessage', 'createMessages', 'deleteMessages'):
+      invalidate_templates_cache()
+
     print('response: {}'.format(json.dumps(response, indent = 4)))    
     return response
 
+def create_message_input(arguments):
+  """
+  Creates the message input of an operation from the arguments of a single template.
+  """
+
+  message_input = {
+    'template_name': arguments.get('template'),
+    'channels': create_channel_inputs([arguments['input']] if arguments.get('input') else [], arguments.get('channels')),
+    'premium_channels': create_channel_inputs(arguments.get('premiumChannels')),
+    'include_premium': bool(arguments.get('includePremium')),
+    'limit': arguments.get('limit'),
+    'next_token': arguments.get('nextToken')
+  }
+
+  return message_input
+
+def create_channel_inputs(*channel_lists):
+  """
+  Returns the service, action, title and body of the messages of the channel lists.
+  """
+
+  return [
+    {
+      'service': channel['service'],
+      'action': channel['action'],
+      'title': channel['title'],
+      'body': channel['body']
+    }
+    for channels in channel_lists for channel in (channels or [])
+  ]
+
+def get_batch_arguments(arguments):
+  """
+  Returns the arguments of each template of a batch operation, given either as a list of template names or as a list of
+  messages with their template and input.
+  """
+
+  if 'messages' in arguments:
+    batch_arguments = arguments['messages']
+  else:
+    batch_arguments = [{'template': template, 'includePremium': arguments.get('includePremium')} for template in arguments['templates']]
+
+  if len(batch_arguments) > max_batch_size:
+    raise ValueError(f'At most {max_batch_size} templates can be handled at once')
+
+  return batch_arguments
+
+def run_batch(pinpoint_client, operation, message_inputs, context):
+  """
+  Runs the operation for each message input and returns the results in the same order, with the template name and an
+  error message for the templates that failed.
+
+  The Amazon Pinpoint requests are sent concurrently, but never faster than the configured rate limit, and no new request
+  is started once the Lambda time budget is running out.
+  """
+
+  results = [None] * len(message_inputs)
+  deadline = get_deadline(context)
+  acquire = rateLimiter.create_rate_limiter(float(os.environ.get('PINPOINT_RATE_LIMIT', default_rate_limit)))
+
+  def run_operation(position):
+    if not acquire(deadline):
+      results[position] = create_error_payload(
+        exception = 'TimeoutError',
+        message = 'not handled before the Lambda time budget ran out',
+        endpoint_id = ''
+      )
+      return
+
+    try:
+      results[position] = operation(pinpoint_client, message_inputs[position])
+    except Exception as ex:
+      results[position] = create_error_payload(
+        exception = type(ex).__name__,
+        message = str(ex),
+        endpoint_id = ''
+      )
+
+  if message_inputs:
+    executor = ThreadPoolExecutor(max_workers = int(os.environ.get('PINPOINT_MAX_CONCURRENCY', default_max_concurrency)))
+    futures = [executor.submit(run_operation, position) for position in range(len(message_inputs))]
+    wait(futures, timeout = None if deadline is None else max(deadline - time.monotonic(), 0) + time_budget_margin_seconds / 2)
+    executor.shutdown(wait = False)
+
+  response = []
+  for message_input, result in zip(message_inputs, results):
+    if result is None:
+      result = create_error_payload(
+        exception = 'TimeoutError',
+        message = 'no response from Amazon Pinpoint before the Lambda time budget ran out',
+        endpoint_id = ''
+      )
+
+    result = dict(result, template = message_input['template_name'])
+    if result['status'] == 'MESSAGE_ERROR':
+      result['error'] = result.pop('message')
+    response.append(result)
+
+  return response
+
+def get_deadline(context):
+  """
+  Returns the monotonic time after which no new Amazon Pinpoint request should be started, or None without a Lambda
+  context.
+  """
+
+  if context is None:
+    return None
+
+  return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - time_budget_margin_seconds
+
 def get_message(pinpoint_client, message_input):
   """
   Based on a message passed as parameter, it gets a push notification message template 
-  in Pinpoint and creates a message Payload to be returned
+  in Pinpoint and creates a message Payload to be returned, with the message of every channel of the template.
+
+  The message field keeps the first channel found (APNS, then GCM, then DEFAULT). The channels of the -PREMIUM sibling
+  template are added when include_premium is set, a missing sibling giving an empty list.
   """
 
   try:
+    template = message_input['template_name']
+
     response_get_template = pinpoint_client.get_push_template(
-      TemplateName = message_input['template_name']
+      TemplateName = template
     ) 
 
-    push_template = response_get_template['PushNotificationTemplateResponse']
-
-    if push_template['APNS']:
-      service = 'APNS'
-    elif push_template['GCM']:
-      service = 'GCM'
+    channels = read_channels(response_get_template['PushNotificationTemplateResponse'])
+    if not channels:
+      raise ValueError(f'No push message found in template {template}')
 
     response = {
       'status': 'MESSAGE_OK',
-      'message': {
-        'service': service,
-        'action': push_template[service]['Action'],
-        'title': push_template[service]['Title'],
-        'body': push_template[service]['Body']
-      }
-    }  
+      'message': channels[0],
+      'channels': channels
+    }
+
+    if message_input.get('include_premium'):
+      try:
+        response_get_premium_template = pinpoint_client.get_push_template(
+          TemplateName = template + premium_suffix
+        )
+        response['premiumChannels'] = read_channels(response_get_premium_template['PushNotificationTemplateResponse'])
+      except ClientError as ex:
+        if ex.response['Error']['Code'] != 'NotFoundException':
+          raise
+        response['premiumChannels'] = []
+
+  except ValueError as ex:
+    response = create_error_payload(
+      exception = 'ValueError',
+      message = str(ex),
+      endpoint_id = ''
+    )
 
   except ClientError as ex:      
     response = create_error_payload(
@@ -93,29 +269,36 @@ def get_message(pinpoint_client, message_input):
 def create_message(pinpoint_client, message_input):
   """
   Based on a message passed as parameter, it creates a push notification 
-  message template in Pinpoint
+  message template in Pinpoint, with the message of every channel given, and its -PREMIUM sibling when premium
+  channels are given. Existing templates are updated with the new messages.
   """
 
   try:
     template = message_input['template_name']
-    service = message_input['service']
+    channels = message_input.get('channels')
+    premium_channels = message_input.get('premium_channels')
 
-    response_create_template = pinpoint_client.create_push_template(
-      TemplateName = template,
-      PushNotificationTemplateRequest = {
-        service: {
-          'Action': message_input['action'],
-          'Title': message_input['title'],
-          'Body': message_input['body']        
-        }
-      }
-    ) 
+    if not channels and not premium_channels:
+      raise ValueError('At least one channel message is required')
 
+    if channels:
+      put_push_template(pinpoint_client, template, channels)
+    if premium_channels:
+      put_push_template(pinpoint_client, template + premium_suffix, premium_channels)
+
+    services = ', '.join(dict.fromkeys(channel['service'].upper() for channel in channels + premium_channels))
     response = {
       'status': 'MESSAGE_CREATED',
-      'message': f'Personalized {service} push message created for geofence {template}'
+      'message': f'Personalized {services} push message created for geofence {template}' + (' and its premium users' if premium_channels else '')
     }  
 
+  except ValueError as ex:
+    response = create_error_payload(
+      exception = 'ValueError',
+      message = str(ex),
+      endpoint_id = ''
+    )
+
   except ClientError as ex:      
     response = create_error_payload(
       exception = 'ClientError',
@@ -125,10 +308,87 @@ def create_message(pinpoint_client, message_input):
 
   return response
 
+def put_push_template(pinpoint_client, template, channels):
+  """
+  Creates the push template with the messages of the channels, or updates it when it already exists. New templates take
+  a single request.
+  """
+
+  template_request = create_template_request(channels)
+
+  try:
+    pinpoint_client.create_push_template(
+      TemplateName = template,
+      PushNotificationTemplateRequest = template_request
+    )
+  except ClientError as ex:
+    # Amazon Pinpoint refuses to create a template that already exists with a ConflictException, or a
+    # BadRequestException also returned for an invalid request, so the template is only updated if it exists
+    if ex.response['Error']['Code'] == 'BadRequestException':
+      if not push_template_exists(pinpoint_client, template):
+        raise ex
+    elif ex.response['Error']['Code'] != 'ConflictException':
+      raise
+
+    pinpoint_client.update_push_template(
+      TemplateName = template,
+      PushNotificationTemplateRequest = template_request,
+      CreateNewVersion = False
+    )
+
+def push_template_exists(pinpoint_client, template):
+  """
+  Returns whether the push template exists.
+  """
+
+  try:
+    pinpoint_client.get_push_template(TemplateName = template)
+  except ClientError as ex:
+    if ex.response['Error']['Code'] != 'NotFoundException':
+      raise
+    return False
+
+  return True
+
+def create_template_request(channels):
+  """
+  Creates the PushNotificationTemplateRequest holding the message of each channel.
+  """
+
+  template_request = {}
+
+  for channel in channels:
+    service = channel['service'].upper()
+    if service not in channel_keys:
+      raise ValueError(f"Unsupported service {channel['service']}, expected one of {', '.join(channel_keys)}")
+
+    template_request[channel_keys[service]] = {
+      'Action': channel['action'],
+      'Title': channel['title'],
+      'Body': channel['body']
+    }
+
+  return template_request
+
+def read_channels(push_template):
+  """
+  Returns the message of each channel found in a push template response.
+  """
+
+  return [
+    {
+      'service': service,
+      'action': push_template[key].get('Action', 'OPEN_APP'),
+      'title': push_template[key].get('Title', ''),
+      'body': push_template[key].get('Body', '')
+    }
+    for service, key in channel_keys.items() if push_template.get(key)
+  ]
+
 def delete_message(pinpoint_client, message_input):
   """
   Based on a message passed as parameter, it deletes a push notification 
-  message template in Pinpoint 
+  message template in Pinpoint, and its -PREMIUM sibling when there is one
   """
   try:
     template = message_input['template_name']
@@ -137,6 +397,15 @@ def delete_message(pinpoint_client, message_input):
       TemplateName = template
     ) 
 
+    if not template.endswith(premium_suffix):
+      try:
+        pinpoint_client.delete_push_template(
+          TemplateName = template + premium_suffix
+        )
+      except ClientError as ex:
+        if ex.response['Error']['Code'] != 'NotFoundException':
+          raise
+
     response = {
       'status': 'MESSAGE_DELETED',
       'message': f'Personalized message deleted for geofence {template}'
@@ -151,6 +420,111 @@ def delete_message(pinpoint_client, message_input):
 
   return response
 
+def list_messages(pinpoint_client, message_input):
+  """
+  Returns a page of the geofences having push templates, sorted by geofence ID, each one with its template and its
+  -PREMIUM sibling template. The nextToken is the geofence ID the next page starts after.
+  """
+
+  try:
+    limit = message_input.get('limit') or default_list_limit
+    if limit < 1:
+      raise ValueError('limit must be a positive number')
+
+    items = get_templates(pinpoint_client)
+
+    start = 0
+    if message_input.get('next_token'):
+      start = bisect.bisect_right([item['geofenceId'] for item in items], message_input['next_token'])
+
+    page = items[start:start + limit]
+
+    response = {
+      'status': 'MESSAGE_OK',
+      'items': page,
+      'nextToken': page[-1]['geofenceId'] if start + limit < len(items) else None
+    }
+
+  except ValueError as ex:
+    response = create_error_payload(
+      exception = 'ValueError',
+      message = str(ex),
+      endpoint_id = ''
+    )
+    response['error'] = response.pop('message')
+
+  except ClientError as ex:
+    response = create_error_payload(
+      exception = 'ClientError',
+      message = f'Unexpected error: {ex}',
+      endpoint_id = ''
+    )
+    response['error'] = response.pop('message')
+
+  return response
+
+def get_templates(pinpoint_client):
+  """
+  Returns the geofences having push templates from the container cache, listing them again from Amazon Pinpoint once
+  the cache expired.
+  """
+
+  with templates_cache_lock:
+    if templates_cache['items'] is not None and time.monotonic() < templates_cache['expires_at']:
+      return templates_cache['items']
+
+  items = list_templates(pinpoint_client)
+  ttl_seconds = float(os.environ.get('TEMPLATES_CACHE_TTL_SECONDS', default_templates_cache_ttl_seconds))
+
+  with templates_cache_lock:
+    templates_cache['items'] = items
+    templates_cache['expires_at'] = time.monotonic() + ttl_seconds
+
+  return items
+
+def invalidate_templates_cache():
+  """
+  Clears the templates cache after a template was created or deleted.
+  """
+
+  with templates_cache_lock:
+    templates_cache['items'] = None
+    templates_cache['expires_at'] = 0.0
+
+def list_templates(pinpoint_client):
+  """
+  Pages through the push templates of Amazon Pinpoint and joins each geofence template to its -PREMIUM sibling.
+  """
+
+  geofences = {}
+  list_args = {
+    'TemplateType': 'PUSH',
+    'PageSize': '100'
+  }
+
+  while True:
+    response_list = pinpoint_client.list_templates(**list_args)['TemplatesResponse']
+
+    for template in response_list.get('Item', []):
+      template_name = template['TemplateName']
+      is_premium = template_name.endswith(premium_suffix)
+      geofence_id = template_name[:-len(premium_suffix)] if is_premium else template_name
+
+      item = geofences.setdefault(geofence_id, {
+        'geofenceId': geofence_id,
+        'template': None,
+        'premiumTemplate': None,
+        'lastModifiedDate': None
+      })
+      item['premiumTemplate' if is_premium else 'template'] = template_name
+      item['lastModifiedDate'] = max(item['lastModifiedDate'] or '', template.get('LastModifiedDate') or '') or None
+
+    if not response_list.get('NextToken'):
+      break
+    list_args['NextToken'] = response_list['NextToken']
+
+  return [geofences[geofence_id] for geofence_id in sorted(geofences)]
+
 def create_error_payload(exception, message, endpoint_id):
   """
   Formats an error message to be added in case of failure
@@ -23,7 +23,10 @@ import uuid
 import os
 import json
 import random
+import time
 import manageMessages
+import rateLimiter
+from botocore.exceptions import ClientError
 
 class TestManageMessages(unittest.TestCase):  
   """
@@ -115,6 +118,332 @@ class TestManageMessages(unittest.TestCase):
 
     self.assertTrue(response)
     self.assertEqual(response['status'], 'MESSAGE_DELETED')       
+    self.assertEqual(
+      [args[1]['TemplateName'] for args in mock_client().delete_push_template.call_args_list],
+      ['my-sample-geofence-id', 'my-sample-geofence-id-PREMIUM']
+    )
+
+  @patch('boto3.client')
+  def test_delete_message_without_premium_template(self, mock_client):
+    """
+    Test when the lambda deletes a message template without -PREMIUM sibling on Pinpoint
+    """
+
+    def delete_push_template(TemplateName):
+      if TemplateName.endswith('-PREMIUM'):
+        raise ClientError({'Error': {'Code': 'NotFoundException', 'Message': 'Template not found'}}, 'DeletePushTemplate')
+      return {'Arn': f'arn:aws:mobiletargeting:us-east-1:SOME_ACCOUNT_ID:templates/{TemplateName}/PUSH'}
+
+    mock_client().delete_push_template.side_effect = delete_push_template
+    response = manageMessages.handler({'operation': 'deleteMessage', 'arguments': {'template': 'my-sample-geofence-id'}}, None)
+
+    self.assertEqual(response['status'], 'MESSAGE_DELETED')
+    self.assertEqual(mock_client().delete_push_template.call_count, 2)
+
+  @patch('boto3.client')
+  def test_get_messages_in_batch(self, mock_client):
+    """
+    Test when the lambda gets many message templates at once, returning them in order with the failed ones
+    """
+
+    event = {
+      'operation': 'getMessages',
+      'arguments': {
+        'templates': ['geofence-1', 'geofence-2', 'geofence-3']
+      }
+    }
+
+    def get_push_template(TemplateName):
+      if TemplateName == 'geofence-2':
+        raise ClientError({'Error': {'Code': 'NotFoundException', 'Message': 'Template not found'}}, 'GetPushTemplate')
+      return {
+        "PushNotificationTemplateResponse": {
+          'APNS': {
+            'Action': 'OPEN_APP',
+            'Title': f'Title {TemplateName}',
+            'Body': 'This is a sample body'
+          }
+        }
+      }
+
+    mock_client().get_push_template.side_effect = get_push_template
+    with patch.dict(os.environ, {'PINPOINT_RATE_LIMIT': '1000'}):
+      response = manageMessages.handler(event, None)
+
+    self.assertEqual([result['template'] for result in response], ['geofence-1', 'geofence-2', 'geofence-3'])
+    self.assertEqual(response[0]['status'], 'MESSAGE_OK')
+    self.assertEqual(response[2]['message']['title'], 'Title geofence-3')
+    self.assertEqual(response[1]['status'], 'MESSAGE_ERROR')
+    self.assertIn('NotFoundException', response[1]['error'])
+    self.assertNotIn('message', response[1])
+
+  @patch('boto3.client')
+  def test_create_and_delete_messages_in_batch(self, mock_client):
+    """
+    Test when the lambda creates and deletes many message templates at once
+    """
+
+    event = {
+      'operation': 'createMessages',
+      'arguments': {
+        'messages': [{
+          'template': f'geofence-{index}',
+          'input': {
+            'service': 'GCM',
+            'action': 'OPEN_APP',
+            'title': 'Sample Title',
+            'body': 'This is a sample body'
+          }
+        } for index in range(12)]
+      }
+    }
+
+    with patch.dict(os.environ, {'PINPOINT_RATE_LIMIT': '1000', 'PINPOINT_MAX_CONCURRENCY': '3'}):
+      response = manageMessages.handler(event, None)
+
+      self.assertEqual(len(response), 12)
+      self.assertTrue(all(result['status'] == 'MESSAGE_CREATED' for result in response))
+      self.assertEqual(response[11]['template'], 'geofence-11')
+      self.assertEqual(mock_client().create_push_template.call_count, 12)
+
+      response = manageMessages.handler({
+        'operation': 'deleteMessages',
+        'arguments': {
+          'templates': ['geofence-1', 'geofence-1-PREMIUM']
+        }
+      }, None)
+
+    self.assertEqual([result['status'] for result in response], ['MESSAGE_DELETED', 'MESSAGE_DELETED'])
+    self.assertEqual(response[1]['template'], 'geofence-1-PREMIUM')
+
+  @patch('boto3.client')
+  def test_batch_rejected_when_too_large(self, mock_client):
+    """
+    Test when a batch operation has more templates than allowed
+    """
+
+    event = {
+      'operation': 'deleteMessages',
+      'arguments': {
+        'templates': [f'geofence-{index}' for index in range(manageMessages.max_batch_size + 1)]
+      }
+    }
+
+    with self.assertRaises(ValueError):
+      manageMessages.handler(event, None)
+
+    mock_client().delete_push_template.assert_not_called()
+
+  def test_rate_limiter_spaces_calls(self):
+    """
+    Test when the rate limiter spaces the calls and refuses the ones after the deadline
+    """
+
+    acquire = rateLimiter.create_rate_limiter(100)
+    started = time.monotonic()
+
+    self.assertTrue(acquire(None))
+    self.assertTrue(acquire(None))
+    self.assertTrue(acquire(None))
+    self.assertGreaterEqual(time.monotonic() - started, 0.015)
+    self.assertFalse(acquire(time.monotonic()))
+
+  @patch('boto3.client')
+  def test_create_multi_channel_message_with_premium(self, mock_client):
+    """
+    Test when the lambda creates the messages of every channel and updates the existing premium template
+    """
+
+    event = {
+      'operation': 'createMessage',
+      'arguments': {
+        'template': 'my-sample-geofence-id',
+        'channels': [
+          {'service': 'APNS', 'action': 'OPEN_APP', 'title': 'Apple Title', 'body': 'Apple body'},
+          {'service': 'GCM', 'action': 'OPEN_APP', 'title': 'Android Title', 'body': 'Android body'},
+          {'service': 'DEFAULT', 'action': 'OPEN_APP', 'title': 'Default Title', 'body': 'Default body'}
+        ],
+        'premiumChannels': [
+          {'service': 'APNS', 'action': 'OPEN_APP', 'title': 'Premium Title', 'body': 'Premium body'}
+        ]
+      }
+    }
+
+    def create_push_template(TemplateName, PushNotificationTemplateRequest):
+      if TemplateName.endswith('-PREMIUM'):
+        raise ClientError({'Error': {'Code': 'BadRequestException', 'Message': 'Template already exists'}}, 'CreatePushTemplate')
+      return {}
+
+    mock_client().create_push_template.side_effect = create_push_template
+    response = manageMessages.handler(event, None)
+
+    self.assertEqual(response['status'], 'MESSAGE_CREATED')
+    self.assertEqual(mock_client().create_push_template.call_count, 2)
+
+    template_request = mock_client().create_push_template.call_args_list[0][1]['PushNotificationTemplateRequest']
+    self.assertEqual(sorted(template_request), ['APNS', 'Default', 'GCM'])
+    self.assertEqual(template_request['GCM']['Title'], 'Android Title')
+
+    mock_client().update_push_template.assert_called_once_with(
+      TemplateName = 'my-sample-geofence-id-PREMIUM',
+      PushNotificationTemplateRequest = {'APNS': {'Action': 'OPEN_APP', 'Title': 'Premium Title', 'Body': 'Premium body'}},
+      CreateNewVersion = False
+    )
+
+  @patch('boto3.client')
+  def test_create_message_bad_request(self, mock_client):
+    """
+    Test when Amazon Pinpoint refuses to create a new template and its error is returned instead of updating it
+    """
+
+    event = {
+      'operation': 'createMessage',
+      'arguments': {
+        'template': 'my-sample-geofence-id',
+        'channels': [
+          {'service': 'APNS', 'action': 'OPEN_APP', 'title': 'Apple Title', 'body': 'x' * 5000}
+        ]
+      }
+    }
+
+    mock_client().create_push_template.side_effect = ClientError({'Error': {'Code': 'BadRequestException', 'Message': 'Body is too long'}}, 'CreatePushTemplate')
+    mock_client().get_push_template.side_effect = ClientError({'Error': {'Code': 'NotFoundException', 'Message': 'Template not found'}}, 'GetPushTemplate')
+
+    response = manageMessages.handler(event, None)
+
+    self.assertEqual(response['status'], 'MESSAGE_ERROR')
+    self.assertIn('Body is too long', response['message'])
+    mock_client().update_push_template.assert_not_called()
+
+  @patch('boto3.client')
+  def test_create_message_with_unknown_service(self, mock_client):
+    """
+    Test when the lambda is asked to create a message for an unsupported channel
+    """
+
+    event = {
+      'operation': 'createMessage',
+      'arguments': {
+        'template': 'my-sample-geofence-id',
+        'input': {'service': 'SMS', 'action': 'OPEN_APP', 'title': 'Sample Title', 'body': 'This is a sample body'}
+      }
+    }
+
+    response = manageMessages.handler(event, None)
+
+    self.assertEqual(response['status'], 'MESSAGE_ERROR')
+    mock_client().create_push_template.assert_not_called()
+
+  @patch('boto3.client')
+  def test_get_multi_channel_message_with_premium(self, mock_client):
+    """
+    Test when the lambda gets the messages of every channel along with the premium template
+    """
+
+    event = {
+      'operation': 'getMessage',
+      'arguments': {
+        'template': 'my-sample-geofence-id',
+        'includePremium': True
+      }
+    }
+
+    templates = {
+      'my-sample-geofence-id': {
+        'GCM': {'Action': 'OPEN_APP', 'Title': 'Android Title', 'Body': 'Android body'},
+        'Default': {'Title': 'Default Title', 'Body': 'Default body'}
+      },
+      'my-sample-geofence-id-PREMIUM': {
+        'APNS': {'Action': 'OPEN_APP', 'Title': 'Premium Title', 'Body': 'Premium body'}
+      }
+    }
+
+    mock_client().get_push_template.side_effect = lambda TemplateName: {'PushNotificationTemplateResponse': templates[TemplateName]}
+    response = manageMessages.handler(event, None)
+
+    self.assertEqual(response['status'], 'MESSAGE_OK')
+    self.assertEqual(response['message']['service'], 'GCM')
+    self.assertEqual([channel['service'] for channel in response['channels']], ['GCM', 'DEFAULT'])
+    self.assertEqual(response['channels'][1]['action'], 'OPEN_APP')
+    self.assertEqual(response['premiumChannels'][0]['title'], 'Premium Title')
+    self.assertEqual(mock_client().get_push_template.call_count, 2)
+
+  @patch('boto3.client')
+  def test_get_message_without_premium_template(self, mock_client):
+    """
+    Test when the premium template of a geofence does not exist
+    """
+
+    event = {
+      'operation': 'getMessage',
+      'arguments': {
+        'template': 'my-sample-geofence-id',
+        'includePremium': True
+      }
+    }
+
+    def get_push_template(TemplateName):
+      if TemplateName.endswith('-PREMIUM'):
+        raise ClientError({'Error': {'Code': 'NotFoundException', 'Message': 'Template not found'}}, 'GetPushTemplate')
+      return {'PushNotificationTemplateResponse': {'APNS': {'Action': 'OPEN_APP', 'Title': 'Title', 'Body': 'Body'}}}
+
+    mock_client().get_push_template.side_effect = get_push_template
+    response = manageMessages.handler(event, None)
+
+    self.assertEqual(response['status'], 'MESSAGE_OK')
+    self.assertEqual(response['premiumChannels'], [])
+
+  @patch('boto3.client')
+  def test_list_messages_from_cache(self, mock_client):
+    """
+    Test when the lambda lists the geofence templates page by page, serving them from the cache until a template is deleted
+    """
+
+    manageMessages.invalidate_templates_cache()
+
+    pages = {
+      None: {
+        'TemplatesResponse': {
+          'Item': [
+            {'TemplateName': 'geofence-b', 'TemplateType': 'PUSH', 'LastModifiedDate': '2020-01-02T00:00:00.000Z'},
+            {'TemplateName': 'geofence-a-PREMIUM', 'TemplateType': 'PUSH', 'LastModifiedDate': '2020-01-03T00:00:00.000Z'}
+          ],
+          'NextToken': 'page-2'
+        }
+      },
+      'page-2': {
+        'TemplatesResponse': {
+          'Item': [
+            {'TemplateName': 'geofence-a', 'TemplateType': 'PUSH', 'LastModifiedDate': '2020-01-01T00:00:00.000Z'},
+            {'TemplateName': 'geofence-c', 'TemplateType': 'PUSH', 'LastModifiedDate': '2020-01-01T00:00:00.000Z'}
+          ]
+        }
+      }
+    }
+
+    mock_client().list_templates.side_effect = lambda **list_args: pages[list_args.get('NextToken')]
+
+    response = manageMessages.handler({'operation': 'listMessages', 'arguments': {'limit': 2}}, None)
+
+    self.assertEqual(response['status'], 'MESSAGE_OK')
+    self.assertEqual([item['geofenceId'] for item in response['items']], ['geofence-a', 'geofence-b'])
+    self.assertEqual(response['items'][0]['template'], 'geofence-a')
+    self.assertEqual(response['items'][0]['premiumTemplate'], 'geofence-a-PREMIUM')
+    self.assertEqual(response['items'][0]['lastModifiedDate'], '2020-01-03T00:00:00.000Z')
+    self.assertIsNone(response['items'][1]['premiumTemplate'])
+    self.assertEqual(response['nextToken'], 'geofence-b')
+    self.assertEqual(mock_client().list_templates.call_args_list[0][1]['TemplateType'], 'PUSH')
+
+    response = manageMessages.handler({'operation': 'listMessages', 'arguments': {'limit': 2, 'nextToken': 'geofence-b'}}, None)
+
+    self.assertEqual([item['geofenceId'] for item in response['items']], ['geofence-c'])
+    self.assertIsNone(response['nextToken'])
+    self.assertEqual(mock_client().list_templates.call_count, 2)
+
+    manageMessages.handler({'operation': 'deleteMessage', 'arguments': {'template': 'geofence-c'}}, None)
+    manageMessages.handler({'operation': 'listMessages', 'arguments': {}}, None)
+
+    self.assertEqual(mock_client().list_templates.call_count, 4)
 
 if __name__ == '__main__':
     unittest.main()  
\ No newline at end of file
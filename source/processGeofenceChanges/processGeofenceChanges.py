@@ -0,0 +1,451 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Lambda function used together with DynamoDB Streams to keep derived data of the geofences up to date.
+
+Every geofence written through AWS AppSync is stamped with the geohash prefix attributes used by the geohash global
+secondary indexes of the geofences table, so proximity lookups can query the nearby cells instead of scanning the table.
+Polygon geofences are also stamped with their vertices parsed from the definition, which is the geometry used by the
+search and indexing functions, and the largest polygon extent is kept in the sync table for the geohash searches.
+
+Every change is also recorded in the sync table, which holds the latest state of each geofence (or a tombstone once it
+is deleted) along with a monotonically increasing version. Mobile clients query that table by version to download only
+the geofences changed since their last sync. The layout of the table and the rules keeping the readers from skipping a
+version are described in the geofenceSync module. A geofence is synced with its derived attributes as they are stamped,
+so the MODIFY records changing only the derived attributes or the number of visits, updated by the sendMessage function
+on every notification, are not synced again.
+
+The geofences written before the stream was processed are stamped and synced once by the backfillGeofences operation,
+started by the GeofenceBackfill custom resource of the stack. It scans the table until close to the timeout, then
+invokes the function again with the key it stopped at.
+"""
+
+import json
+import os
+import re
+import time
+import datetime
+import urllib.request
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+
+import geohash
+import geofenceSync
+
+version_counter_id = '__version__'
+batch_write_size = 25
+polygon_pattern = re.compile(r'^\s*POLYGON\s*:\s*\((.*)\)\s*$', re.IGNORECASE | re.DOTALL)
+number_pattern = re.compile(r'[-+]?\d+(?:\.\d+)?')
+backfill_page_size = 100
+# time left to the backfill invocation when it hands the rest of the scan to a new one
+backfill_margin_ms = 15000
+# attributes left out of the comparison of the old and new images, and of the sync table items for the unsynced ones
+unsynced_attributes = ['visits']
+
+def handler(event, context):
+  """
+  Main handler function that gets the changed geofences from the DynamoDB stream and processes each record.
+  """
+
+  print('Request: {}'.format(json.dumps(event)))
+
+  if 'RequestType' in event:
+    return handle_custom_resource(event, context)
+  if event.get('operation') == 'backfillGeofences':
+    return backfill_geofences(event, context)
+
+  dbb_table_name = os.environ['DBB_TABLE_NAME']
+  sync_table_name = os.environ['SYNC_TABLE_NAME']
+  dbb_client = boto3.client('dynamodb')
+  changes = {}
+  recorded_extent = 0.0
+  count = 0
+
+  for record in event['Records']:
+    try:
+      if record['eventName'] == 'INSERT' or record['eventName'] == 'MODIFY':
+        # the extent is recorded before the polygon is stamped, so the geohash searches find it once it is indexed
+        extent = polygon_extent(record['dynamodb']['NewImage'])
+        if extent > recorded_extent:
+          record_polygon_extent(dbb_client, sync_table_name, extent)
+          recorded_extent = extent
+
+        stamp_derived_attributes(dbb_client, dbb_table_name, record)
+
+        if has_synced_changes(record):
+          changes[get_id(record)] = create_sync_item(record)
+        else:
+          print(f'Geofence ID {get_id(record)} has no synced change')
+      elif record['eventName'] == 'REMOVE':
+        changes[get_id(record)] = create_tombstone(record)
+
+    except Exception as e:
+      print("Failed to process:")
+      print('Record: {}'.format(json.dumps(record, indent = 4)))
+      print("ERROR: " + repr(e))
+      continue
+
+    count += 1
+
+  if changes:
+    record_changes(dbb_client, sync_table_name, list(changes.values()))
+
+  return f'{count} records processed.'
+
+def handle_custom_resource(event, context):
+  """
+  Starts the backfill when the GeofenceBackfill custom resource is created or updated, then answers CloudFormation
+  without waiting for the backfill to finish.
+  """
+
+  status = 'SUCCESS'
+
+  try:
+    if event['RequestType'] in ['Create', 'Update']:
+      invoke_backfill(context.invoked_function_arn, None)
+  except Exception as e:
+    print("ERROR: " + repr(e))
+    status = 'FAILED'
+
+  response_body = json.dumps({
+    'Status': status,
+    'Reason': 'See the details in CloudWatch Log Stream: ' + context.log_stream_name,
+    'PhysicalResourceId': 'geofence-backfill',
+    'StackId': event['StackId'],
+    'RequestId': event['RequestId'],
+    'LogicalResourceId': event['LogicalResourceId'],
+    'Data': {}
+  }).encode('utf-8')
+
+  urllib.request.urlopen(urllib.request.Request(
+    event['ResponseURL'],
+    data = response_body,
+    headers = {'content-type': '', 'content-length': str(len(response_body))},
+    method = 'PUT'
+  ))
+
+  return status
+
+def backfill_geofences(event, context):
+  """
+  Stamps the derived attributes of the geofences missing them and records these geofences in the sync table, scanning
+  the table from the key the previous invocation stopped at.
+  """
+
+  dbb_table_name = os.environ['DBB_TABLE_NAME']
+  sync_table_name = os.environ['SYNC_TABLE_NAME']
+  dbb_client = boto3.client('dynamodb')
+  scan_args = {'TableName': dbb_table_name, 'Limit': backfill_page_size}
+  stamped = 0
+
+  if event.get('startKey'):
+    scan_args['ExclusiveStartKey'] = event['startKey']
+
+  while True:
+    response_scan = dbb_client.scan(**scan_args)
+    changes = []
+
+    extent = max([polygon_extent(item) for item in response_scan['Items']] + [0.0])
+    if extent > 0:
+      record_polygon_extent(dbb_client, sync_table_name, extent)
+
+    for item in response_scan['Items']:
+      record = {'eventName': 'MODIFY', 'dynamodb': {'Keys': {'id': item['id']}, 'NewImage': item}}
+      if stamp_derived_attributes(dbb_client, dbb_table_name, record):
+        changes.append(create_sync_item(record))
+
+    if changes:
+      record_changes(dbb_client, sync_table_name, changes)
+      stamped += len(changes)
+
+    if 'LastEvaluatedKey' not in response_scan:
+      print(f'Backfill finished, {stamped} geofences stamped')
+      return f'{stamped} geofences stamped.'
+
+    scan_args['ExclusiveStartKey'] = response_scan['LastEvaluatedKey']
+
+    if context.get_remaining_time_in_millis() < backfill_margin_ms:
+      invoke_backfill(context.invoked_function_arn, scan_args['ExclusiveStartKey'])
+      print(f'Backfill continued by a new invocation, {stamped} geofences stamped')
+      return f'{stamped} geofences stamped.'
+
+def invoke_backfill(function_arn, start_key):
+  """
+  Asynchronously invokes the backfillGeofences operation, starting the scan after the given key.
+  """
+
+  boto3.client('lambda').invoke(
+    FunctionName = function_arn,
+    InvocationType = 'Event',
+    Payload = json.dumps({'operation': 'backfillGeofences', 'startKey': start_key})
+  )
+
+def is_synced_attribute(name):
+  """
+  Returns True for the attributes whose changes are synced, which are all of them except the derived ones and the
+  unsynced_attributes.
+  """
+
+  return not name.startswith('geohash') and name != 'polygon' and name not in unsynced_attributes
+
+def has_synced_changes(record):
+  """
+  Returns True if the record is an INSERT or a MODIFY changing at least one synced attribute of the geofence.
+  """
+
+  old_image = record['dynamodb'].get('OldImage')
+  if record['eventName'] != 'MODIFY' or old_image is None:
+    return True
+
+  new_image = record['dynamodb']['NewImage']
+  synced_names = {k for k in list(old_image) + list(new_image) if is_synced_attribute(k)}
+  return any(old_image.get(k) != new_image.get(k) for k in synced_names)
+
+def create_sync_item(record):
+  """
+  Creates the sync table item holding the latest state of a geofence, with the polygon vertices it is stamped with.
+  """
+
+  new_image = record['dynamodb']['NewImage']
+  sync_item = {k: v for k, v in new_image.items() if is_synced_attribute(k)}
+
+  polygon = derived_attributes(new_image).get('polygon')
+  if polygon:
+    sync_item['polygon'] = polygon
+
+  sync_item['deleted'] = {'BOOL': False}
+  return sync_item
+
+def create_tombstone(record):
+  """
+  Creates the sync table item telling the clients a geofence was deleted.
+  """
+
+  return {
+    'id': {'S': get_id(record)},
+    'deleted': {'BOOL': True},
+    'updatedAt': {'S': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'}
+  }
+
+def record_changes(dbb_client, sync_table_name, sync_items):
+  """
+  Writes the changed geofences to the sync table.
+
+  Only the last change of each geofence in the batch is kept, and a single counter update reserves one version per
+  change, so the versions follow the order of the stream records. The changes are stamped with the time their versions
+  were reserved, after the counter update, which the readers compare to the sync lag.
+  """
+
+  last_version = allocate_versions(dbb_client, sync_table_name, len(sync_items))
+  first_version = last_version - len(sync_items) + 1
+  recorded_at = str(time.time())
+
+  for offset, sync_item in enumerate(sync_items):
+    version = first_version + offset
+    sync_item['syncGroup'] = {'S': geofenceSync.shard_key(version)}
+    sync_item['version'] = {'N': str(version)}
+    sync_item['recordedAt'] = {'N': recorded_at}
+
+  for start in range(0, len(sync_items), batch_write_size):
+    request_items = {
+      sync_table_name: [{'PutRequest': {'Item': item}} for item in sync_items[start:start + batch_write_size]]
+    }
+
+    attempt = 0
+    while request_items:
+      response_batch = dbb_client.batch_write_item(RequestItems = request_items)
+      request_items = response_batch.get('UnprocessedItems')
+
+      if request_items:
+        attempt += 1
+        time.sleep(min(0.05 * (2 ** attempt), 1))
+
+  print(f'Versions {first_version} to {last_version} recorded in {sync_table_name}')
+
+def record_polygon_extent(dbb_client, sync_table_name, extent):
+  """
+  Raises the largest polygon extent stored in the sync table to the given extent in meters. The stored extent only
+  grows, so a search never misses a polygon that was larger before being edited.
+  """
+
+  try:
+    dbb_client.update_item(
+      TableName = sync_table_name,
+      Key = {
+        'id': {'S': geofenceSync.polygon_extent_id}
+      },
+      UpdateExpression = 'SET maxExtent = :extent',
+      ConditionExpression = 'attribute_not_exists(maxExtent) OR maxExtent < :extent',
+      ExpressionAttributeValues = {
+        ':extent': {'N': str(extent)}
+      }
+    )
+    print(f'Largest polygon extent raised to {extent} meters')
+  except dbb_client.exceptions.ConditionalCheckFailedException:
+    pass
+
+def allocate_versions(dbb_client, sync_table_name, count):
+  """
+  Atomically increases the version counter of the sync table and returns the last reserved version.
+  """
+
+  response_counter = dbb_client.update_item(
+    TableName = sync_table_name,
+    Key = {
+      'id': {'S': version_counter_id}
+    },
+    UpdateExpression = 'ADD currentVersion :count',
+    ExpressionAttributeValues = {
+      ':count': {'N': str(count)}
+    },
+    ReturnValues = 'UPDATED_NEW'
+  )
+
+  return int(response_counter['Attributes']['currentVersion']['N'])
+
+def stamp_derived_attributes(dbb_client, dbb_table_name, record):
+  """
+  Updates the geohash and polygon attributes of a geofence when they are missing or do not match its coordinates and
+  definition anymore.
+
+  Returns True if the item was updated. The update produces a new MODIFY record in the stream whose derived attributes
+  already match, so it is neither updated nor synced again.
+  """
+
+  new_image = record['dynamodb']['NewImage']
+  geofence_id = get_id(record)
+  expected = derived_attributes(new_image)
+  current = {k: v for k, v in new_image.items() if k.startswith('geohash') or k == 'polygon'}
+
+  deserializer = TypeDeserializer()
+  if current.keys() == expected.keys() and all(deserializer.deserialize(current[k]) == deserializer.deserialize(v) for k, v in expected.items()):
+    return False
+
+  expression_names = {'#id': 'id'}
+  expression_values = {}
+  set_expressions = []
+  remove_expressions = []
+
+  for name, value in expected.items():
+    expression_names[f'#{name}'] = name
+    expression_values[f':{name}'] = value
+    set_expressions.append(f'#{name} = :{name}')
+
+  for name in current:
+    if name not in expected:
+      expression_names[f'#{name}'] = name
+      remove_expressions.append(f'#{name}')
+
+  update_expression = ''
+  if set_expressions:
+    update_expression += 'SET ' + ', '.join(set_expressions)
+  if remove_expressions:
+    update_expression += ' REMOVE ' + ', '.join(remove_expressions)
+
+  update_args = {
+    'TableName': dbb_table_name,
+    'Key': {
+      'id': {'S': geofence_id}
+    },
+    'UpdateExpression': update_expression.strip(),
+    'ConditionExpression': 'attribute_exists(#id)',
+    'ExpressionAttributeNames': expression_names
+  }
+
+  if expression_values:
+    update_args['ExpressionAttributeValues'] = expression_values
+
+  try:
+    dbb_client.update_item(**update_args)
+  except dbb_client.exceptions.ConditionalCheckFailedException:
+    print(f'Geofence ID {geofence_id} was deleted before its derived attributes were updated')
+    return False
+
+  print(f'Attributes {list(expected)} set for geofence ID {geofence_id}')
+  return True
+
+def derived_attributes(new_image):
+  """
+  Returns the geohash and polygon attributes a geofence should have, in Amazon DynamoDB format.
+  """
+
+  deserializer = TypeDeserializer()
+  attributes = {}
+
+  if 'latitude' in new_image and 'longitude' in new_image:
+    geohashes = geohash.geohash_attributes(
+      float(deserializer.deserialize(new_image['latitude'])),
+      float(deserializer.deserialize(new_image['longitude']))
+    )
+    attributes.update({k: {'S': v} for k, v in geohashes.items()})
+
+  vertices = parse_polygon(deserializer.deserialize(new_image['definition']) if 'definition' in new_image else None)
+  if vertices:
+    attributes['polygon'] = {
+      'L': [{'M': {'latitude': {'N': repr(lat)}, 'longitude': {'N': repr(lon)}}} for lat, lon in vertices]
+    }
+
+  return attributes
+
+def polygon_extent(new_image):
+  """
+  Returns the distance in meters from the coordinates of a polygon geofence to its farthest vertex, or 0 for the other
+  geofences.
+  """
+
+  deserializer = TypeDeserializer()
+  vertices = parse_polygon(deserializer.deserialize(new_image['definition']) if 'definition' in new_image else None)
+
+  if not vertices or 'latitude' not in new_image or 'longitude' not in new_image:
+    return 0.0
+
+  latitude = float(deserializer.deserialize(new_image['latitude']))
+  longitude = float(deserializer.deserialize(new_image['longitude']))
+
+  return max(geohash.distance(latitude, longitude, lat, lon) for lat, lon in vertices)
+
+def parse_polygon(definition):
+  """
+  Returns the (latitude, longitude) vertices of a 'POLYGON:(lat lng, lat lng, ...)' geofence definition, or None if the
+  definition is not a valid polygon. The closing vertex is dropped when it repeats the first one.
+  """
+
+  match = polygon_pattern.match(definition or '')
+  if not match:
+    return None
+
+  numbers = [float(number) for number in number_pattern.findall(match.group(1))]
+  vertices = list(zip(numbers[0::2], numbers[1::2]))
+
+  if len(vertices) > 1 and vertices[0] == vertices[-1]:
+    vertices.pop()
+
+  if len(numbers) % 2 or len(vertices) < 3:
+    return None
+  if any(abs(lat) > 90 or abs(lon) > 180 for lat, lon in vertices):
+    return None
+
+  return vertices
+
+def get_id(record):
+  """
+  Returns the Amazon DynamoDB key.
+  """
+
+  return record['dynamodb']['Keys']['id']['S']
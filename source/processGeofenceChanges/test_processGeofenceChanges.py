@@ -0,0 +1,387 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+import unittest
+from unittest.mock import Mock, patch
+
+import os
+import json
+import time
+import geofenceSync
+import processGeofenceChanges
+
+class TestProcessGeofenceChanges(unittest.TestCase):
+  """
+  Test class for the ProcessGeofenceChanges function 
+  """
+
+  ENV_DBB_TABLE_NAME = 'DBB_TABLE_NAME'
+  DDB_TABLE_NAME = 'geofence-ddb-table'
+  ENV_SYNC_TABLE_NAME = 'SYNC_TABLE_NAME'
+  SYNC_TABLE_NAME = 'geofence-sync-table'
+
+  def setUp(self):
+    """
+    Setting up the test case
+    """
+    os.environ[TestProcessGeofenceChanges.ENV_DBB_TABLE_NAME] = TestProcessGeofenceChanges.DDB_TABLE_NAME
+    os.environ[TestProcessGeofenceChanges.ENV_SYNC_TABLE_NAME] = TestProcessGeofenceChanges.SYNC_TABLE_NAME
+
+  def create_record(self, event_name, new_image, old_image = None):
+    """
+    Creates a DynamoDB stream record for the given geofence images
+    """
+
+    record = {
+      'eventName': event_name,
+      'dynamodb': {
+        'Keys': {
+          'id': {'S': 'geofence-id'}
+        },
+        'NewImage': new_image
+      }
+    }
+
+    if old_image is not None:
+      record['dynamodb']['OldImage'] = old_image
+
+    return record
+
+  @patch('boto3.client')
+  def test_stamp_geohashes_on_insert(self, mock_client):
+    """
+    Test when a new geofence is stamped with its geohash attributes and synced without them
+    """
+
+    event = {
+      'Records': [
+        self.create_record('INSERT', {
+          'id': {'S': 'geofence-id'},
+          'latitude': {'N': '57.64911'},
+          'longitude': {'N': '10.40744'},
+          'visits': {'N': '0'}
+        })
+      ]
+    }
+
+    mock_client().update_item.return_value = {
+      'Attributes': {
+        'currentVersion': {'N': '1'}
+      }
+    }
+    mock_client().batch_write_item.return_value = {'UnprocessedItems': {}}
+
+    response = processGeofenceChanges.handler(event, None)
+
+    update_args = mock_client().update_item.call_args_list[0][1]
+    self.assertEqual(response, '1 records processed.')
+    self.assertEqual(update_args['Key'], {'id': {'S': 'geofence-id'}})
+    self.assertEqual(update_args['ExpressionAttributeValues'], {
+      ':geohash4': {'S': 'u4pr'},
+      ':geohash6': {'S': 'u4pruy'}
+    })
+
+    sync_item = mock_client().batch_write_item.call_args[1]['RequestItems']['geofence-sync-table'][0]['PutRequest']['Item']
+    self.assertEqual(sync_item['id'], {'S': 'geofence-id'})
+    self.assertNotIn('geohash4', sync_item)
+    self.assertNotIn('visits', sync_item)
+
+  @patch('boto3.client')
+  def test_sync_geofence_already_stamped(self, mock_client):
+    """
+    Test when the geohash attributes already match the coordinates, so the geofence is only recorded in the sync table
+    """
+
+    event = {
+      'Records': [
+        self.create_record('MODIFY', {
+          'id': {'S': 'geofence-id'},
+          'latitude': {'N': '57.64911'},
+          'longitude': {'N': '10.40744'},
+          'geohash4': {'S': 'u4pr'},
+          'geohash6': {'S': 'u4pruy'}
+        })
+      ]
+    }
+
+    mock_client().update_item.return_value = {
+      'Attributes': {
+        'currentVersion': {'N': '42'}
+      }
+    }
+    mock_client().batch_write_item.return_value = {'UnprocessedItems': {}}
+
+    response = processGeofenceChanges.handler(event, None)
+
+    self.assertEqual(response, '1 records processed.')
+    self.assertEqual(mock_client().update_item.call_args[1]['Key'], {'id': {'S': '__version__'}})
+
+    sync_item = mock_client().batch_write_item.call_args[1]['RequestItems']['geofence-sync-table'][0]['PutRequest']['Item']
+    self.assertEqual(sync_item['version'], {'N': '42'})
+    self.assertEqual(sync_item['deleted'], {'BOOL': False})
+    self.assertNotIn('geohash6', sync_item)
+
+  @patch('boto3.client')
+  def test_sync_tombstones_and_last_change_per_geofence(self, mock_client):
+    """
+    Test when a geofence is modified and then deleted in the same batch, only its tombstone is recorded
+    """
+
+    event = {
+      'Records': [
+        self.create_record('MODIFY', {
+          'id': {'S': 'geofence-id'},
+          'name': {'S': 'some-name'}
+        }),
+        {
+          'eventName': 'REMOVE',
+          'dynamodb': {
+            'Keys': {
+              'id': {'S': 'geofence-id'}
+            }
+          }
+        }
+      ]
+    }
+
+    mock_client().update_item.return_value = {
+      'Attributes': {
+        'currentVersion': {'N': '7'}
+      }
+    }
+    mock_client().batch_write_item.return_value = {'UnprocessedItems': {}}
+
+    response = processGeofenceChanges.handler(event, None)
+
+    self.assertEqual(response, '2 records processed.')
+    self.assertEqual(mock_client().update_item.call_args[1]['ExpressionAttributeValues'], {':count': {'N': '1'}})
+
+    sync_items = mock_client().batch_write_item.call_args[1]['RequestItems']['geofence-sync-table']
+    self.assertEqual(len(sync_items), 1)
+    self.assertEqual(sync_items[0]['PutRequest']['Item']['deleted'], {'BOOL': True})
+    self.assertEqual(sync_items[0]['PutRequest']['Item']['version'], {'N': '7'})
+
+  @patch('boto3.client')
+  def test_stamp_polygon_on_modify(self, mock_client):
+    """
+    Test when a polygon geofence is stamped with the vertices parsed from its definition, and synced with them
+    """
+
+    event = {
+      'Records': [
+        self.create_record('MODIFY', {
+          'id': {'S': 'geofence-id'},
+          'latitude': {'N': '57.64911'},
+          'longitude': {'N': '10.40744'},
+          'definition': {'S': 'POLYGON:(57.64 10.40, 57.66 10.40, 57.66 10.42, 57.64 10.40)'},
+          'geohash4': {'S': 'u4pr'},
+          'geohash6': {'S': 'u4pruy'}
+        })
+      ]
+    }
+
+    mock_client().update_item.return_value = {
+      'Attributes': {
+        'currentVersion': {'N': '1'}
+      }
+    }
+    mock_client().batch_write_item.return_value = {'UnprocessedItems': {}}
+
+    processGeofenceChanges.handler(event, None)
+
+    update_args = mock_client().update_item.call_args_list[1][1]
+    self.assertEqual(update_args['UpdateExpression'], 'SET #geohash4 = :geohash4, #geohash6 = :geohash6, #polygon = :polygon')
+    self.assertEqual(len(update_args['ExpressionAttributeValues'][':polygon']['L']), 3)
+    self.assertEqual(update_args['ExpressionAttributeValues'][':polygon']['L'][2], {
+      'M': {'latitude': {'N': '57.66'}, 'longitude': {'N': '10.42'}}
+    })
+
+    sync_item = mock_client().batch_write_item.call_args[1]['RequestItems']['geofence-sync-table'][0]['PutRequest']['Item']
+    self.assertEqual(sync_item['polygon'], update_args['ExpressionAttributeValues'][':polygon'])
+
+    extent_args = mock_client().update_item.call_args_list[0][1]
+    self.assertEqual(extent_args['Key'], {'id': {'S': '__polygon_extent__'}})
+    self.assertAlmostEqual(float(extent_args['ExpressionAttributeValues'][':extent']['N']), 1423, delta = 1)
+
+  @patch('boto3.client')
+  def test_visits_and_derived_changes_not_synced(self, mock_client):
+    """
+    Test when the MODIFY records only change the visits of a geofence, or only stamp its derived attributes, nothing is
+    written to the sync table
+    """
+
+    old_image = {
+      'id': {'S': 'geofence-id'},
+      'name': {'S': 'some-name'},
+      'latitude': {'N': '57.64911'},
+      'longitude': {'N': '10.40744'},
+      'visits': {'N': '3'}
+    }
+    stamped_image = dict(old_image, geohash4 = {'S': 'u4pr'}, geohash6 = {'S': 'u4pruy'})
+    visited_image = dict(stamped_image, visits = {'N': '4'})
+
+    event = {
+      'Records': [
+        self.create_record('MODIFY', stamped_image, old_image),
+        self.create_record('MODIFY', visited_image, stamped_image)
+      ]
+    }
+
+    response = processGeofenceChanges.handler(event, None)
+
+    self.assertEqual(response, '2 records processed.')
+    mock_client().update_item.assert_not_called()
+    mock_client().batch_write_item.assert_not_called()
+
+  @patch('boto3.client')
+  def test_backfill_stamps_and_syncs_unstamped_geofences(self, mock_client):
+    """
+    Test when the backfill stamps the geofences missing their geohash attributes, syncs them, and hands the rest of the
+    scan to a new invocation once close to the timeout
+    """
+
+    stamped = {
+      'id': {'S': 'geofence-stamped'},
+      'latitude': {'N': '57.64911'},
+      'longitude': {'N': '10.40744'},
+      'geohash4': {'S': 'u4pr'},
+      'geohash6': {'S': 'u4pruy'}
+    }
+    unstamped = {
+      'id': {'S': 'geofence-unstamped'},
+      'latitude': {'N': '57.64911'},
+      'longitude': {'N': '10.40744'},
+      'visits': {'N': '5'}
+    }
+
+    mock_client().scan.side_effect = [
+      {'Items': [stamped, unstamped], 'LastEvaluatedKey': {'id': {'S': 'geofence-unstamped'}}},
+      {'Items': []}
+    ]
+    mock_client().update_item.return_value = {
+      'Attributes': {
+        'currentVersion': {'N': '3'}
+      }
+    }
+    mock_client().batch_write_item.return_value = {'UnprocessedItems': {}}
+
+    context = Mock(invoked_function_arn = 'process-geofence-changes-arn')
+    context.get_remaining_time_in_millis.return_value = 1000
+
+    response = processGeofenceChanges.handler({'operation': 'backfillGeofences'}, context)
+
+    self.assertEqual(response, '1 geofences stamped.')
+    self.assertEqual(mock_client().update_item.call_args_list[0][1]['Key'], {'id': {'S': 'geofence-unstamped'}})
+
+    sync_items = mock_client().batch_write_item.call_args[1]['RequestItems']['geofence-sync-table']
+    self.assertEqual([item['PutRequest']['Item']['id'] for item in sync_items], [{'S': 'geofence-unstamped'}])
+
+    invoke_args = mock_client().invoke.call_args[1]
+    self.assertEqual(invoke_args['InvocationType'], 'Event')
+    self.assertEqual(json.loads(invoke_args['Payload']), {'operation': 'backfillGeofences', 'startKey': {'id': {'S': 'geofence-unstamped'}}})
+
+    context.get_remaining_time_in_millis.return_value = 60000
+    response = processGeofenceChanges.handler(json.loads(invoke_args['Payload']), context)
+
+    self.assertEqual(response, '0 geofences stamped.')
+    self.assertEqual(mock_client().scan.call_args[1]['ExclusiveStartKey'], {'id': {'S': 'geofence-unstamped'}})
+    mock_client().invoke.assert_called_once()
+
+  @patch('urllib.request.urlopen')
+  @patch('boto3.client')
+  def test_backfill_started_by_custom_resource(self, mock_client, mock_urlopen):
+    """
+    Test when the custom resource is created, the backfill is started and CloudFormation is answered right away
+    """
+
+    event = {
+      'RequestType': 'Create',
+      'ResponseURL': 'https://cloudformation-response',
+      'StackId': 'some-stack',
+      'RequestId': 'some-request',
+      'LogicalResourceId': 'GeofenceBackfill'
+    }
+    context = Mock(invoked_function_arn = 'process-geofence-changes-arn', log_stream_name = 'some-log-stream')
+
+    self.assertEqual(processGeofenceChanges.handler(event, context), 'SUCCESS')
+    self.assertEqual(mock_client().invoke.call_args[1]['FunctionName'], 'process-geofence-changes-arn')
+
+    request = mock_urlopen.call_args[0][0]
+    self.assertEqual(request.get_method(), 'PUT')
+    self.assertEqual(json.loads(request.data)['Status'], 'SUCCESS')
+
+  def test_interleaved_batches_do_not_skip_versions(self):
+    """
+    Test when a second batch reserves and writes its versions while the first one is still writing, a client syncing in
+    between does not move past the versions of the first batch
+    """
+
+    sync_table = {}
+    counter = {'currentVersion': 0}
+    dbb_client = Mock()
+
+    def update_item(**update_args):
+      counter['currentVersion'] += int(update_args['ExpressionAttributeValues'][':count']['N'])
+      return {'Attributes': {'currentVersion': {'N': str(counter['currentVersion'])}}}
+
+    def query(**query_args):
+      values = query_args['ExpressionAttributeValues']
+      items = [item for item in sync_table.values() if item['syncGroup'] == values[':syncGroup'] and int(item['version']['N']) > int(values[':sinceVersion']['N'])]
+      return {'Items': sorted(items, key = lambda item: int(item['version']['N']))}
+
+    def write_batch(request_items):
+      for request in request_items['geofence-sync-table']:
+        sync_table[request['PutRequest']['Item']['id']['S']] = request['PutRequest']['Item']
+      return {'UnprocessedItems': {}}
+
+    def batch_write_item(RequestItems):
+      if not sync_table and not interleaved:
+        # the second batch runs while the first one is writing, and a client syncs right after it
+        interleaved.append(True)
+        processGeofenceChanges.record_changes(dbb_client, 'geofence-sync-table', [create_item('geofence-c'), create_item('geofence-d')])
+        interleaved.append(geofenceSync.query_changes(dbb_client, 'geofence-sync-table', 0))
+
+      return write_batch(RequestItems)
+
+    def create_item(geofence_id):
+      return {'id': {'S': geofence_id}, 'deleted': {'BOOL': False}}
+
+    interleaved = []
+    dbb_client.update_item.side_effect = update_item
+    dbb_client.query.side_effect = query
+    dbb_client.batch_write_item.side_effect = batch_write_item
+
+    processGeofenceChanges.record_changes(dbb_client, 'geofence-sync-table', [create_item('geofence-a'), create_item('geofence-b')])
+
+    self.assertEqual(sync_table['geofence-a']['version'], {'N': '1'})
+    self.assertEqual(sync_table['geofence-c']['version'], {'N': '3'})
+    self.assertNotEqual(sync_table['geofence-a']['syncGroup'], sync_table['geofence-b']['syncGroup'])
+
+    # versions 3 and 4 were visible before 1 and 2, but they were not settled yet
+    self.assertEqual(interleaved[1], ([], False))
+
+    settled_at = time.time() + geofenceSync.sync_lag_seconds + 1
+    changes, more = geofenceSync.query_changes(dbb_client, 'geofence-sync-table', 0, 3, now = settled_at)
+    self.assertEqual([change['id']['S'] for change in changes], ['geofence-a', 'geofence-b', 'geofence-c'])
+    self.assertTrue(more)
+
+    changes, more = geofenceSync.query_changes(dbb_client, 'geofence-sync-table', 3, 3, now = settled_at)
+    self.assertEqual([change['id']['S'] for change in changes], ['geofence-d'])
+    self.assertFalse(more)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Vectorized point-in-polygon and distance engine used to evaluate a device location against polygon geofences.
+
+All the polygons are flattened into NumPy arrays of edges once, so a location is tested against every candidate
+polygon with a handful of array operations instead of a Python loop per vertex. The polygons are first prefiltered by
+their bounding boxes, then the edges of the remaining candidates are projected around the location (equirectangular,
+in meters), which is accurate for the geofence sizes used by the solution.
+"""
+
+import numpy as np
+
+earth_radius = 6371008.8
+meters_per_degree = np.pi * earth_radius / 180.0
+
+def build_polygon_index(polygons):
+  """
+  Builds the polygon index from a list of (geofence id, [(latitude, longitude), ...]) tuples.
+  """
+
+  ids = []
+  counts = []
+  latitudes = []
+  longitudes = []
+
+  for geofence_id, vertices in polygons:
+    ids.append(geofence_id)
+    counts.append(len(vertices))
+    latitudes.extend(float(latitude) for latitude, longitude in vertices)
+    longitudes.extend(float(longitude) for latitude, longitude in vertices)
+
+  counts = np.array(counts, dtype=np.int64)
+  offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+  np.cumsum(counts, out=offsets[1:])
+
+  start_latitudes = np.array(latitudes, dtype=np.float64)
+  start_longitudes = np.array(longitudes, dtype=np.float64)
+
+  # each edge goes from a vertex to the next one of the same polygon, the last vertex closes the ring
+  next_vertex = np.arange(1, len(start_latitudes) + 1, dtype=np.int64)
+  next_vertex[offsets[1:] - 1] = offsets[:-1]
+
+  owners = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+
+  return {
+    'ids': ids,
+    'edge_counts': counts,
+    'edge_offsets': offsets,
+    'edge_owners': owners,
+    'start_latitudes': start_latitudes,
+    'start_longitudes': start_longitudes,
+    'end_latitudes': start_latitudes[next_vertex],
+    'end_longitudes': start_longitudes[next_vertex],
+    'min_latitudes': np.minimum.reduceat(start_latitudes, offsets[:-1]) if len(counts) else np.empty(0),
+    'max_latitudes': np.maximum.reduceat(start_latitudes, offsets[:-1]) if len(counts) else np.empty(0),
+    'min_longitudes': np.minimum.reduceat(start_longitudes, offsets[:-1]) if len(counts) else np.empty(0),
+    'max_longitudes': np.maximum.reduceat(start_longitudes, offsets[:-1]) if len(counts) else np.empty(0)
+  }
+
+def locate(index, latitude, longitude, max_distance = 0.0):
+  """
+  Returns the positions in the index of the polygons within max_distance meters of the location, along with their
+  distances in meters. The distance is 0 when the location is inside the polygon.
+  """
+
+  cos_latitude = max(np.cos(np.radians(latitude)), 1e-6)
+  margin_latitude = max_distance / meters_per_degree
+  margin_longitude = max_distance / (meters_per_degree * cos_latitude)
+
+  candidates = np.flatnonzero(
+    (index['min_latitudes'] - margin_latitude <= latitude) & (latitude <= index['max_latitudes'] + margin_latitude) &
+    (index['min_longitudes'] - margin_longitude <= longitude) & (longitude <= index['max_longitudes'] + margin_longitude)
+  )
+
+  if not len(candidates):
+    return candidates, np.empty(0)
+
+  is_candidate = np.zeros(len(index['ids']), dtype=bool)
+  is_candidate[candidates] = True
+  edges = is_candidate[index['edge_owners']]
+
+  # projects the candidate edges around the location, which becomes the origin
+  x1 = (index['start_longitudes'][edges] - longitude) * meters_per_degree * cos_latitude
+  y1 = (index['start_latitudes'][edges] - latitude) * meters_per_degree
+  x2 = (index['end_longitudes'][edges] - longitude) * meters_per_degree * cos_latitude
+  y2 = (index['end_latitudes'][edges] - latitude) * meters_per_degree
+
+  dx = x2 - x1
+  dy = y2 - y1
+
+  # ray casting along the positive x axis
+  straddles = (y1 > 0) != (y2 > 0)
+  with np.errstate(divide = 'ignore', invalid = 'ignore'):
+    crossings = straddles & (x1 - y1 * dx / dy > 0)
+
+  # distance from the origin to each edge segment
+  lengths = dx * dx + dy * dy
+  with np.errstate(divide = 'ignore', invalid = 'ignore'):
+    t = np.clip(np.where(lengths > 0, -(x1 * dx + y1 * dy) / lengths, 0.0), 0.0, 1.0)
+  edge_distances = np.hypot(x1 + t * dx, y1 + t * dy)
+
+  starts = np.zeros(len(candidates), dtype=np.int64)
+  np.cumsum(index['edge_counts'][candidates][:-1], out=starts[1:])
+
+  inside = np.add.reduceat(crossings.astype(np.int64), starts) % 2 == 1
+  distances = np.where(inside, 0.0, np.minimum.reduceat(edge_distances, starts))
+
+  within = distances <= max_distance
+  return candidates[within], distances[within]
+
+def find_containing(index, latitude, longitude):
+  """
+  Returns the ids of the polygons containing the location.
+  """
+
+  positions, distances = locate(index, latitude, longitude)
+  return [index['ids'][position] for position in positions]
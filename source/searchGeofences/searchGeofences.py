@@ -0,0 +1,548 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Lambda function used as an AWS AppSync datasource to return the geofences around a device.
+
+Geofences are mirrored into Amazon ElasticSearch by the indexDdbDataToEs function, so this function runs geo_distance
+or geo_bounding_box queries against that index and pages through the results with search_after. Mobile clients get only
+the geofences close to them instead of downloading the whole geofence table.
+
+When the analytics stack is not deployed (no ES_HOST), the same query is answered from the geohash indexes of the
+Amazon DynamoDB geofences table.
+
+Polygon geofences match when their shape intersects the searched area, and their distance is the distance to the
+polygon (0 when the device is inside it), which is also the distance they are sorted by.
+
+The syncGeofences operation returns the geofences changed since a version from the sync table, merging its shards in
+version order (see the geofenceSync module).
+"""
+
+import json
+import os
+import math
+import time
+import base64
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+
+import geohash
+import geofenceSync
+import geofenceItems
+
+index_name = 'index-geofences'
+service = 'es'
+
+default_radius = 1000
+default_limit = 20
+max_limit = 100
+default_sync_limit = 100
+max_sync_limit = 1000
+max_search_cells = 64
+max_polygon_hits = 1000
+polygon_extent_ttl_seconds = 300
+circle_vertices = 32
+
+es_client = None
+dbb_client = None
+polygon_extent = {'value': 0.0, 'expires_at': 0.0}
+
+def handler(event, context):
+  """
+  Handler for the Lambda function.
+
+  Gets the coordinates of the device and an optional radius in meters (or a bounding box) from the AWS AppSync API,
+  then returns one page of the geofences found in that area, sorted by distance from the device.
+  """
+
+  print('request: {}'.format(json.dumps(event)))
+  arguments = event['arguments']
+
+  if event.get('operation') == 'syncGeofences':
+    response = sync_geofences(arguments)
+    print('response: {} changes, nextToken {}'.format(len(response['items']), response['nextToken']))
+    return response
+
+  limit = min(int(arguments.get('limit') or default_limit), max_limit)
+
+  if os.environ.get('ES_HOST'):
+    response = search_elasticsearch(arguments, limit)
+  else:
+    response = search_geohash_index(arguments, limit)
+
+  print('response: {}'.format(json.dumps(response)))
+  return response
+
+def search_elasticsearch(arguments, limit):
+  """
+  Returns one page of geofences from the Amazon ElasticSearch geofences index.
+
+  ElasticSearch can only sort by the distance to the location of a geofence, which is not the distance to a polygon.
+  When sorting by distance, the point geofences are paged by ElasticSearch while the polygons intersecting the area are
+  all fetched, measured with their shape and merged into the page, the same way as the geohash index searches.
+  """
+
+  search_after = decode_next_token(arguments.get('nextToken'))
+  coordinates = arguments.get('coordinates')
+
+  search_body = {
+    'size': limit,
+    'query': create_geo_query(arguments, 'point' if coordinates else None),
+    'sort': create_sort(arguments),
+    '_source': {
+      'excludes': ['location', 'shape']
+    }
+  }
+
+  if search_after:
+    search_body['search_after'] = search_after
+
+  hits = get_es_client().search(
+    index = index_name,
+    body = search_body
+  )['hits']['hits']
+
+  if not coordinates:
+    return {
+      'items': [create_geofence(hit, False) for hit in hits],
+      'nextToken': encode_next_token(hits[-1]['sort']) if len(hits) == limit else None
+    }
+
+  geofences = [create_geofence(hit, True) for hit in hits]
+  polygons = search_polygons(arguments)
+  sort_key = lambda g: [g['distance'], g['id']]
+
+  if search_after:
+    polygons = [polygon for polygon in polygons if sort_key(polygon) > search_after]
+
+  geofences = sorted(geofences + polygons, key = sort_key)
+  page = geofences[:limit]
+
+  return {
+    'items': page,
+    'nextToken': encode_next_token(sort_key(page[-1])) if len(page) == limit else None
+  }
+
+def search_polygons(arguments):
+  """
+  Returns all the polygon geofences of the Amazon ElasticSearch index intersecting the searched area, with their
+  distance to the device, up to max_polygon_hits of them.
+  """
+
+  hits = get_es_client().search(
+    index = index_name,
+    body = {
+      'size': max_polygon_hits,
+      'query': create_geo_query(arguments, 'polygon'),
+      '_source': {
+        'excludes': ['location', 'shape']
+      }
+    }
+  )['hits']['hits']
+
+  if len(hits) == max_polygon_hits:
+    print(f'More than {max_polygon_hits} polygon geofences in the searched area, only the first ones are returned')
+
+  polygons = [hit['_source'] for hit in hits]
+  radius = None if arguments.get('boundingBox') else float(arguments.get('radius') or default_radius)
+  distances = get_polygon_distances(polygons, arguments['coordinates'], radius)
+
+  for polygon in polygons:
+    polygon['distance'] = distances.get(polygon['id'], math.inf)
+
+  return [polygon for polygon in polygons if polygon['distance'] != math.inf]
+
+def search_geohash_index(arguments, limit):
+  """
+  Returns one page of geofences from the geohash indexes of the Amazon DynamoDB geofences table.
+
+  The searched area is covered by a handful of geohash cells that are queried concurrently, then the candidates are
+  filtered by the exact distance (or bounding box) and sorted the same way as the ElasticSearch results, so the
+  pagination token has the same shape for both backends. A polygon is indexed in the cell of its coordinates only, so
+  the queried cells cover the searched area grown by the largest polygon extent.
+  """
+
+  coordinates = arguments.get('coordinates')
+  bounding_box = arguments.get('boundingBox')
+
+  if bounding_box:
+    box = (
+      float(bounding_box['bottomRight']['latitude']),
+      float(bounding_box['topLeft']['longitude']),
+      float(bounding_box['topLeft']['latitude']),
+      float(bounding_box['bottomRight']['longitude'])
+    )
+  elif coordinates:
+    radius = float(arguments.get('radius') or default_radius)
+    box = geohash.bounding_box(float(coordinates['latitude']), float(coordinates['longitude']), radius)
+  else:
+    raise ValueError('Either coordinates or boundingBox must be provided')
+
+  precision, cells = geohash.choose_cells(geohash.expand_box(box, get_polygon_extent()))
+  if len(cells) > max_search_cells:
+    raise ValueError('The search area is too large, use a smaller radius or bounding box')
+
+  items = geohash.query_cells(get_dbb_client(), os.environ['DBB_TABLE_NAME'], precision, cells)
+  deserializer = TypeDeserializer()
+  candidates = [{k: geofenceItems.normalize_values(deserializer.deserialize(v)) for k, v in item.items() if not k.startswith('geohash')} for item in items]
+  polygon_distances = get_polygon_distances(candidates, coordinates, None if bounding_box else radius)
+  geofences = []
+
+  for geofence in candidates:
+    latitude = float(geofence['latitude'])
+    longitude = float(geofence['longitude'])
+
+    if bounding_box:
+      if geofence.get('polygon'):
+        if not polygon_intersects_box([(vertex['latitude'], vertex['longitude']) for vertex in geofence['polygon']], box):
+          continue
+      elif not (box[0] <= latitude <= box[2] and box[1] <= longitude <= box[3]):
+        continue
+
+    if coordinates:
+      if geofence.get('polygon'):
+        geofence['distance'] = polygon_distances.get(geofence['id'], math.inf)
+      else:
+        geofence['distance'] = geohash.distance(float(coordinates['latitude']), float(coordinates['longitude']), latitude, longitude)
+
+      if not bounding_box and geofence['distance'] > radius:
+        continue
+
+    geofences.append(geofence)
+
+  sort_key = (lambda g: [g['distance'], g['id']]) if coordinates else (lambda g: [g['id']])
+  geofences.sort(key = sort_key)
+
+  search_after = decode_next_token(arguments.get('nextToken'))
+  if search_after:
+    geofences = [geofence for geofence in geofences if sort_key(geofence) > search_after]
+
+  page = geofences[:limit]
+
+  return {
+    'items': page,
+    'nextToken': encode_next_token(sort_key(page[-1])) if len(geofences) > limit else None
+  }
+
+def sync_geofences(arguments):
+  """
+  Returns the geofences changed since the sinceVersion argument (or the version of the nextToken), in version order.
+
+  The changes are only returned once settled, so a client can resume from the version of the last change it received
+  without skipping any. The nextToken is set when more changes can be read right away.
+  """
+
+  limit = min(int(arguments.get('limit') or default_sync_limit), max_sync_limit)
+  next_token = decode_next_token(arguments.get('nextToken'))
+  since_version = next_token[0] if next_token else int(arguments.get('sinceVersion') or 0)
+
+  changes, more = geofenceSync.query_changes(get_dbb_client(), os.environ['SYNC_TABLE_NAME'], since_version, limit)
+
+  deserializer = TypeDeserializer()
+  items = [{k: geofenceItems.normalize_values(deserializer.deserialize(v)) for k, v in change.items() if k not in ('syncGroup', 'recordedAt')} for change in changes]
+
+  return {
+    'items': items,
+    'nextToken': encode_next_token([items[-1]['version']]) if more and items else None
+  }
+
+def get_polygon_extent():
+  """
+  Returns the largest polygon extent in meters recorded in the sync table by the processGeofenceChanges function,
+  read at most once every polygon_extent_ttl_seconds per container. The last known extent is kept when the table
+  cannot be read.
+  """
+
+  sync_table_name = os.environ.get('SYNC_TABLE_NAME')
+  if not sync_table_name or polygon_extent['expires_at'] > time.time():
+    return polygon_extent['value']
+
+  try:
+    response_item = get_dbb_client().get_item(
+      TableName = sync_table_name,
+      Key = {
+        'id': {'S': geofenceSync.polygon_extent_id}
+      }
+    )
+    polygon_extent['value'] = float(response_item.get('Item', {}).get('maxExtent', {'N': '0'})['N'])
+  except ClientError as e:
+    print(f'Could not read the polygon extent from {sync_table_name}: {e}')
+
+  polygon_extent['expires_at'] = time.time() + polygon_extent_ttl_seconds
+  return polygon_extent['value']
+
+def polygon_intersects_box(vertices, box):
+  """
+  Returns whether the polygon of (latitude, longitude) vertices intersects the (min_lat, min_lon, max_lat, max_lon)
+  box: a vertex is in the box, a corner of the box is in the polygon, or an edge of the polygon crosses the box.
+  """
+
+  min_lat, min_lon, max_lat, max_lon = box
+
+  if any(min_lat <= lat <= max_lat and min_lon <= lon <= max_lon for lat, lon in vertices):
+    return True
+
+  corners = [(min_lat, min_lon), (min_lat, max_lon), (max_lat, max_lon), (max_lat, min_lon)]
+  if any(contains_point(vertices, lat, lon) for lat, lon in corners):
+    return True
+
+  box_edges = list(zip(corners, corners[1:] + corners[:1]))
+  polygon_edges = list(zip(vertices, vertices[1:] + vertices[:1]))
+
+  return any(segments_cross(a, b, c, d) for a, b in polygon_edges for c, d in box_edges)
+
+def contains_point(vertices, latitude, longitude):
+  """
+  Returns whether the point is inside the polygon of (latitude, longitude) vertices, by ray casting.
+  """
+
+  inside = False
+  for (lat_a, lon_a), (lat_b, lon_b) in zip(vertices, vertices[1:] + vertices[:1]):
+    if (lat_a > latitude) != (lat_b > latitude):
+      if longitude < lon_a + (latitude - lat_a) * (lon_b - lon_a) / (lat_b - lat_a):
+        inside = not inside
+
+  return inside
+
+def segments_cross(a, b, c, d):
+  """
+  Returns whether the segments ab and cd cross.
+  """
+
+  def orientation(p, q, r):
+    return (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+
+  return orientation(a, b, c) * orientation(a, b, d) < 0 and orientation(c, d, a) * orientation(c, d, b) < 0
+
+def get_polygon_distances(geofences, coordinates, radius):
+  """
+  Returns the distances from the device to the polygon geofences found within the radius (or to all of them when there
+  is no radius), keyed by geofence id.
+  """
+
+  polygons = [(geofence['id'], [(vertex['latitude'], vertex['longitude']) for vertex in geofence['polygon']]) for geofence in geofences if geofence.get('polygon')]
+
+  if not coordinates or not polygons:
+    return {}
+
+  # numpy is only loaded by the containers searching polygon geofences
+  import geofencePolygons
+
+  index = geofencePolygons.build_polygon_index(polygons)
+  positions, distances = geofencePolygons.locate(
+    index,
+    float(coordinates['latitude']),
+    float(coordinates['longitude']),
+    math.inf if radius is None else radius
+  )
+
+  return {index['ids'][position]: float(distance) for position, distance in zip(positions, distances)}
+
+def get_es_client():
+  """
+  Returns the Amazon ElasticSearch client, creating it only once per container. The ElasticSearch modules are imported
+  here, so the geohash index searches do not load them.
+  """
+
+  global es_client
+
+  if es_client is None:
+    from elasticsearch import Elasticsearch, RequestsHttpConnection
+    from requests_aws4auth import AWS4Auth
+
+    credentials = boto3.Session().get_credentials()
+    awsauth = AWS4Auth(credentials.access_key, credentials.secret_key, os.environ['REGION'], service, session_token=credentials.token)
+
+    es_client = Elasticsearch(
+      hosts = [{'host': os.environ['ES_HOST'], 'port': 443}],
+      http_auth = awsauth,
+      use_ssl = True,
+      verify_certs = True,
+      connection_class = RequestsHttpConnection
+    )
+
+  return es_client
+
+def get_dbb_client():
+  """
+  Returns the Amazon DynamoDB client, creating it only once per container.
+  """
+
+  global dbb_client
+
+  if dbb_client is None:
+    dbb_client = boto3.client('dynamodb')
+
+  return dbb_client
+
+def create_geo_query(arguments, kind = None):
+  """
+  Creates the query filter. A bounding box takes precedence over the radius around the coordinates.
+
+  The kind restricts the query to the 'point' geofences or to the 'polygon' geofences, both being matched by default.
+  """
+
+  bounding_box = arguments.get('boundingBox')
+  coordinates = arguments.get('coordinates')
+
+  if bounding_box:
+    top_left = to_geo_point(bounding_box['topLeft'])
+    bottom_right = to_geo_point(bounding_box['bottomRight'])
+
+    point_filter = {
+      'geo_bounding_box': {
+        'location': {
+          'top_left': top_left,
+          'bottom_right': bottom_right
+        }
+      }
+    }
+    area = {
+      'type': 'envelope',
+      'coordinates': [[top_left['lon'], top_left['lat']], [bottom_right['lon'], bottom_right['lat']]]
+    }
+  elif coordinates:
+    radius = float(arguments.get('radius') or default_radius)
+
+    point_filter = {
+      'geo_distance': {
+        'distance': f'{radius}m',
+        'location': to_geo_point(coordinates)
+      }
+    }
+    area = {
+      'type': 'polygon',
+      'coordinates': [create_circle(float(coordinates['latitude']), float(coordinates['longitude']), radius)]
+    }
+  else:
+    raise ValueError('Either coordinates or boundingBox must be provided')
+
+  shape_filter = {
+    'geo_shape': {
+      'shape': {
+        'shape': area,
+        'relation': 'intersects'
+      }
+    }
+  }
+
+  if kind == 'point':
+    return {
+      'bool': {
+        'filter': point_filter,
+        'must_not': {'exists': {'field': 'shape'}}
+      }
+    }
+  if kind == 'polygon':
+    return {
+      'bool': {
+        'filter': shape_filter
+      }
+    }
+
+  return {
+    'bool': {
+      'filter': {
+        'bool': {
+          'should': [point_filter, shape_filter],
+          'minimum_should_match': 1
+        }
+      }
+    }
+  }
+
+def create_circle(latitude, longitude, radius):
+  """
+  Returns a closed GeoJSON ring ([lon, lat] pairs) approximating the circle of the given radius in meters, used to match
+  the polygon geofences with a geo_shape query.
+  """
+
+  angular_radius = radius / geohash.earth_radius
+  lat = math.radians(latitude)
+  lon = math.radians(longitude)
+  ring = []
+
+  for step in range(circle_vertices):
+    bearing = 2 * math.pi * step / circle_vertices
+    vertex_lat = math.asin(math.sin(lat) * math.cos(angular_radius) + math.cos(lat) * math.sin(angular_radius) * math.cos(bearing))
+    vertex_lon = lon + math.atan2(math.sin(bearing) * math.sin(angular_radius) * math.cos(lat), math.cos(angular_radius) - math.sin(lat) * math.sin(vertex_lat))
+    ring.append([round(math.degrees(vertex_lon), 7), round(math.degrees(vertex_lat), 7)])
+
+  ring.append(ring[0])
+  return ring
+
+def create_sort(arguments):
+  """
+  Sorts by distance when the device coordinates are known, which is only used for the point geofences. The geofence id
+  is always used as the tie breaker so search_after pages are stable.
+  """
+
+  sort = []
+  coordinates = arguments.get('coordinates')
+
+  if coordinates:
+    sort.append({
+      '_geo_distance': {
+        'location': to_geo_point(coordinates),
+        'order': 'asc',
+        'unit': 'm'
+      }
+    })
+
+  sort.append({'id': 'asc'})
+  return sort
+
+def create_geofence(hit, has_distance):
+  """
+  Creates the geofence object to be returned from an ElasticSearch hit.
+  """
+
+  geofence = hit['_source']
+
+  if has_distance:
+    geofence['distance'] = hit['sort'][0]
+
+  return geofence
+
+def to_geo_point(coordinates):
+  """
+  Converts the AppSync coordinates input into an ElasticSearch geo_point.
+  """
+
+  return {
+    'lat': float(coordinates['latitude']),
+    'lon': float(coordinates['longitude'])
+  }
+
+def encode_next_token(sort_values):
+  """
+  Encodes the sort values of the last hit as an opaque pagination token.
+  """
+
+  return base64.urlsafe_b64encode(json.dumps(sort_values).encode('utf-8')).decode('utf-8')
+
+def decode_next_token(next_token):
+  """
+  Decodes a pagination token back into the search_after sort values.
+  """
+
+  if not next_token:
+    return None
+
+  return json.loads(base64.urlsafe_b64decode(next_token.encode('utf-8')))
@@ -0,0 +1,403 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+import unittest
+from unittest.mock import Mock, patch
+
+import os
+import json
+import geohash
+import geofenceSync
+import geofencePolygons
+import searchGeofences
+
+class TestSearchGeofences(unittest.TestCase):
+  """
+  Test class for the SearchGeofences function 
+  """
+
+  ENV_ES_HOST = 'ES_HOST'
+  ES_HOST = 'search-some-domain.us-east-1.es.amazonaws.com'
+  ENV_DBB_TABLE_NAME = 'DBB_TABLE_NAME'
+  DDB_TABLE_NAME = 'geofence-ddb-table'
+
+  def query_geohash_index(self, items):
+    """
+    Returns a Query stand-in answering from the given items as the geohash index would
+    """
+
+    def query(**query_args):
+      names = query_args['ExpressionAttributeNames']
+      values = query_args['ExpressionAttributeValues']
+      return {
+        'Items': [item for item in items if item[names['#coarse']]['S'] == values[':coarse']['S'] and (':cell' not in values or item[names['#fine']]['S'].startswith(values[':cell']['S']))]
+      }
+
+    return query
+
+  def setUp(self):
+    """
+    Setting up the test case
+    """
+    os.environ[TestSearchGeofences.ENV_ES_HOST] = TestSearchGeofences.ES_HOST
+    os.environ[TestSearchGeofences.ENV_DBB_TABLE_NAME] = TestSearchGeofences.DDB_TABLE_NAME
+    searchGeofences.polygon_extent.update({'value': 0.0, 'expires_at': 0.0})
+
+  def create_hit(self, geofence_id, distance):
+    """
+    Creates an ElasticSearch hit sorted by distance and id
+    """
+
+    return {
+      '_id': geofence_id,
+      '_source': {
+        'id': geofence_id,
+        'name': f'name-{geofence_id}',
+        'latitude': -11.1234567,
+        'longitude': -99.0987654
+      },
+      'sort': [distance, geofence_id]
+    }
+
+  @patch('searchGeofences.get_es_client')
+  def test_search_geofences_by_radius_successfully(self, mock_get_es_client):
+    """
+    Test when searching the geofences around the device returns a full page and a token for the next one
+    """
+
+    event = {
+      'arguments': {
+        'coordinates': {
+          'latitude': -11.1234567,
+          'longitude': -99.0987654
+        },
+        'radius': 500,
+        'limit': 2
+      }
+    }
+
+    mock_get_es_client().search.side_effect = [
+      {'hits': {'hits': [self.create_hit('geofence-1', 10.5), self.create_hit('geofence-2', 120.0)]}},
+      {'hits': {'hits': []}}
+    ]
+
+    response = searchGeofences.handler(event, None)
+
+    search_body = mock_get_es_client().search.call_args_list[0][1]['body']
+    self.assertEqual(search_body['size'], 2)
+    self.assertEqual(search_body['query']['bool']['filter']['geo_distance']['distance'], '500.0m')
+    self.assertEqual(search_body['query']['bool']['must_not'], {'exists': {'field': 'shape'}})
+    self.assertNotIn('search_after', search_body)
+
+    polygon_body = mock_get_es_client().search.call_args_list[1][1]['body']
+    self.assertEqual(polygon_body['query']['bool']['filter']['geo_shape']['shape']['shape']['type'], 'polygon')
+    self.assertNotIn('sort', polygon_body)
+
+    self.assertEqual(len(response['items']), 2)
+    self.assertEqual(response['items'][0]['id'], 'geofence-1')
+    self.assertEqual(response['items'][0]['distance'], 10.5)
+    self.assertEqual(searchGeofences.decode_next_token(response['nextToken']), [120.0, 'geofence-2'])
+
+  @patch('searchGeofences.get_es_client')
+  def test_search_geofences_next_page_by_bounding_box(self, mock_get_es_client):
+    """
+    Test when the last page of a bounding box search is requested with a pagination token
+    """
+
+    event = {
+      'arguments': {
+        'boundingBox': {
+          'topLeft': {'latitude': 10, 'longitude': -100},
+          'bottomRight': {'latitude': -20, 'longitude': -90}
+        },
+        'nextToken': searchGeofences.encode_next_token(['geofence-2'])
+      }
+    }
+
+    mock_get_es_client().search.return_value = {
+      'hits': {
+        'hits': [{
+          '_id': 'geofence-3',
+          '_source': {'id': 'geofence-3'},
+          'sort': ['geofence-3']
+        }]
+      }
+    }
+
+    response = searchGeofences.handler(event, None)
+
+    search_body = mock_get_es_client().search.call_args[1]['body']
+    geo_filters = search_body['query']['bool']['filter']['bool']['should']
+    self.assertIn('geo_bounding_box', geo_filters[0])
+    self.assertEqual(geo_filters[1]['geo_shape']['shape']['shape']['type'], 'envelope')
+    self.assertEqual(search_body['sort'], [{'id': 'asc'}])
+    self.assertEqual(search_body['search_after'], ['geofence-2'])
+
+    self.assertEqual(response['items'], [{'id': 'geofence-3'}])
+    self.assertIsNone(response['nextToken'])
+
+  @patch('searchGeofences.get_es_client')
+  def test_search_polygon_geofences_sorted_by_polygon_distance(self, mock_get_es_client):
+    """
+    Test when a polygon whose centre is far from the device is sorted by its distance to the device, between the points
+    """
+
+    event = {
+      'arguments': {
+        'coordinates': {
+          'latitude': 57.6515,
+          'longitude': 10.4140
+        },
+        'radius': 1000,
+        'limit': 2
+      }
+    }
+
+    polygon = [(57.6480, 10.4050), (57.6520, 10.4050), (57.6520, 10.4150), (57.6480, 10.4150)]
+    polygon_hit = {
+      '_id': 'geofence-polygon',
+      '_source': {
+        'id': 'geofence-polygon',
+        'latitude': 57.6500,
+        'longitude': 10.4100,
+        'polygon': [{'latitude': lat, 'longitude': lon} for lat, lon in polygon]
+      }
+    }
+
+    mock_get_es_client().search.side_effect = [
+      {'hits': {'hits': [self.create_hit('geofence-1', 10.5), self.create_hit('geofence-2', 120.0)]}},
+      {'hits': {'hits': [polygon_hit]}}
+    ]
+
+    response = searchGeofences.handler(event, None)
+
+    self.assertEqual([geofence['id'] for geofence in response['items']], ['geofence-polygon', 'geofence-1'])
+    self.assertEqual(response['items'][0]['distance'], 0.0)
+    self.assertEqual(searchGeofences.decode_next_token(response['nextToken']), [10.5, 'geofence-1'])
+
+    event['arguments']['nextToken'] = response['nextToken']
+    mock_get_es_client().search.side_effect = [
+      {'hits': {'hits': [self.create_hit('geofence-2', 120.0)]}},
+      {'hits': {'hits': [polygon_hit]}}
+    ]
+
+    response = searchGeofences.handler(event, None)
+
+    self.assertEqual(mock_get_es_client().search.call_args_list[2][1]['body']['search_after'], [10.5, 'geofence-1'])
+    self.assertEqual([geofence['id'] for geofence in response['items']], ['geofence-2'])
+    self.assertIsNone(response['nextToken'])
+
+  def test_geohash_encode(self):
+    """
+    Test the geohash encoding and the cells chosen to cover a small radius
+    """
+
+    self.assertEqual(geohash.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+    self.assertEqual(geohash.geohash_attributes(57.64911, 10.40744), {'geohash4': 'u4pr', 'geohash6': 'u4pruy'})
+
+    precision, cells = geohash.choose_cells(geohash.bounding_box(57.64911, 10.40744, 500))
+    self.assertEqual(precision, 6)
+    self.assertIn('u4pruy', cells)
+    self.assertLessEqual(len(cells), geohash.max_query_cells)
+
+  @patch('searchGeofences.get_dbb_client')
+  def test_search_geofences_from_geohash_index(self, mock_get_dbb_client):
+    """
+    Test when ElasticSearch is not deployed and the geofences are queried from the geohash index
+    """
+
+    del os.environ[TestSearchGeofences.ENV_ES_HOST]
+
+    event = {
+      'arguments': {
+        'coordinates': {
+          'latitude': 57.64911,
+          'longitude': 10.40744
+        },
+        'radius': 500,
+        'limit': 1
+      }
+    }
+
+    def create_item(geofence_id, latitude, longitude):
+      return {
+        'id': {'S': geofence_id},
+        'latitude': {'N': str(latitude)},
+        'longitude': {'N': str(longitude)},
+        'visits': {'N': '3'},
+        'geohash4': {'S': geohash.encode(latitude, longitude, 4)},
+        'geohash6': {'S': geohash.encode(latitude, longitude, 6)}
+      }
+
+    items = [
+      create_item('geofence-far', 57.66, 10.45),
+      create_item('geofence-2', 57.6495, 10.4080),
+      create_item('geofence-1', 57.64911, 10.40744)
+    ]
+
+    mock_get_dbb_client().query.side_effect = self.query_geohash_index(items)
+
+    response = searchGeofences.handler(event, None)
+
+    self.assertEqual(mock_get_dbb_client().query.call_args[1]['IndexName'], 'geohash-index')
+    self.assertEqual(mock_get_dbb_client().query.call_args[1]['KeyConditionExpression'], '#coarse = :coarse AND begins_with(#fine, :cell)')
+    self.assertEqual([item['id'] for item in response['items']], ['geofence-1'])
+    self.assertEqual(response['items'][0]['visits'], 3)
+    self.assertNotIn('geohash6', response['items'][0])
+
+    event['arguments']['nextToken'] = response['nextToken']
+    response = searchGeofences.handler(event, None)
+
+    self.assertEqual([item['id'] for item in response['items']], ['geofence-2'])
+    self.assertIsNone(response['nextToken'])
+
+  def test_locate_polygons(self):
+    """
+    Test the point-in-polygon and distance engine with a location inside, near and far from the polygons
+    """
+
+    index = geofencePolygons.build_polygon_index([
+      ('square', [(0.0, 0.0), (0.0, 1.0), (1.0, 1.0), (1.0, 0.0)]),
+      ('triangle', [(0.5, 0.5), (0.5, 2.0), (2.0, 2.0)]),
+      ('far', [(10.0, 10.0), (10.0, 11.0), (11.0, 10.0)])
+    ])
+
+    self.assertEqual(geofencePolygons.find_containing(index, 0.9, 0.95), ['square', 'triangle'])
+    self.assertEqual(geofencePolygons.find_containing(index, 0.6, 0.55), ['square'])
+    self.assertEqual(geofencePolygons.find_containing(index, 5.0, 5.0), [])
+
+    positions, distances = geofencePolygons.locate(index, 1.001, 0.5, 1000)
+    self.assertEqual([index['ids'][position] for position in positions], ['square'])
+    self.assertAlmostEqual(distances[0], 111.2, delta = 1)
+
+  @patch('searchGeofences.get_dbb_client')
+  def test_search_polygon_geofences_from_geohash_index(self, mock_get_dbb_client):
+    """
+    Test when a device inside a polygon geofence whose centre is out of the radius searches the geohash index
+    """
+
+    del os.environ[TestSearchGeofences.ENV_ES_HOST]
+
+    event = {
+      'arguments': {
+        'coordinates': {
+          'latitude': 57.6515,
+          'longitude': 10.4140
+        },
+        'radius': 100
+      }
+    }
+
+    polygon = [(57.6480, 10.4050), (57.6520, 10.4050), (57.6520, 10.4150), (57.6480, 10.4150)]
+    item = {
+      'id': {'S': 'geofence-polygon'},
+      'latitude': {'N': '57.6500'},
+      'longitude': {'N': '10.4100'},
+      'definition': {'S': 'POLYGON:(...)'},
+      'polygon': {'L': [{'M': {'latitude': {'N': str(lat)}, 'longitude': {'N': str(lon)}}} for lat, lon in polygon]},
+      'geohash4': {'S': geohash.encode(57.6500, 10.4100, 4)},
+      'geohash6': {'S': geohash.encode(57.6500, 10.4100, 6)}
+    }
+
+    mock_get_dbb_client().query.side_effect = self.query_geohash_index([item])
+
+    response = searchGeofences.handler(event, None)
+
+    self.assertEqual(len(response['items']), 1)
+    self.assertEqual(response['items'][0]['distance'], 0.0)
+    self.assertEqual(response['items'][0]['polygon'][0], {'latitude': 57.648, 'longitude': 10.405})
+    json.dumps(response)
+
+  @patch.dict(os.environ, {'SYNC_TABLE_NAME': 'geofence-sync-table'})
+  @patch('searchGeofences.get_dbb_client')
+  def test_search_large_polygon_anchored_in_distant_cell(self, mock_get_dbb_client):
+    """
+    Test when the geohash search area is grown by the largest polygon extent, so a device in the corner of a large
+    polygon finds it by radius and by bounding box
+    """
+
+    del os.environ[TestSearchGeofences.ENV_ES_HOST]
+
+    polygon = [(57.60, 10.30), (57.70, 10.30), (57.70, 10.50), (57.60, 10.50)]
+    item = {
+      'id': {'S': 'geofence-large'},
+      'latitude': {'N': '57.65'},
+      'longitude': {'N': '10.40'},
+      'polygon': {'L': [{'M': {'latitude': {'N': str(lat)}, 'longitude': {'N': str(lon)}}} for lat, lon in polygon]},
+      'geohash4': {'S': geohash.encode(57.65, 10.40, 4)},
+      'geohash6': {'S': geohash.encode(57.65, 10.40, 6)}
+    }
+
+    mock_get_dbb_client().query.side_effect = self.query_geohash_index([item])
+
+    radius_event = {'arguments': {'coordinates': {'latitude': 57.699, 'longitude': 10.499}, 'radius': 50}}
+    box_event = {'arguments': {'boundingBox': {'topLeft': {'latitude': 57.72, 'longitude': 10.49}, 'bottomRight': {'latitude': 57.69, 'longitude': 10.52}}}}
+
+    mock_get_dbb_client().get_item.return_value = {}
+    self.assertEqual(searchGeofences.handler(radius_event, None)['items'], [])
+
+    searchGeofences.polygon_extent['expires_at'] = 0.0
+    mock_get_dbb_client().get_item.return_value = {'Item': {'maxExtent': {'N': '9000'}}}
+
+    response = searchGeofences.handler(radius_event, None)
+    self.assertEqual([geofence['id'] for geofence in response['items']], ['geofence-large'])
+    self.assertEqual(response['items'][0]['distance'], 0.0)
+
+    response = searchGeofences.handler(box_event, None)
+    self.assertEqual([geofence['id'] for geofence in response['items']], ['geofence-large'])
+    self.assertEqual(mock_get_dbb_client().get_item.call_count, 2)
+
+    box_event['arguments']['boundingBox']['bottomRight']['longitude'] = 10.495
+    box_event['arguments']['boundingBox']['topLeft']['latitude'] = 57.75
+    box_event['arguments']['boundingBox']['bottomRight']['latitude'] = 57.71
+    self.assertEqual(searchGeofences.handler(box_event, None)['items'], [])
+
+  @patch.dict(os.environ, {'SYNC_TABLE_NAME': 'geofence-sync-table'})
+  @patch('searchGeofences.get_dbb_client')
+  def test_sync_geofences_merges_shards(self, mock_get_dbb_client):
+    """
+    Test when the changes of the sync table shards are merged by version, paging with the version of the last change
+    """
+
+    changes = [{
+      'id': {'S': f'geofence-{version}'},
+      'version': {'N': str(version)},
+      'deleted': {'BOOL': version == 12},
+      'syncGroup': {'S': geofenceSync.shard_key(version)},
+      'recordedAt': {'N': '1600000000'}
+    } for version in range(10, 15)]
+
+    def query(**query_args):
+      values = query_args['ExpressionAttributeValues']
+      items = [change for change in changes if change['syncGroup'] == values[':syncGroup'] and int(change['version']['N']) > int(values[':sinceVersion']['N'])]
+      return {'Items': items[:query_args['Limit']]}
+
+    mock_get_dbb_client().query.side_effect = query
+
+    response = searchGeofences.handler({'operation': 'syncGeofences', 'arguments': {'sinceVersion': 10, 'limit': 2}}, None)
+
+    self.assertEqual([item['version'] for item in response['items']], [11, 12])
+    self.assertTrue(response['items'][1]['deleted'])
+    self.assertNotIn('syncGroup', response['items'][0])
+
+    response = searchGeofences.handler({'operation': 'syncGeofences', 'arguments': {'nextToken': response['nextToken'], 'limit': 2}}, None)
+
+    self.assertEqual([item['version'] for item in response['items']], [13, 14])
+    self.assertIsNone(response['nextToken'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,7 +21,6 @@ based on the geofence that users passed within.
 """
 
 import json
-import uuid 
 import os
 import time
 import boto3
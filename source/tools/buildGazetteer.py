@@ -0,0 +1,85 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+"""
+Builds the gazetteer file used by the getCurrentAddress function to answer reverse geocoding requests offline.
+
+The places come from the GeoNames cities export (https://download.geonames.org/export/dump/, cities15000.txt for
+example). The state names come from admin1CodesASCII.txt and the 3 letter country codes, the ones returned by HERE,
+come from countryInfo.txt. Both files are optional:
+
+    python buildGazetteer.py --cities cities15000.txt --admin1 admin1CodesASCII.txt --countries countryInfo.txt \
+      --output ../getCurrentAddress/gazetteer.bin
+"""
+
+import argparse
+import csv
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'getCurrentAddress'))
+
+import gazetteer
+
+csv.field_size_limit(sys.maxsize)
+
+def read_tsv(path):
+  """
+  Returns the rows of a GeoNames tab separated file, skipping the comment lines.
+  """
+
+  with open(path, encoding = 'utf-8', newline = '') as tsv_file:
+    for row in csv.reader(tsv_file, delimiter = '\t', quoting = csv.QUOTE_NONE):
+      if row and not row[0].startswith('#'):
+        yield row
+
+def read_places(cities_path, admin1_path, countries_path):
+  """
+  Returns the (latitude, longitude, city, state, country) tuples of the GeoNames cities.
+  """
+
+  states = {row[0]: row[1] for row in read_tsv(admin1_path)} if admin1_path else {}
+  countries = {row[0]: row[1] for row in read_tsv(countries_path)} if countries_path else {}
+
+  for row in read_tsv(cities_path):
+    country_code = row[8]
+    yield (
+      float(row[4]),
+      float(row[5]),
+      row[1],
+      states.get(f'{country_code}.{row[10]}', row[10]),
+      countries.get(country_code, country_code)
+    )
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Builds the gazetteer file of the getCurrentAddress function')
+  parser.add_argument('--cities', required = True, help = 'GeoNames cities file')
+  parser.add_argument('--admin1', help = 'GeoNames admin1CodesASCII.txt file')
+  parser.add_argument('--countries', help = 'GeoNames countryInfo.txt file')
+  parser.add_argument('--output', default = gazetteer.default_path)
+  args = parser.parse_args()
+
+  places = list(read_places(args.cities, args.admin1, args.countries))
+  data = gazetteer.pack_gazetteer(places)
+
+  with open(args.output, 'wb') as output_file:
+    output_file.write(data)
+
+  print(f'{len(places)} places written to {args.output} ({len(data)} bytes)')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,400 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge,
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+"""
+Replays the traffic recorded in the logs of a Lambda function against a local copy of the function.
+
+Every function prints the event it receives (and most of them the response they return), so the CloudWatch logs hold
+the production traffic. The events are read from the output of `aws logs filter-log-events` or from a JSON lines file
+of {"timestamp", "event", "response"} objects, then replayed with their original spacing divided by the speed-up. Each
+worker process plays a Lambda container handling one event at a time.
+
+The AWS API calls and the HTTP calls (HERE, ElasticSearch) of the function are answered by local stand-ins, with the
+responses and latencies of an optional JSON file:
+
+    {
+      "aws": {"GetUserEndpoints": {...}, "GetPushTemplate": "NotFoundException"},
+      "http": {"geocode.search.hereapi.com": {"status": 200, "body": {...}}},
+      "awsLatencyMs": 20,
+      "httpLatencyMs": 80
+    }
+
+An AWS operation answered with a string raises the error of that code. Without the file, or for the operations and hosts
+it leaves out, the minimal valid responses of default_stand_ins are used. The report gives the latency distributions and
+the differences between the replayed responses and the recorded ones. Run it from this folder:
+
+    aws logs filter-log-events --log-group-name /aws/lambda/<sendMessage function> --output json > sendMessage.json
+    python replayTraffic.py sendMessage sendMessage.json --stand-ins standIns.json --speedup 10 --concurrency 8
+"""
+
+import argparse
+import bisect
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+source_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# the environment each function needs to be imported and invoked, completed with --env
+default_env = {
+  'sendMessage': {'DBB_TABLE_NAME': 'replay-table'},
+  'manageMessages': {},
+  'getCoordsFromAddress': {'SYNC_TABLE_NAME': 'replay-table', 'HERE_API_KEY': 'replay-key'},
+  'getCurrentAddress': {'HERE_API_KEY': 'replay-key'},
+  'indexDdbDataToEs': {'REGION': 'us-east-1', 'ES_HOST': 'replay-domain.us-east-1.es.amazonaws.com'}
+}
+
+here_item = {
+  'address': {'label': 'replay_address', 'city': 'replay_city', 'state': 'replay_state', 'countryCode': 'USA'},
+  'position': {'lat': 40.7128, 'lng': -74.0060}
+}
+
+# the minimal valid responses of the calls of each function, merged under the ones of --stand-ins
+default_stand_ins = {
+  'sendMessage': {
+    'aws': {
+      'GetUserEndpoints': {'EndpointsResponse': {'Item': []}},
+      'GetPushTemplate': {'PushNotificationTemplateResponse': {'Default': {'Title': 'replay_title', 'Body': 'replay_body'}}}
+    }
+  },
+  'manageMessages': {
+    'aws': {
+      'GetPushTemplate': {'PushNotificationTemplateResponse': {'Default': {'Title': 'replay_title', 'Body': 'replay_body'}}},
+      'ListTemplates': {'TemplatesResponse': {'Item': []}}
+    }
+  },
+  'getCoordsFromAddress': {
+    'aws': {'GetObject': 'NoSuchKey'},
+    'http': {
+      'geocode.search.hereapi.com': {'body': {'items': [here_item]}},
+      'autosuggest.search.hereapi.com': {'body': {'items': [{'title': 'replay_address', 'address': {'label': 'replay_address'}}]}}
+    }
+  },
+  'getCurrentAddress': {
+    'http': {'revgeocode.search.hereapi.com': {'body': {'items': [here_item]}}}
+  },
+  'indexDdbDataToEs': {
+    'http': {'replay-domain.us-east-1.es.amazonaws.com': {'body': {'_id': 'replay', 'result': 'created'}}}
+  }
+}
+
+log_marker_pattern = re.compile(r'(?:^|\n)[ \t]*(request|Request|response): ')
+
+worker = {}
+
+def read_captures(path):
+  """
+  Returns the captured invocations of a file, sorted by timestamp, as {timestamp, event, response} dictionaries.
+  """
+
+  with open(path, encoding = 'utf-8') as capture_file:
+    content = capture_file.read()
+
+  try:
+    document = json.loads(content)
+  except ValueError:
+    document = None
+
+  if isinstance(document, dict) and 'events' in document:
+    captures = parse_log_events(document['events'])
+  else:
+    captures = [json.loads(line) for line in content.splitlines() if line.strip()]
+
+  return sorted(captures, key = lambda capture: capture.get('timestamp', 0))
+
+def parse_log_events(log_events):
+  """
+  Rebuilds the invocations from the CloudWatch log events of the function.
+
+  A multi-line print is split into several log events, so the messages of each log stream are joined back before
+  decoding the JSON printed after the request and response markers. A log stream is written by a single container,
+  which handles one event at a time, so a response belongs to the last request of its stream.
+  """
+
+  streams = defaultdict(list)
+  for log_event in log_events:
+    streams[log_event.get('logStreamName', '')].append(log_event)
+
+  decoder = json.JSONDecoder()
+  captures = []
+
+  for stream_events in streams.values():
+    stream_events.sort(key = lambda log_event: log_event['timestamp'])
+
+    text = ''
+    offsets = []
+    for log_event in stream_events:
+      offsets.append(len(text))
+      message = log_event['message']
+      text += message if message.endswith('\n') else message + '\n'
+
+    last_capture = None
+    for match in log_marker_pattern.finditer(text):
+      try:
+        value, _ = decoder.raw_decode(text, match.end())
+      except ValueError:
+        continue
+
+      if match.group(1).lower() == 'request':
+        last_capture = {
+          'timestamp': stream_events[bisect.bisect_right(offsets, match.start() + 1) - 1]['timestamp'],
+          'event': value
+        }
+        captures.append(last_capture)
+      elif last_capture is not None and 'response' not in last_capture:
+        last_capture['response'] = value
+
+  return captures
+
+def merge_stand_ins(defaults, stand_ins):
+  """
+  Returns the stand-ins completed with the default responses of the AWS operations and HTTP hosts they leave out.
+  """
+
+  merged = dict(stand_ins)
+  for section in ['aws', 'http']:
+    merged[section] = {**defaults.get(section, {}), **stand_ins.get(section, {})}
+  return merged
+
+def init_worker(function_name, env, stand_ins):
+  """
+  Imports the function in the worker process and points its AWS and HTTP calls to the stand-ins.
+  """
+
+  os.environ.update({
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'replay',
+    'AWS_SECRET_ACCESS_KEY': 'replay'
+  })
+  os.environ.update(env)
+  sys.path[:0] = [os.path.join(source_folder, function_name), os.path.join(source_folder, 'common')]
+
+  import botocore.client
+  import requests
+  import requests.adapters
+
+  aws_responses = stand_ins.get('aws', {})
+  aws_latency = stand_ins.get('awsLatencyMs', 0) / 1000
+  http_responses = stand_ins.get('http', {})
+  http_latency = stand_ins.get('httpLatencyMs', 0) / 1000
+
+  def make_api_call(client, operation_name, api_params):
+    time.sleep(aws_latency)
+    response = aws_responses.get(operation_name, {})
+    if isinstance(response, str):
+      raise client.exceptions.from_code(response)({'Error': {'Code': response, 'Message': response}}, operation_name)
+    return response
+
+  def send(adapter, request, **kwargs):
+    time.sleep(http_latency)
+    host = requests.utils.urlparse(request.url).hostname
+    stand_in = http_responses.get(host, {})
+
+    response = requests.Response()
+    response.status_code = stand_in.get('status', 200)
+    response.headers['Content-Type'] = 'application/json'
+    response._content = json.dumps(stand_in.get('body', {})).encode('utf-8')
+    response.url = request.url
+    response.request = request
+    return response
+
+  botocore.client.BaseClient._make_api_call = make_api_call
+  requests.adapters.HTTPAdapter.send = send
+
+  with contextlib.redirect_stdout(io.StringIO()):
+    worker['handler'] = __import__(function_name).handler
+
+def invoke(index, event):
+  """
+  Invokes the function with a recorded event. Returns the index of the event, the start and end times and the
+  response, or the error raised by the function.
+  """
+
+  started = time.time()
+  try:
+    with contextlib.redirect_stdout(io.StringIO()):
+      response = worker['handler'](event, None)
+    error = None
+  except Exception as ex:
+    response = None
+    error = f'{type(ex).__name__}: {ex}'
+
+  return index, started, time.time(), response, error
+
+def get_operation(event):
+  """
+  Returns the name the latencies of an event are grouped by: the AppSync operation, or the stream event names.
+  """
+
+  if 'operation' in event:
+    return event['operation']
+
+  if 'Records' in event:
+    return '+'.join(sorted({record.get('eventName', '?') for record in event['Records']}))
+
+  return 'handler'
+
+def diff_values(recorded, replayed, ignored_keys, path = ''):
+  """
+  Returns the paths where the replayed response differs from the recorded one.
+  """
+
+  if isinstance(recorded, dict) and isinstance(replayed, dict):
+    differences = []
+    for key in sorted(set(recorded) | set(replayed)):
+      if key in ignored_keys:
+        continue
+      if key not in recorded or key not in replayed:
+        differences.append(f"{path}/{key} {'added' if key in replayed else 'missing'}")
+      else:
+        differences.extend(diff_values(recorded[key], replayed[key], ignored_keys, f'{path}/{key}'))
+    return differences
+
+  if isinstance(recorded, list) and isinstance(replayed, list):
+    if len(recorded) != len(replayed):
+      return [f'{path} has {len(replayed)} items instead of {len(recorded)}']
+    differences = []
+    for position, (recorded_item, replayed_item) in enumerate(zip(recorded, replayed)):
+      differences.extend(diff_values(recorded_item, replayed_item, ignored_keys, f'{path}/{position}'))
+    return differences
+
+  if recorded != replayed:
+    return [f'{path or "/"}: {json.dumps(recorded)} -> {json.dumps(replayed)}']
+
+  return []
+
+def percentile(sorted_values, fraction):
+  """
+  Returns the nearest-rank percentile of sorted values.
+  """
+
+  return sorted_values[min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))]
+
+def print_latencies(label, latencies):
+  """
+  Prints the distribution of latencies in milliseconds.
+  """
+
+  latencies = sorted(latencies)
+  print(
+    f'{label:32} {len(latencies):6} calls  p50 {percentile(latencies, 0.5):8.1f}  p90 {percentile(latencies, 0.9):8.1f}'
+    f'  p99 {percentile(latencies, 0.99):8.1f}  max {latencies[-1]:8.1f} ms'
+  )
+
+def replay(function_name, captures, env, stand_ins, speedup, concurrency):
+  """
+  Replays the captured events with their recorded spacing divided by speedup, as fast as possible when speedup is 0.
+  Returns the (capture, scheduled time, result) of every event.
+  """
+
+  scheduled = []
+  first_timestamp = captures[0].get('timestamp', 0)
+
+  with ProcessPoolExecutor(max_workers = concurrency, initializer = init_worker, initargs = (function_name, env, stand_ins)) as executor:
+    # the containers are started before the clock, the way provisioned capacity would be
+    list(executor.map(time.sleep, [0.1] * concurrency))
+    started = time.time()
+
+    for index, capture in enumerate(captures):
+      offset = (capture.get('timestamp', first_timestamp) - first_timestamp) / 1000 / speedup if speedup else 0
+      delay = started + offset - time.time()
+      if delay > 0:
+        time.sleep(delay)
+
+      scheduled.append((capture, started + offset, executor.submit(invoke, index, capture['event'])))
+
+    results = [(capture, scheduled_at, future.result()) for capture, scheduled_at, future in scheduled]
+
+  print(f'{len(captures)} events replayed in {time.time() - started:.1f} s with {concurrency} containers')
+  return results
+
+def print_report(results, ignored_keys, max_diffs):
+  """
+  Prints the latency distributions by operation and the differences with the recorded responses.
+  """
+
+  latencies = defaultdict(list)
+  queueing = []
+  errors = []
+  matching = 0
+  different = []
+
+  for capture, scheduled_at, (index, started, finished, response, error) in results:
+    latencies[get_operation(capture['event'])].append((finished - started) * 1000)
+    queueing.append(max(0, started - scheduled_at) * 1000)
+
+    if error:
+      errors.append(f'event {index}: {error}')
+    elif 'response' in capture:
+      differences = diff_values(capture['response'], json.loads(json.dumps(response, default = str)), ignored_keys)
+      if differences:
+        different.append((index, differences))
+      else:
+        matching += 1
+
+  print_latencies('all', [latency for values in latencies.values() for latency in values])
+  for operation in sorted(latencies):
+    print_latencies(operation, latencies[operation])
+  print_latencies('waiting for a container', queueing)
+
+  print(f'{len(errors)} errors, {matching} responses as recorded, {len(different)} different, {len(results) - len(errors) - matching - len(different)} without recorded response')
+
+  for error in errors[:max_diffs]:
+    print(f'  {error}')
+
+  for index, differences in different[:max_diffs]:
+    print(f'  event {index}:')
+    for difference in differences[:max_diffs]:
+      print(f'    {difference}')
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Replays the recorded traffic of a Lambda function against local stand-ins')
+  parser.add_argument('function', choices = sorted(default_env), help = 'function folder')
+  parser.add_argument('captures', help = 'filter-log-events JSON output or JSON lines file of the recorded invocations')
+  parser.add_argument('--stand-ins', help = 'JSON file of the stand-in responses and latencies')
+  parser.add_argument('--speedup', type = float, default = 1.0, help = 'replay speed factor, 0 for as fast as possible')
+  parser.add_argument('--concurrency', type = int, default = 4, help = 'number of containers')
+  parser.add_argument('--limit', type = int, help = 'number of events to replay')
+  parser.add_argument('--env', action = 'append', default = [], help = 'KEY=VALUE environment variable of the function')
+  parser.add_argument('--ignore', action = 'append', default = [], help = 'response key left out of the comparison')
+  parser.add_argument('--max-diffs', type = int, default = 5, help = 'number of differences and errors printed')
+  args = parser.parse_args()
+
+  captures = read_captures(args.captures)[:args.limit]
+  if not captures:
+    sys.exit(f'No recorded event found in {args.captures}')
+
+  env = dict(default_env[args.function])
+  env.update(variable.split('=', 1) for variable in args.env)
+
+  stand_ins = {}
+  if args.stand_ins:
+    with open(args.stand_ins, encoding = 'utf-8') as stand_ins_file:
+      stand_ins = json.load(stand_ins_file)
+  stand_ins = merge_stand_ins(default_stand_ins[args.function], stand_ins)
+
+  results = replay(args.function, captures, env, stand_ins, args.speedup, args.concurrency)
+  print_report(results, set(args.ignore), args.max_diffs)
+
+if __name__ == '__main__':
+  main()
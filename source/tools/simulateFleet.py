@@ -0,0 +1,557 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge,
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+"""
+Simulates a fleet of mobile devices moving across the geofences and drives the sendMessage function with the geofence
+enter events they generate, to size the notification path for crowded events such as concerts.
+
+The devices follow a random walk, part of them heading to the venue geofence, or the GPS traces of a CSV file of
+deviceId,timestamp,latitude,longitude rows. The geofences are laid out at random around the center, or read from a
+GeoJSON / NDJSON export of the exportGeofences function. A device entering a geofence it entered less than the cooldown
+before is suppressed, as the mobile application does.
+
+sendMessage runs in this process against in-memory Amazon Pinpoint and Amazon DynamoDB stand-ins. They throttle the
+calls above the per-second limits of the simulated time: the writes of a single geofence item (one DynamoDB partition
+key) and the messages sent by Pinpoint. The stand-ins do not retry, so a throttled call is an error of the report, where
+the SDK would retry it at the cost of latency. The report gives the throughput, the enter event rates, the suppression
+and error rates and the hottest geofence items. Run it from this folder:
+
+    python simulateFleet.py --devices 5000 --duration 3600 --venue-share 0.6 --concurrency 8
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import types
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sendMessage'))
+
+from botocore.exceptions import ClientError
+
+earth_radius = 6371000.0
+walking_speed = 1.4
+default_center = (47.6205, -122.3493)
+error_code_pattern = re.compile(r'\((\w+)\)')
+
+simulated = threading.local()
+
+class Geofence:
+  """
+  A circular or polygon geofence, with its bounding box in degrees.
+  """
+
+  def __init__(self, geofence_id, latitude, longitude, radius = None, polygon = None):
+    self.id = geofence_id
+    self.latitude = latitude
+    self.longitude = longitude
+    self.radius = radius
+    self.polygon = polygon
+
+    if polygon:
+      self.box = (min(p[0] for p in polygon), min(p[1] for p in polygon), max(p[0] for p in polygon), max(p[1] for p in polygon))
+    else:
+      delta_latitude = math.degrees(radius / earth_radius)
+      delta_longitude = delta_latitude / max(math.cos(math.radians(latitude)), 1e-6)
+      self.box = (latitude - delta_latitude, longitude - delta_longitude, latitude + delta_latitude, longitude + delta_longitude)
+
+  def contains(self, latitude, longitude):
+    """
+    Returns true if the position is inside the geofence.
+    """
+
+    if not (self.box[0] <= latitude <= self.box[2] and self.box[1] <= longitude <= self.box[3]):
+      return False
+
+    if self.polygon:
+      inside = False
+      for (lat1, lng1), (lat2, lng2) in zip(self.polygon, self.polygon[1:] + self.polygon[:1]):
+        if (lat1 > latitude) != (lat2 > latitude) and longitude < lng1 + (latitude - lat1) * (lng2 - lng1) / (lat2 - lat1):
+          inside = not inside
+      return inside
+
+    return distance(self.latitude, self.longitude, latitude, longitude) <= self.radius
+
+class GeofenceGrid:
+  """
+  Buckets the geofences by the grid cells their bounding box overlaps, so a position is only tested against the
+  geofences of its cell.
+  """
+
+  def __init__(self, geofences, cell_degrees = 0.01):
+    self.cell_degrees = cell_degrees
+    self.cells = defaultdict(list)
+
+    for geofence in geofences:
+      for row in range(self.cell(geofence.box[0]), self.cell(geofence.box[2]) + 1):
+        for column in range(self.cell(geofence.box[1]), self.cell(geofence.box[3]) + 1):
+          self.cells[(row, column)].append(geofence)
+
+  def cell(self, degrees):
+    """
+    Returns the grid row or column of a latitude or longitude.
+    """
+
+    return int(math.floor(degrees / self.cell_degrees))
+
+  def find(self, latitude, longitude):
+    """
+    Returns the ids of the geofences containing the position.
+    """
+
+    return {geofence.id for geofence in self.cells.get((self.cell(latitude), self.cell(longitude)), []) if geofence.contains(latitude, longitude)}
+
+def distance(latitude1, longitude1, latitude2, longitude2):
+  """
+  Returns the equirectangular approximation of the distance in meters, accurate at the scale of a city.
+  """
+
+  x = math.radians(longitude2 - longitude1) * math.cos(math.radians((latitude1 + latitude2) / 2))
+  y = math.radians(latitude2 - latitude1)
+  return math.hypot(x, y) * earth_radius
+
+def move(latitude, longitude, heading, meters):
+  """
+  Returns the position reached after moving meters towards the heading, in radians from the north.
+  """
+
+  latitude2 = latitude + math.degrees(meters * math.cos(heading) / earth_radius)
+  longitude2 = longitude + math.degrees(meters * math.sin(heading) / earth_radius) / max(math.cos(math.radians(latitude)), 1e-6)
+  return latitude2, longitude2
+
+def bearing(latitude1, longitude1, latitude2, longitude2):
+  """
+  Returns the heading from the first position to the second one, in radians from the north.
+  """
+
+  return math.atan2(math.radians(longitude2 - longitude1) * math.cos(math.radians(latitude1)), math.radians(latitude2 - latitude1))
+
+def create_layout(rng, count, center, area_meters, min_radius, max_radius, venue_radius):
+  """
+  Returns count circular geofences at random in a square area around the center. The first one is the venue, on the
+  center.
+  """
+
+  geofences = [Geofence('venue', center[0], center[1], venue_radius)]
+
+  for index in range(1, count):
+    latitude, longitude = move(center[0], center[1], 0, rng.uniform(-area_meters / 2, area_meters / 2))
+    latitude, longitude = move(latitude, longitude, math.pi / 2, rng.uniform(-area_meters / 2, area_meters / 2))
+    geofences.append(Geofence(f'geofence-{index}', latitude, longitude, rng.uniform(min_radius, max_radius)))
+
+  return geofences
+
+def read_layout(path, default_radius):
+  """
+  Returns the geofences of a GeoJSON or NDJSON export, gzip compressed or not. The radius of the point geofences is
+  their definition in meters.
+  """
+
+  opener = gzip.open if path.endswith('.gz') else open
+  with opener(path, 'rt', encoding = 'utf-8') as layout_file:
+    content = layout_file.read()
+
+  try:
+    document = json.loads(content)
+  except ValueError:
+    document = None
+
+  if isinstance(document, dict) and document.get('type') == 'FeatureCollection':
+    features = document['features']
+  else:
+    features = [json.loads(line) for line in content.splitlines() if line.strip()]
+
+  geofences = []
+  for feature in features:
+    geometry = feature.get('geometry') or {}
+    properties = feature.get('properties') or {}
+    geofence_id = feature.get('id') or properties.get('id')
+
+    if geometry.get('type') == 'Polygon':
+      polygon = [(position[1], position[0]) for position in geometry['coordinates'][0][:-1]]
+      geofences.append(Geofence(geofence_id, polygon[0][0], polygon[0][1], polygon = polygon))
+    elif geometry.get('type') == 'Point':
+      try:
+        radius = float(properties.get('definition'))
+      except (TypeError, ValueError):
+        radius = default_radius
+      geofences.append(Geofence(geofence_id, geometry['coordinates'][1], geometry['coordinates'][0], radius))
+
+  return geofences
+
+def walk_devices(rng, devices, duration, tick, center, area_meters, venue, venue_share):
+  """
+  Yields the (time, device, latitude, longitude) positions of the devices at every tick of the random walk. The devices
+  heading to the venue walk towards it and wander around once inside.
+  """
+
+  states = []
+  for index in range(devices):
+    latitude, longitude = move(center[0], center[1], 0, rng.uniform(-area_meters / 2, area_meters / 2))
+    latitude, longitude = move(latitude, longitude, math.pi / 2, rng.uniform(-area_meters / 2, area_meters / 2))
+    states.append([f'device-{index}', latitude, longitude, rng.uniform(0, 2 * math.pi), rng.random() < venue_share])
+
+  for step in range(int(duration / tick) + 1):
+    for state in states:
+      device_id, latitude, longitude, heading, to_venue = state
+      yield step * tick + rng.uniform(0, tick), device_id, latitude, longitude
+
+      if to_venue and not venue.contains(latitude, longitude):
+        heading = bearing(latitude, longitude, venue.latitude, venue.longitude) + rng.gauss(0, 0.3)
+      else:
+        heading += rng.gauss(0, 0.5)
+
+      state[1], state[2] = move(latitude, longitude, heading, walking_speed * rng.uniform(0.5, 1.5) * tick)
+      state[3] = heading
+
+def read_traces(path):
+  """
+  Yields the (time, device, latitude, longitude) positions of a CSV file of GPS traces, sorted by time. The times are
+  made relative to the first one.
+  """
+
+  with open(path, encoding = 'utf-8', newline = '') as traces_file:
+    rows = [row for row in csv.DictReader(traces_file)]
+
+  rows.sort(key = lambda row: float(row['timestamp']))
+  start = float(rows[0]['timestamp']) if rows else 0
+
+  for row in rows:
+    yield float(row['timestamp']) - start, row['deviceId'], float(row['latitude']), float(row['longitude'])
+
+def generate_enter_events(positions, grid, cooldown):
+  """
+  Returns the (time, device, geofence) enter events of the positions, sorted by time, and the number of enters
+  suppressed because the device entered the same geofence less than cooldown seconds before.
+  """
+
+  inside = {}
+  last_enter = {}
+  events = []
+  suppressed = 0
+
+  for at, device_id, latitude, longitude in positions:
+    geofence_ids = grid.find(latitude, longitude)
+
+    # the geofences a device starts in were entered before the simulation
+    if device_id not in inside:
+      inside[device_id] = geofence_ids
+      continue
+
+    for geofence_id in geofence_ids - inside[device_id]:
+      previous = last_enter.get((device_id, geofence_id))
+      last_enter[(device_id, geofence_id)] = at
+
+      if previous is not None and at - previous < cooldown:
+        suppressed += 1
+      else:
+        events.append((at, device_id, geofence_id))
+
+    inside[device_id] = geofence_ids
+
+  events.sort()
+  return events, suppressed
+
+class FixedWindowLimiter:
+  """
+  Allows limit calls per key and per second of simulated time. The window of a call is the simulated time of the enter
+  event being processed, so the limits do not depend on the replay speed.
+  """
+
+  def __init__(self, limit):
+    self.limit = limit
+    self.counts = Counter()
+    self.lock = threading.Lock()
+
+  def allow(self, key):
+    window = (key, int(getattr(simulated, 'now', 0)))
+    with self.lock:
+      self.counts[window] += 1
+      return not self.limit or self.counts[window] <= self.limit
+
+  def peaks(self):
+    """
+    Returns the highest calls per second of every key.
+    """
+
+    peaks = Counter()
+    for (key, _), count in self.counts.items():
+      peaks[key] = max(peaks[key], count)
+    return peaks
+
+def throttle(code, operation_name):
+  """
+  Returns the error raised by a throttled stand-in call.
+  """
+
+  return ClientError({'Error': {'Code': code, 'Message': 'Rate exceeded'}}, operation_name)
+
+class PinpointStandIn:
+  """
+  In-memory Amazon Pinpoint with one endpoint per device, a push template per geofence and a limit of messages sent per
+  second.
+  """
+
+  def __init__(self, rng, latency, send_limit, missing_endpoint_rate):
+    self.latency = latency
+    self.send_limiter = FixedWindowLimiter(send_limit)
+    self.missing_endpoint_rate = missing_endpoint_rate
+    self.endpoints = {}
+    self.rng = rng
+    self.lock = threading.Lock()
+    self.exceptions = types.SimpleNamespace(NotFoundException = type('NotFoundException', (ClientError,), {}))
+
+  def get_user_endpoints(self, ApplicationId, UserId):
+    time.sleep(self.latency)
+
+    with self.lock:
+      if UserId not in self.endpoints:
+        missing = self.rng.random() < self.missing_endpoint_rate
+        self.endpoints[UserId] = None if missing else {
+          'Id': f'endpoint-{UserId}',
+          'ChannelType': self.rng.choice(['APNS', 'GCM']),
+          'Address': f'token-{UserId}',
+          'Attributes': {}
+        }
+      endpoint = self.endpoints[UserId]
+
+    if endpoint is None:
+      raise self.exceptions.NotFoundException({'Error': {'Code': 'NotFoundException', 'Message': 'Resource not found'}}, 'GetUserEndpoints')
+
+    return {'EndpointsResponse': {'Item': [json.loads(json.dumps(endpoint))]}}
+
+  def get_push_template(self, TemplateName):
+    time.sleep(self.latency)
+    message = {'Title': f'Welcome to {TemplateName}', 'Body': 'Some message'}
+    return {'PushNotificationTemplateResponse': {'APNS': message, 'GCM': message}}
+
+  def send_messages(self, ApplicationId, MessageRequest):
+    time.sleep(self.latency)
+
+    if not self.send_limiter.allow(ApplicationId):
+      raise throttle('TooManyRequestsException', 'SendMessages')
+
+    return {'MessageResponse': {'Result': {token: {'DeliveryStatus': 'SUCCESSFUL', 'StatusMessage': ''} for token in MessageRequest['Addresses']}}}
+
+  def update_endpoint(self, ApplicationId, EndpointId, EndpointRequest):
+    time.sleep(self.latency)
+
+    with self.lock:
+      user_id = EndpointId[len('endpoint-'):]
+      self.endpoints[user_id]['Attributes'].update(EndpointRequest['Attributes'])
+
+    return {'ResponseMetadata': {'HTTPStatusCode': 202}}
+
+class DynamoDBStandIn:
+  """
+  In-memory Amazon DynamoDB geofence table counting the visits, with a limit of writes per second per partition key.
+  """
+
+  def __init__(self, latency, key_write_limit):
+    self.latency = latency
+    self.write_limiter = FixedWindowLimiter(key_write_limit)
+    self.writes = Counter()
+    self.throttled = Counter()
+    self.lock = threading.Lock()
+
+  def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeValues, ReturnValues):
+    time.sleep(self.latency)
+    geofence_id = Key['id']['S']
+
+    if not self.write_limiter.allow(geofence_id):
+      with self.lock:
+        self.throttled[geofence_id] += 1
+      raise throttle('ProvisionedThroughputExceededException', 'UpdateItem')
+
+    with self.lock:
+      self.writes[geofence_id] += 1
+      visits = self.writes[geofence_id]
+
+    return {'Attributes': {'visits': {'N': str(visits)}}, 'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+def drive(events, pinpoint, dynamodb, concurrency, speedup):
+  """
+  Invokes sendMessage for every enter event from a thread pool, paced at speedup times the simulated time, as fast as
+  possible when speedup is 0. Returns the responses, the latencies in milliseconds and the wall time.
+  """
+
+  with open(os.devnull, 'w') as devnull:
+    stdout = sys.stdout
+    sys.stdout = devnull
+    try:
+      import sendMessage
+    finally:
+      sys.stdout = stdout
+
+  sendMessage.boto3 = types.SimpleNamespace(client = lambda service_name: pinpoint if service_name == 'pinpoint' else dynamodb)
+  sendMessage.print = lambda *args, **kwargs: None
+  os.environ.setdefault('DBB_TABLE_NAME', 'simulated-geofences')
+
+  def invoke(at, device_id, geofence_id):
+    simulated.now = at
+    started = time.perf_counter()
+    response = sendMessage.handler({
+      'arguments': {
+        'input': {
+          'applicationId': 'simulated-application',
+          'geofenceId': geofence_id,
+          'userId': device_id
+        }
+      }
+    }, None)
+    return response, (time.perf_counter() - started) * 1000
+
+  responses = []
+  latencies = []
+  pending = set()
+
+  def record(done):
+    for future in done:
+      response, latency = future.result()
+      responses.append(response)
+      latencies.append(latency)
+
+  started = time.time()
+  with ThreadPoolExecutor(max_workers = concurrency) as executor:
+    for at, device_id, geofence_id in events:
+      if speedup:
+        delay = started + at / speedup - time.time()
+        if delay > 0:
+          time.sleep(delay)
+
+      if len(pending) >= concurrency * 2:
+        done, pending = wait(pending, return_when = FIRST_COMPLETED)
+        record(done)
+
+      pending.add(executor.submit(invoke, at, device_id, geofence_id))
+
+    record(pending)
+
+  return responses, latencies, time.time() - started
+
+def get_outcome(response):
+  """
+  Returns the outcome of a sendMessage response: its status, with the error code for the failures.
+  """
+
+  if response['status'] == 'MESSAGE_SENT':
+    return 'MESSAGE_SENT'
+
+  match = error_code_pattern.search(response['message'])
+  return f"MESSAGE_NOT_SENT {match.group(1) if match else response['message'].split(':')[0]}"
+
+def percentile(sorted_values, fraction):
+  """
+  Returns the nearest-rank percentile of sorted values.
+  """
+
+  return sorted_values[min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))]
+
+def print_report(events, crossings, suppressed, duration, responses, latencies, wall_time, dynamodb, top):
+  """
+  Prints the rates, throughput, outcomes and hot keys of the simulation.
+  """
+
+  per_second = Counter(int(at) for at, _, _ in events)
+  rates = sorted(per_second.get(second, 0) for second in range(int(duration) + 1))
+
+  print(f'{crossings} geofence enters, {suppressed} suppressed by the cooldown ({100 * suppressed / max(crossings, 1):.1f}%), {len(events)} sendMessage calls')
+  if rates:
+    print(f'simulated enter events per second: mean {len(events) / max(duration, 1):.1f}  p99 {percentile(rates, 0.99)}  peak {rates[-1]}')
+
+  if not latencies:
+    return
+
+  latencies.sort()
+  print(f'{len(responses)} calls in {wall_time:.1f} s: {len(responses) / wall_time:.0f} calls/s, latency p50 {percentile(latencies, 0.5):.2f}  p99 {percentile(latencies, 0.99):.2f}  max {latencies[-1]:.2f} ms')
+
+  outcomes = Counter(get_outcome(response) for response in responses)
+  for outcome, count in outcomes.most_common():
+    print(f'  {outcome:56} {count:8} {100 * count / len(responses):6.2f}%')
+
+  total_writes = sum(dynamodb.writes.values()) + sum(dynamodb.throttled.values())
+  peaks = dynamodb.write_limiter.peaks()
+  print(f'hottest geofence items ({total_writes} writes):')
+  for geofence_id, _ in (dynamodb.writes + dynamodb.throttled).most_common(top):
+    writes = dynamodb.writes[geofence_id] + dynamodb.throttled[geofence_id]
+    print(f'  {geofence_id:36} {writes:8} writes {100 * writes / total_writes:6.2f}%  peak {peaks[geofence_id]:5}/s  throttled {dynamodb.throttled[geofence_id]}')
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Simulates a fleet of devices entering geofences and drives sendMessage with their enter events')
+  parser.add_argument('--devices', type = int, default = 1000)
+  parser.add_argument('--duration', type = float, default = 3600, help = 'simulated seconds')
+  parser.add_argument('--tick', type = float, default = 5, help = 'seconds between two positions of a device')
+  parser.add_argument('--traces', help = 'CSV file of deviceId,timestamp,latitude,longitude GPS traces, instead of the random walk')
+  parser.add_argument('--layout', help = 'GeoJSON or NDJSON geofences export, instead of the random layout')
+  parser.add_argument('--geofences', type = int, default = 50, help = 'number of geofences of the random layout')
+  parser.add_argument('--center', default = f'{default_center[0]},{default_center[1]}', help = 'latitude,longitude of the venue')
+  parser.add_argument('--area', type = float, default = 3000, help = 'side in meters of the square area of the random walk and layout')
+  parser.add_argument('--min-radius', type = float, default = 50)
+  parser.add_argument('--max-radius', type = float, default = 300)
+  parser.add_argument('--venue', default = 'venue', help = 'geofence id the devices of the venue share head to')
+  parser.add_argument('--venue-radius', type = float, default = 400)
+  parser.add_argument('--venue-share', type = float, default = 0.3, help = 'fraction of the devices heading to the venue')
+  parser.add_argument('--cooldown', type = float, default = 300, help = 'seconds before a new enter of the same geofence is notified')
+  parser.add_argument('--key-write-limit', type = int, default = 1000, help = 'writes per second of a geofence item, 0 for no limit')
+  parser.add_argument('--send-limit', type = int, default = 20000, help = 'Pinpoint messages per second, 0 for no limit')
+  parser.add_argument('--missing-endpoint-rate', type = float, default = 0.0, help = 'fraction of the devices without endpoint')
+  parser.add_argument('--latency', type = float, default = 0, help = 'milliseconds of every stand-in call')
+  parser.add_argument('--concurrency', type = int, default = 8)
+  parser.add_argument('--speedup', type = float, default = 0, help = 'pace of the calls relative to the simulated time, 0 for as fast as possible')
+  parser.add_argument('--top', type = int, default = 10, help = 'number of hot geofence items printed')
+  parser.add_argument('--seed', type = int, default = 1)
+  args = parser.parse_args()
+
+  rng = random.Random(args.seed)
+  center = tuple(float(value) for value in args.center.split(','))
+
+  if args.layout:
+    geofences = read_layout(args.layout, args.min_radius)
+  else:
+    geofences = create_layout(rng, args.geofences, center, args.area, args.min_radius, args.max_radius, args.venue_radius)
+
+  if args.traces:
+    positions = list(read_traces(args.traces))
+    duration = positions[-1][0] if positions else 0
+  else:
+    venue = next((geofence for geofence in geofences if geofence.id == args.venue), None)
+    if venue is None:
+      sys.exit(f'Venue geofence {args.venue} not found in the layout')
+    positions = sorted(walk_devices(rng, args.devices, args.duration, args.tick, center, args.area, venue, args.venue_share))
+    duration = args.duration
+
+  grid = GeofenceGrid(geofences)
+  events, suppressed = generate_enter_events(positions, grid, args.cooldown)
+  print(f'{len(geofences)} geofences, {len({position[1] for position in positions})} devices, {duration:.0f} simulated seconds')
+
+  pinpoint = PinpointStandIn(random.Random(args.seed), args.latency / 1000, args.send_limit, args.missing_endpoint_rate)
+  dynamodb = DynamoDBStandIn(args.latency / 1000, args.key_write_limit)
+
+  responses, latencies, wall_time = drive(events, pinpoint, dynamodb, args.concurrency, args.speedup) if events else ([], [], 0)
+  print_report(events, len(events) + suppressed, suppressed, duration, responses, latencies, wall_time, dynamodb, args.top)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,92 @@
+"""
+  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved
+
+  Licensed under the MIT No Attribution License (MIT-0) (the ‘License’). You may not use this file except in compliance
+  with the License. A copy of the License is located at
+
+      https://opensource.org/licenses/MIT-0
+
+  Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files 
+  (the “Software”), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, 
+  publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so.
+  THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR 
+  ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH 
+  THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.    
+"""
+
+
+import unittest
+from unittest.mock import Mock, patch
+
+import hashlib
+import websiteDeploy
+
+class TestWebsiteDeploy(unittest.TestCase):
+  """
+  Test class for the WebSiteCustomResourceLambda function
+  """
+
+  @patch('websiteDeploy.s3')
+  def test_upload_files_with_changed_headers(self, mock_s3):
+    """
+    Test when the unchanged files are skipped, and a file with the same content but other headers is uploaded again
+    """
+
+    css_content = b'body { margin: 0; }'
+    html_content = b'<html></html>'
+    s3_client = mock_s3.meta.client
+
+    s3_client.get_paginator().paginate.return_value = [{
+      'Contents': [
+        {'Key': 'index.html', 'ETag': '"{}"'.format(hashlib.md5(html_content).hexdigest())},
+        {'Key': 'static/css/main.0123abcd.css', 'ETag': '"{}"'.format(hashlib.md5(css_content).hexdigest())}
+      ]
+    }]
+
+    deployed_headers = {
+      'index.html': {'ContentType': 'text/html', 'CacheControl': websiteDeploy.short_cache_control},
+      'static/css/main.0123abcd.css': {'ContentType': 'text/css', 'CacheControl': websiteDeploy.short_cache_control}
+    }
+    s3_client.head_object.side_effect = lambda Bucket, Key: deployed_headers[Key]
+
+    replaced_files = websiteDeploy.upload_files('website-bucket', iter([
+      ('index.html', html_content),
+      ('static/css/main.0123abcd.css', css_content),
+      ('favicon.ico', b'icon')
+    ]))
+
+    self.assertEqual(replaced_files, ['static/css/main.0123abcd.css'])
+    uploaded = {call[1]['Key']: call[1] for call in s3_client.put_object.call_args_list}
+    self.assertEqual(sorted(uploaded), ['favicon.ico', 'static/css/main.0123abcd.css'])
+    self.assertEqual(uploaded['static/css/main.0123abcd.css']['CacheControl'], websiteDeploy.immutable_cache_control)
+
+  @patch('boto3.client')
+  def test_invalidate_index_html(self, mock_client):
+    """
+    Test when index.html is replaced and the default root object is invalidated with it
+    """
+
+    mock_client().create_invalidation.return_value = {'Invalidation': {'Id': 'some-invalidation'}}
+
+    self.assertTrue(websiteDeploy.invalidate_distribution({'RequestId': 'some-request'}, None, 'some-distribution', ['index.html', 'static/js/main.js']))
+
+    paths = mock_client().create_invalidation.call_args[1]['InvalidationBatch']['Paths']
+    self.assertEqual(paths, {'Quantity': 3, 'Items': ['/', '/index.html', '/static/js/main.js']})
+
+  @patch('boto3.client')
+  def test_invalidate_too_many_paths(self, mock_client):
+    """
+    Test when more objects than max_invalidation_paths are replaced and the whole distribution is invalidated
+    """
+
+    mock_client().create_invalidation.return_value = {'Invalidation': {'Id': 'some-invalidation'}}
+    file_keys = [f'static/media/image-{index}.png' for index in range(websiteDeploy.max_invalidation_paths + 1)]
+
+    self.assertTrue(websiteDeploy.invalidate_distribution({'RequestId': 'some-request'}, None, 'some-distribution', file_keys))
+
+    paths = mock_client().create_invalidation.call_args[1]['InvalidationBatch']['Paths']
+    self.assertEqual(paths, {'Quantity': 1, 'Items': ['/*']})
+
+if __name__ == '__main__':
+    unittest.main()
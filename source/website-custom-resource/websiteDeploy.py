@@ -19,24 +19,63 @@
 Custom resource function to be invoked by the CloudFormation stack in oder to deploy the administrator website.
 
 This function deploys the administrator website into a S3 bucket configured as a website in the Create event. For
-the Delete event, the function cleans up the website bucket to be removed by the CloudFormation stack.
+the Delete event, the function cleans up the website bucket to be removed by the CloudFormation stack. The Update event
+deploys the website again, and only the objects it replaced are invalidated on the CloudFront distribution.
 
-This custom resource will be processed only for the Create and Delete events.
+The website files are read straight from the website-contents.zip object in the origin bucket, with ranged GET requests,
+without extracting it to the Lambda tmp directory. They are uploaded concurrently by a bounded thread pool, and only the
+ones whose content or headers differ from the object already in the website bucket are uploaded.
+
+Compressible files are stored gzip compressed with their Content-Encoding, and every file gets a Cache-Control header:
+files with a content hash in their name are cached for a year as immutable, the other ones (index.html, and the
+main*.js files whose content changes with the replaced placeholders) only for a minute.
 """
 
+import io
+import re
 import json
 import os
+import gzip
+import time
 import boto3
+import posixpath
+import hashlib
 import zipfile
 import cfnResponse 
 import mimetypes
+from urllib.parse import quote
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 s3 = boto3.resource('s3')
 
+default_upload_concurrency = 16
+# size of the ranged GET requests reading the website zip
+read_buffer_size = 4 * 1024 * 1024
+
+immutable_cache_control = 'public, max-age=31536000, immutable'
+short_cache_control = 'public, max-age=60'
+# build file names carrying a content hash, such as static/js/main.1a2b3c4d.chunk.js
+hashed_file_pattern = re.compile(r'\.[0-9a-f]{8,}\.')
+compressible_mime_types = {
+  'application/javascript',
+  'application/json',
+  'application/manifest+json',
+  'application/xml',
+  'image/svg+xml',
+  'image/vnd.microsoft.icon',
+  'image/x-icon'
+}
+# smaller files are not worth compressing
+min_compress_size = 1024
+# headers of the website objects, compared with the ones of the deployed objects before skipping an upload
+object_headers = ['ContentType', 'CacheControl', 'ContentEncoding']
+# above this number of replaced objects, the whole distribution is invalidated with a wildcard path
+max_invalidation_paths = 30
+
 def handler(event, context):
   """
-  Main handler to control wether to process the Custom Resource in the event of a stack creation or deletion.
+  Main handler to control wether to process the Custom Resource in the event of a stack creation, update or deletion.
   """
 
   print('request: {}'.format(json.dumps(event, indent = 4)))
@@ -48,9 +87,10 @@ def handler(event, context):
   print('Bucket Origin: ' + origin_bucket)
   print('Bucket Prefix: ' + origin_prefix)
   print('Bucket Target: ' + website_bucket)
+  print('Website Build: ' + requests.get('websiteHash', 'unknown'))
 
-  if event['RequestType'] == 'Create':
-    print('Creating the Stack...')
+  if event['RequestType'] == 'Create' or event['RequestType'] == 'Update':
+    print(f"{'Creating' if event['RequestType'] == 'Create' else 'Updating'} the Stack...")
     aws_resources = {
       'aws_region': os.environ['REGION'],
       'user_pool_id': requests['userPoolId'],
@@ -60,28 +100,41 @@ def handler(event, context):
       'appsync_endpoint': requests['appSyncEndpoint']
     }        
 
-    content, content_to_replace = get_website_content_from_origin_bucket(
+    website_zip, content, content_to_replace = get_website_content_from_origin_bucket(
       event = event,
       context = context,
       origin_bucket = origin_bucket,
       origin_prefix = origin_prefix
     )
 
-    deploy_website_to_target_bucket(
+    replaced_files = deploy_website_to_target_bucket(
       event = event,
       context = context,
       target_bucket = website_bucket,
+      website_zip = website_zip,
       files = content
     )
 
-    replace_aws_resources(
+    replaced_files_with_resources = replace_aws_resources(
       event = event,
       context = context,
       target_bucket = website_bucket,
+      website_zip = website_zip,
       files = content_to_replace,
       aws_resources = aws_resources
     )
 
+    website_zip.close()
+
+    # the failure was already sent to CloudFormation
+    if replaced_files is None or replaced_files_with_resources is None:
+      return
+
+    replaced_files += replaced_files_with_resources
+    if replaced_files and requests.get('distributionId'):
+      if not invalidate_distribution(event, context, requests['distributionId'], replaced_files):
+        return
+
     cfnResponse.send(event, context, cfnResponse.SUCCESS, {}, "CustomResourcePhysicalID")
 
   elif event['RequestType'] == 'Delete':  
@@ -107,109 +160,216 @@ def handler(event, context):
     except ClientError as ex:     
       print(f'Target Bucket {website_bucket} with error: {ex}')    
       cfnResponse.send(event, context, cfnResponse.FAILED, {}, "CustomResourcePhysicalID")  
-    '''   
-
-  else:
-    print('Updating Stack. <No implementation>')   
-    cfnResponse.send(event, context, cfnResponse.SUCCESS, {}, "CustomResourcePhysicalID") 
+    '''
 
-def replace_aws_resources(event, context, target_bucket, files, aws_resources):
+def replace_aws_resources(event, context, target_bucket, website_zip, files, aws_resources):
   """
-  Replace all placeholders at deployment time with the newly created resources. Then sends the files
-  to the S3 website bucket
+  Replace all placeholders at deployment time with the newly created resources, in a single pass over each file. Then
+  sends the files to the S3 website bucket and returns the keys of the objects they replaced, None on failure.
   """
 
   print(f'Setting up AWS resources to the admin website')
-  
-  try:    
+
+  replace_placeholders = create_placeholder_replacer({
+    'REPLACE_AWS_REGION': aws_resources['aws_region'],
+    'REPLACE_USER_POOL_ID': aws_resources['user_pool_id'],
+    'REPLACE_APP_CLIENT_ID': aws_resources['app_client_id'],
+    'REPLACE_IDENTITY_POOL_ID': aws_resources['identity_pool_id'],
+    'REPLACE_PINPOINT_APP_ID': aws_resources['pinpoint_app_id'],
+    'REPLACE_APPSYNC_ENDPOINT': aws_resources['appsync_endpoint']
+  })
+
+  def read_files():
     for webSiteFile in files:
-      with open(webSiteFile) as f:
-        content = f.read()
-      
-      content = content.replace("REPLACE_AWS_REGION", aws_resources['aws_region'])
-      content = content.replace("REPLACE_USER_POOL_ID", aws_resources['user_pool_id'])
-      content = content.replace("REPLACE_APP_CLIENT_ID", aws_resources['app_client_id'])
-      content = content.replace("REPLACE_IDENTITY_POOL_ID", aws_resources['identity_pool_id'])
-      content = content.replace("REPLACE_PINPOINT_APP_ID", aws_resources['pinpoint_app_id'])
-      content = content.replace("REPLACE_APPSYNC_ENDPOINT", aws_resources['appsync_endpoint'])
-
-      encoded_string = content.encode("utf-8")      
-      website_key = os.path.relpath(webSiteFile, '/tmp/website-contents')    
-      guessed_mime_type = mimetypes.guess_type(webSiteFile)
-      
-      if website_key.startswith('../'):
-        file_key = website_key[len('../'):]
-      else:
-        file_key = website_key
-      
-      if guessed_mime_type is None:
-        raise Exception("Failed to guess mimetype")
-        
-      mime_type = guessed_mime_type[0]  
-      
-      if mime_type is None:
-        mime_type = 'binary/octet-stream'
-        
-      s3.Bucket(target_bucket).put_object(
-        Key=file_key, 
-        Body=encoded_string,
-        ContentType=mime_type
-      )
-
-      print(f'{file_key} uploaded to {target_bucket}')
-
-    print(f'AWS Resources set and deployed successfully to {target_bucket} bucket')  
+      yield webSiteFile.filename, replace_placeholders(website_zip.read(webSiteFile))
+
+  try:    
+    replaced_files = upload_files(target_bucket, read_files(), immutable = False)
+    print(f'AWS Resources set and deployed successfully to {target_bucket} bucket')
+    return replaced_files
   except ClientError as ex:     
     print(f'Target Bucket {target_bucket} with error: {ex}')  
     cfnResponse.send(event, context, cfnResponse.FAILED, {}, "CustomResourcePhysicalID")  
 
-def deploy_website_to_target_bucket(event, context, target_bucket, files):
+def deploy_website_to_target_bucket(event, context, target_bucket, website_zip, files):
   """
-  Deploys the website files into the S3 website bucket
+  Deploys the website files into the S3 website bucket and returns the keys of the objects they replaced, None on
+  failure.
   """
 
   print(f'Starting admin website deployment to {target_bucket} bucket')
 
-  try:    
+  def read_files():
     for webSiteFile in files:
-      with open(webSiteFile) as f:
-        content = f.read()
-
-      encoded_string = content.encode("utf-8")
-      website_key = os.path.relpath(webSiteFile, '/tmp/website-contents')   
-      guessed_mime_type = mimetypes.guess_type(webSiteFile)
-      
-      if website_key.startswith('../'):
-        file_key = website_key[len('../'):]
-      else:
-        file_key = website_key
-        
-      print('Key being uploaded to S3: ' + file_key)
-
-      if guessed_mime_type is None:
-        raise Exception("Failed to guess mimetype")
-        
-      mime_type = guessed_mime_type[0]  
-      
-      if mime_type is None:
-        mime_type = 'binary/octet-stream'
-      
-      s3.Bucket(target_bucket).put_object(
-        Key=file_key, 
-        Body=encoded_string,
-        ContentType=mime_type
-      )
+      yield webSiteFile.filename, website_zip.read(webSiteFile)
 
-      print(f'{file_key} uploaded to {target_bucket}')
-
-    print(f'Admin website deployed successfully to {target_bucket} bucket')  
+  try:    
+    replaced_files = upload_files(target_bucket, read_files())
+    print(f'Admin website deployed successfully to {target_bucket} bucket')
+    return replaced_files
   except ClientError as ex:     
     print(f'Target Bucket {target_bucket} with error: {ex}')    
     cfnResponse.send(event, context, cfnResponse.FAILED, {}, "CustomResourcePhysicalID")  
-    
+
+def create_placeholder_replacer(placeholders):
+  """
+  Returns a function replacing all the placeholders of a file content in one pass.
+  """
+
+  values = {placeholder.encode('utf-8'): value.encode('utf-8') for placeholder, value in placeholders.items()}
+  pattern = re.compile(b'|'.join(re.escape(placeholder) for placeholder in values))
+
+  return lambda content: pattern.sub(lambda match: values[match.group(0)], content)
+
+def upload_files(target_bucket, files, immutable = True):
+  """
+  Uploads the (key, content) pairs to the S3 website bucket with a bounded thread pool, skipping the files whose MD5
+  matches the ETag of the object already in the bucket and whose headers are unchanged. Returns the keys of the uploaded
+  files that replaced an existing object, the only ones CloudFront may have cached.
+
+  The ETag of an object is the MD5 of its content when it was uploaded in a single part and encrypted with SSE-S3, as
+  the website bucket objects are, so it is compared to the MD5 of the compressed content. The headers of the objects
+  with the same content are then read with a HEAD request, so a changed Cache-Control or Content-Encoding is applied.
+  At most twice as many files as threads are kept in memory waiting to be uploaded. Hashed file names are cached as
+  immutable unless immutable is False.
+  """
+
+  s3_client = s3.meta.client
+  existing_etags = get_object_etags(s3_client, target_bucket)
+  max_workers = int(os.environ.get('UPLOAD_CONCURRENCY', default_upload_concurrency))
+
+  uploaded = []
+  pending = set()
+
+  def upload_file(file_key, content):
+    put_args = create_put_args(file_key, content, immutable)
+
+    if existing_etags.get(file_key) == hashlib.md5(put_args['Body']).hexdigest():
+      response_head = s3_client.head_object(Bucket=target_bucket, Key=file_key)
+      if all(response_head.get(header) == put_args.get(header) for header in object_headers):
+        return None
+
+    s3_client.put_object(Bucket=target_bucket, Key=file_key, **put_args)
+    print(f'{file_key} uploaded to {target_bucket}')
+    return file_key
+
+  def record_uploads(done):
+    uploaded.extend(file_key for file_key in (future.result() for future in done) if file_key)
+
+  count = 0
+  with ThreadPoolExecutor(max_workers = max_workers) as executor:
+    for file_key, content in files:
+      if len(pending) >= max_workers * 2:
+        done, pending = wait(pending, return_when = FIRST_COMPLETED)
+        record_uploads(done)
+
+      # the compression runs in the pool as well, zlib releases the GIL
+      pending.add(executor.submit(upload_file, file_key, content))
+      count += 1
+
+    record_uploads(pending)
+
+  print(f'{len(uploaded)} files uploaded to {target_bucket}, {count - len(uploaded)} unchanged files skipped')
+  return [file_key for file_key in uploaded if file_key in existing_etags]
+
+def invalidate_distribution(event, context, distribution_id, file_keys):
+  """
+  Invalidates the paths of the replaced website objects on the CloudFront distribution, or every path when there are
+  too many of them. Returns False, after sending the failure to CloudFormation, when the invalidation can not be created.
+  """
+
+  paths = sorted({'/' + quote(file_key) for file_key in file_keys})
+
+  # index.html is also served as the default root object
+  if '/index.html' in paths:
+    paths.insert(0, '/')
+
+  if len(paths) > max_invalidation_paths:
+    paths = ['/*']
+
+  try:
+    response_invalidation = boto3.client('cloudfront').create_invalidation(
+      DistributionId = distribution_id,
+      InvalidationBatch = {
+        'Paths': {
+          'Quantity': len(paths),
+          'Items': paths
+        },
+        'CallerReference': f"{event['RequestId']}-{int(time.time())}"
+      }
+    )
+
+    print(f"Invalidation {response_invalidation['Invalidation']['Id']} of {len(paths)} paths created on distribution {distribution_id}")
+    return True
+
+  except ClientError as ex:
+    print(f'Distribution {distribution_id} with error: {ex}')
+    cfnResponse.send(event, context, cfnResponse.FAILED, {}, "CustomResourcePhysicalID")
+    return False
+
+def create_put_args(file_key, content, immutable):
+  """
+  Returns the body and headers of a website file, gzip compressed when it is worth it.
+  """
+
+  mime_type = get_mime_type(file_key)
+
+  put_args = {
+    'Body': content,
+    'ContentType': mime_type,
+    'CacheControl': immutable_cache_control if immutable and hashed_file_pattern.search(posixpath.basename(file_key)) else short_cache_control
+  }
+
+  if len(content) >= min_compress_size and (mime_type.startswith('text/') or mime_type in compressible_mime_types or file_key.endswith('.map')):
+    compressed = gzip_compress(content)
+
+    if len(compressed) < len(content):
+      put_args['Body'] = compressed
+      put_args['ContentEncoding'] = 'gzip'
+
+  return put_args
+
+def gzip_compress(content):
+  """
+  Compresses the content with gzip. The header timestamp is left empty, so the same content always gives the same bytes
+  and the same ETag.
+  """
+
+  buffer = io.BytesIO()
+  with gzip.GzipFile(fileobj = buffer, mode = 'wb', compresslevel = 9, mtime = 0) as gzip_file:
+    gzip_file.write(content)
+
+  return buffer.getvalue()
+
+def get_object_etags(s3_client, target_bucket):
+  """
+  Returns the ETag of every object of the S3 website bucket, without the surrounding quotes.
+  """
+
+  etags = {}
+
+  for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=target_bucket):
+    for obj in page.get('Contents', []):
+      etags[obj['Key']] = obj['ETag'].strip('"')
+
+  return etags
+
+def get_mime_type(file_key):
+  """
+  Returns the content type of a website file, binary/octet-stream when it can not be guessed.
+  """
+
+  mime_type = mimetypes.guess_type(file_key)[0]
+
+  if mime_type is None:
+    mime_type = 'binary/octet-stream'
+
+  return mime_type
+
 def get_website_content_from_origin_bucket(event, context, origin_bucket, origin_prefix):
   """
-  Gets the website raw content and stores in the Lambda tmp directory to be processed
+  Opens the website zip in the origin bucket, read through ranged GET requests, and returns it with the entries to
+  deploy as they are and the main*.js entries holding the placeholders to replace.
   """
 
   print(f'Getting website files from {origin_bucket} bucket')
@@ -217,35 +377,85 @@ def get_website_content_from_origin_bucket(event, context, origin_bucket, origin
   try:
     key = 'website-contents.zip'
     full_key = origin_prefix + key
-    tmp_dir = '/tmp/'
-    local_file_name = tmp_dir + key
-
-    s3.Bucket(origin_bucket).download_file(full_key, local_file_name)
-    print(f'File {key} downloaded to {local_file_name}')
 
-    print(f'Extracting file {key} to {tmp_dir}')
-    with zipfile.ZipFile(local_file_name, 'r') as zip_ref:
-      zip_ref.extractall(tmp_dir)
-
-    print(f'Deleting {local_file_name}')
-    os.remove(local_file_name)
+    website_zip = zipfile.ZipFile(io.BufferedReader(
+      S3RangeReader(s3.meta.client, origin_bucket, full_key),
+      buffer_size = read_buffer_size
+    ))
+    print(f'File {key} opened from {origin_bucket}')
 
     files = []
     files_to_replace = []
 
-    for r, d, f in os.walk(tmp_dir):
-      for file in f:
-        if file.startswith('main') and all(x in file for x in 'js') and '.ico' not in file:
-          files_to_replace.append(os.path.join(r, file))  
-        elif '.ico' not in file:
-          files.append(os.path.join(r, file))
+    for entry in website_zip.infolist():
+      if entry.is_dir():
+        continue
+
+      file_name = posixpath.basename(entry.filename)
+      if file_name.startswith('main') and file_name.endswith('.js'):
+        files_to_replace.append(entry)
+      else:
+        files.append(entry)
     
-    return files, files_to_replace
+    return website_zip, files, files_to_replace
       
   except ClientError as ex:     
     print(f'Origin Bucket {origin_bucket} with error: {ex}')  
     cfnResponse.send(event, context, cfnResponse.FAILED, {}, "CustomResourcePhysicalID")  
 
+class S3RangeReader(io.RawIOBase):
+  """
+  Read-only, seekable file object over an Amazon S3 object, each read being a ranged GET request. Wrapped in a
+  BufferedReader, it lets ZipFile read the entries it needs without downloading the whole object.
+  """
+
+  def __init__(self, s3_client, bucket, key):
+    self.s3_client = s3_client
+    self.bucket = bucket
+    self.key = key
+    self.size = s3_client.head_object(Bucket = bucket, Key = key)['ContentLength']
+    self.position = 0
+
+  def readable(self):
+    return True
+
+  def seekable(self):
+    return True
+
+  def tell(self):
+    return self.position
+
+  def seek(self, offset, whence = io.SEEK_SET):
+    if whence == io.SEEK_SET:
+      self.position = offset
+    elif whence == io.SEEK_CUR:
+      self.position += offset
+    elif whence == io.SEEK_END:
+      self.position = self.size + offset
+    else:
+      raise ValueError(f'Invalid whence {whence}')
+
+    return self.position
+
+  def readinto(self, buffer):
+    """
+    Reads the next bytes of the object into the buffer with a ranged GET request.
+    """
+
+    if self.position >= self.size or len(buffer) == 0:
+      return 0
+
+    end = min(self.position + len(buffer), self.size) - 1
+    content = self.s3_client.get_object(
+      Bucket = self.bucket,
+      Key = self.key,
+      Range = f'bytes={self.position}-{end}'
+    )['Body'].read()
+
+    buffer[:len(content)] = content
+    self.position += len(content)
+    return len(content)
+
 def is_bucket_empty(bucket):
   """
   Returns true if the S3 website bucket is empty, false otherwise